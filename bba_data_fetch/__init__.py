@@ -1,11 +1,22 @@
 """
 Version corresponding to the git version tag
 """
-from pkg_resources import get_distribution, DistributionNotFound
 from bba_data_fetch import __name__
 
 try:
-    __version__ = get_distribution(__name__).version
-except DistributionNotFound:
-    # package is not installed
-    pass
+    # importlib.metadata (python>=3.8) is much faster to import than pkg_resources
+    from importlib.metadata import version, PackageNotFoundError
+except ImportError:
+    from pkg_resources import get_distribution, DistributionNotFound
+
+    try:
+        __version__ = get_distribution(__name__).version
+    except DistributionNotFound:
+        # package is not installed
+        pass
+else:
+    try:
+        __version__ = version(__name__)
+    except PackageNotFoundError:
+        # package is not installed
+        pass
@@ -0,0 +1,153 @@
+"""
+Read the manifest of a batch of fetches. A manifest is a JSON, YAML or CSV file
+listing several fetches, each of them being described with the same options as the
+command line (--nexus-id or --filter, --out, --favor, --payload, --keep-meta, --rev
+and --tag).
+
+A JSON/YAML manifest is either a list of entries or a dictionary with the list of
+entries under the key "fetches":
+    [
+        {"nexus-id": "https://some/id", "out": "./tmp/annotation.nrrd"},
+        {"filter": ["type=CellPositions", "brainLocation.brainRegion=mba:1048"],
+         "out": "./tmp/positions.json", "payload": true}
+    ]
+
+A CSV manifest has one entry per row, the header giving the option names. The
+multi-valued options (filter and favor) are space separated, with the shell quoting
+rules:
+    nexus-id,filter,out,payload
+    https://some/id,,./tmp/annotation.nrrd,
+    ,type=CellPositions 'atlasRelease.name=Allen Mouse CCF v2',./tmp/p.json,true
+"""
+
+import os
+import csv
+import copy
+import json
+import shlex
+
+# manifest keys (with "-" or "_") and their equivalent in the argparse namespace
+MANIFEST_KEYS = {
+    "nexus_id": "nexus_id",
+    "id": "nexus_id",
+    "filter": "filter",
+    "out": "out",
+    "favor": "favor",
+    "payload": "payload",
+    "keep_meta": "keep_meta",
+    "rev": "nexus_rev",
+    "tag": "nexus_tag",
+}
+
+LIST_KEYS = ["filter", "favor"]
+BOOLEAN_KEYS = ["payload", "keep_meta"]
+
+
+def toBoolean(value):
+    """Interpret a manifest value (possibly a string from a CSV) as a boolean"""
+    if isinstance(value, str):
+        return value.strip().lower() in ["true", "yes", "1", "y"]
+    return bool(value)
+
+
+def normalizeEntry(raw_entry, position):
+    """Convert a raw manifest entry into a dictionary using the argparse namespace
+    names, and check its consistency
+
+    Args:
+      raw_entry (dict): the entry as written in the manifest
+      position (int): the position of the entry in the manifest (for error messages)
+
+    Returns:
+      dict: the entry with argparse namespace keys
+    """
+    if not isinstance(raw_entry, dict):
+        raise ValueError(f"the entry #{position} is not a dictionary")
+
+    entry = {}
+    for raw_key, value in raw_entry.items():
+        key = raw_key.strip().lower().lstrip("-").replace("-", "_")
+        if key not in MANIFEST_KEYS:
+            raise ValueError(f"unknown key '{raw_key}' in the entry #{position}")
+
+        # empty CSV cells are equivalent to a missing key
+        if value is None or value == "":
+            continue
+
+        if key in LIST_KEYS and isinstance(value, str):
+            value = shlex.split(value)
+        elif key in BOOLEAN_KEYS:
+            value = toBoolean(value)
+
+        entry[MANIFEST_KEYS[key]] = value
+
+    if not entry.get("out"):
+        raise ValueError(f"the entry #{position} has no 'out'")
+
+    if bool(entry.get("nexus_id")) == bool(entry.get("filter")):
+        raise ValueError(
+            f"the entry #{position} must have either a 'nexus-id' or a 'filter'"
+        )
+
+    return entry
+
+
+def readManifest(manifest_path):
+    """Read and check a manifest file. The format is guessed from the extension
+    (.json, .yml/.yaml or .csv)
+
+    Args:
+      manifest_path (string): path to the manifest
+
+    Returns:
+      [dict]: the list of entries, using the argparse namespace names as keys
+    """
+    extension = os.path.splitext(manifest_path)[1].lower()
+
+    with open(manifest_path, "r", newline="") as f:
+        if extension == ".json":
+            raw_entries = json.load(f)
+        elif extension in [".yml", ".yaml"]:
+            import yaml
+
+            raw_entries = yaml.safe_load(f)
+        elif extension == ".csv":
+            raw_entries = list(csv.DictReader(f))
+        else:
+            raise ValueError(
+                f"unsupported manifest extension '{extension}' (must be .json, "
+                ".yml, .yaml or .csv)"
+            )
+
+    if isinstance(raw_entries, dict):
+        raw_entries = raw_entries.get("fetches")
+
+    if not isinstance(raw_entries, list):
+        raise ValueError("the manifest must contain a list of fetches")
+
+    return [normalizeEntry(e, i) for i, e in enumerate(raw_entries)]
+
+
+def entryArgs(args, entry):
+    """Build the namespace of a single fetch of the batch. The options that are not
+    specified in the entry are inherited from the command line.
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+      entry (dict): an entry returned by readManifest
+
+    Returns:
+      :obj:`argparse.Namespace`: the parameters namespace of this fetch
+    """
+    entry_args = copy.copy(args)
+    entry_args.manifest = None
+    entry_args.nexus_id = None
+    entry_args.filter = None
+
+    for key, value in entry.items():
+        # in the namespace, keep_meta is False when the metadata must be kept
+        if key == "keep_meta":
+            value = not value
+        setattr(entry_args, key, value)
+
+    return entry_args
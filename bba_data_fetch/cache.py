@@ -0,0 +1,268 @@
+"""
+Local caches. The distribution files are stored in a content-addressed cache, by the
+digest Nexus computed for them, so that a file already fetched (by any resource, in
+any run) is served from the disk instead of being downloaded again. Alongside, small
+JSON entries (eg. the JSON-LD context used to translate the filters) are kept to save
+some requests to Nexus.
+
+The cache directory is given with --cache-dir or with the environment variable
+BBA_DATA_FETCH_CACHE_DIR. The size of the cache, distribution files and JSON entries
+together, can be capped (--cache-max-size or BBA_DATA_FETCH_CACHE_MAX_SIZE), in which
+case the least recently used files are evicted.
+"""
+
+import os
+import re
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+
+CACHE_DIR_ENV = "BBA_DATA_FETCH_CACHE_DIR"
+CACHE_MAX_SIZE_ENV = "BBA_DATA_FETCH_CACHE_MAX_SIZE"
+
+OBJECTS_DIR = "objects"
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parseSize(size):
+    """Convert a human readable size (eg. '500M', '20G', '1.5T' or a number of bytes)
+    into a number of bytes
+
+    Args:
+      size (string): the size to convert
+
+    Returns:
+      int: the number of bytes, or None if no size is given
+    """
+    if size is None or size == "":
+        return None
+
+    matches = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", str(size), re.I)
+    if not matches:
+        raise ValueError(f"invalid size '{size}' (example of valid size: '20G')")
+
+    return int(float(matches.group(1)) * SIZE_UNITS[matches.group(2).upper()])
+
+
+def formatSize(size):
+    """Convert a number of bytes into a human readable size"""
+    for unit in ["", "K", "M", "G"]:
+        if size < 1024:
+            return f"{size:.1f}{unit}B" if unit else f"{size}B"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def getCacheDir(cache_dir=None):
+    """Get the cache directory from the argument or from the environment
+
+    Returns:
+      string: the cache directory, or None if caching is disabled
+    """
+    return cache_dir or os.environ.get(CACHE_DIR_ENV) or None
+
+
+def linkOrCopy(source, destination):
+    """Hardlink the source file to the destination, or copy it if it is not possible
+    (eg. source and destination are not on the same filesystem)"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def entryKey(*parts):
+    """Build the key of a JSON entry from any JSON-serializable values"""
+    serialized = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def entryPath(cache_dir, namespace, key):
+    """Path of a JSON entry in the cache"""
+    return os.path.join(cache_dir, namespace, f"{key}.json")
+
+
+def readJsonEntry(cache_dir, namespace, key):
+    """Read a JSON entry from the cache
+
+    Args:
+      cache_dir (string): the root directory of the cache
+      namespace (string): the kind of entry (eg. 'context'), used as subdirectory
+      key (string): the key of the entry, see entryKey
+
+    Returns:
+      the value of the entry, or None if it is not in the cache (or is unreadable)
+    """
+    filepath = entryPath(cache_dir, namespace, key)
+    try:
+        with open(filepath, "r") as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # the modification time is used to find the least recently used entries
+    try:
+        os.utime(filepath)
+    except OSError:
+        pass
+    return value
+
+
+def writeJsonEntry(cache_dir, namespace, key, value):
+    """Write (atomically) a JSON entry in the cache
+
+    Args:
+      cache_dir (string): the root directory of the cache
+      namespace (string): the kind of entry (eg. 'context'), used as subdirectory
+      key (string): the key of the entry, see entryKey
+      value: any JSON-serializable value
+    """
+    filepath = entryPath(cache_dir, namespace, key)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp_filepath = f"{filepath}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_filepath, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_filepath, filepath)
+    finally:
+        if os.path.lexists(tmp_filepath):
+            os.remove(tmp_filepath)
+
+
+class DistributionCache:
+    """Content-addressed store of files, with a least-recently-used eviction (of the
+    JSON entries as well)"""
+
+    def __init__(self, cache_dir, max_size=None):
+        """
+        Args:
+          cache_dir (string): the root directory of the cache
+          max_size (int): OPTIONAL the maximum size of the cache, in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.objects_dir = os.path.join(cache_dir, OBJECTS_DIR)
+
+    def path(self, algorithm, digest):
+        """Path of the file of a given digest in the cache"""
+        algorithm = re.sub(r"[^a-z0-9-]", "", algorithm.lower())
+        digest = digest.lower()
+        if not re.match(r"^[a-z0-9]+$", digest):
+            raise ValueError(f"invalid digest '{digest}'")
+        return os.path.join(self.objects_dir, algorithm, digest[:2], digest)
+
+    def fetch(self, algorithm, digest, out_filepath):
+        """Write the file of a given digest at out_filepath, if it is in the cache
+
+        Returns:
+          bool: True if the file was in the cache
+        """
+        cached_filepath = self.path(algorithm, digest)
+        if not os.path.isfile(cached_filepath):
+            return False
+
+        # the output is unlinked rather than overwritten, as it may be a hardlink to
+        # another cached file
+        if os.path.lexists(out_filepath):
+            os.remove(out_filepath)
+
+        try:
+            linkOrCopy(cached_filepath, out_filepath)
+        except FileNotFoundError:
+            # evicted in the meantime by a concurrent garbage collection
+            return False
+
+        # the modification time is used to find the least recently used files
+        os.utime(cached_filepath)
+        return True
+
+    def store(self, algorithm, digest, filepath):
+        """Add a file to the cache, under the given digest"""
+        cached_filepath = self.path(algorithm, digest)
+        if os.path.isfile(cached_filepath):
+            os.utime(cached_filepath)
+            return
+
+        os.makedirs(os.path.dirname(cached_filepath), exist_ok=True)
+        tmp_filepath = f"{cached_filepath}.{uuid.uuid4().hex}.tmp"
+        try:
+            linkOrCopy(filepath, tmp_filepath)
+            os.replace(tmp_filepath, cached_filepath)
+        finally:
+            if os.path.lexists(tmp_filepath):
+                os.remove(tmp_filepath)
+
+        if self.max_size is not None:
+            self.gc()
+
+    def entries(self):
+        """List the files in the cache: the distribution files and the JSON entries
+
+        Returns:
+          [tuple]: a list of (path, size, modification time), sorted from the least to
+          the most recently used
+        """
+        entries = []
+        for root, _, filenames in os.walk(self.cache_dir):
+            relative_root = os.path.relpath(root, self.cache_dir)
+            in_objects = relative_root.split(os.sep)[0] == OBJECTS_DIR
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                if not in_objects and not filename.endswith(".json"):
+                    continue
+                filepath = os.path.join(root, filename)
+                try:
+                    stat = os.stat(filepath)
+                except FileNotFoundError:
+                    continue
+                entries.append((filepath, stat.st_size, stat.st_mtime))
+
+        return sorted(entries, key=lambda e: e[2])
+
+    def stats(self):
+        """Get the number of files and the total size of the cache"""
+        entries = self.entries()
+        return {
+            "cache_dir": self.cache_dir,
+            "files": len(entries),
+            "size": sum(e[1] for e in entries),
+            "max_size": self.max_size,
+        }
+
+    def gc(self, max_size=None):
+        """Evict the least recently used files until the cache size is under max_size
+
+        Args:
+          max_size (int): OPTIONAL the size to reach, defaults to the cache max_size
+
+        Returns:
+          tuple: the number of files removed and the number of bytes freed
+        """
+        max_size = self.max_size if max_size is None else max_size
+        if max_size is None:
+            return 0, 0
+
+        entries = self.entries()
+        size = sum(e[1] for e in entries)
+        removed = 0
+        freed = 0
+        for filepath, file_size, _ in entries:
+            if size <= max_size:
+                break
+            try:
+                os.remove(filepath)
+            except FileNotFoundError:
+                continue
+            size -= file_size
+            freed += file_size
+            removed += 1
+
+        if removed:
+            logging.info(
+                f"Cache: {removed} files evicted ({formatSize(freed)} freed)"
+            )
+        return removed, freed
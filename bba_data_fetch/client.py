@@ -0,0 +1,343 @@
+"""
+Lightweight retrieval of the resources by id, talking directly to the Nexus resources
+(or resolvers) endpoints. Building a KnowledgeGraphForge takes several seconds and
+HTTP requests (model context, resolvers, mappings), which dominates the fetch of a
+small file, while retrieving a resource by id only takes two requests: one for its
+Nexus metadata (where its project is) and one for its source payload.
+
+NexusClient has the subset of the KnowledgeGraphForge interface used by fetchResource
+(retrieve and as_json), so that both can be used in its place. Many resources can
+also be retrieved at once (retrieveMany), from the Elasticsearch view of the project,
+and then served by a PrefetchedEngine standing for the forge or the client. A resource
+retrieved earlier can be revalidated (revalidate) with a single conditional request.
+"""
+
+import copy
+import json
+import logging
+
+from urllib.parse import parse_qs, quote_plus, urlparse
+
+from bba_data_fetch.query import ELASTIC_VIEW
+
+# (connection, read) timeouts, in seconds
+CLIENT_TIMEOUT = (30, 120)
+
+# the maximum number of resources retrieved by a single Elasticsearch query
+BULK_SIZE = 500
+
+
+def splitId(id):
+    """Split the revision or the tag given in an @id (eg. '...?tag=v0.1.1') from the
+    @id itself, as kgforge does
+
+    Args:
+      id (string): the @id of the resource, possibly with a query
+
+    Returns:
+      tuple: the @id without its query, and the parameters of its query (dict)
+    """
+    parsed = urlparse(id)
+    fragment = parsed.fragment
+    query = parsed.query
+    # urlparse does not separate the query when it is after a fragment
+    if "?" in fragment:
+        fragment_parts = urlparse(fragment)
+        fragment = fragment_parts.path
+        query = fragment_parts.query
+    if not query:
+        return id, {}
+
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    fragment = f"#{fragment}" if fragment else ""
+    return f"{parsed.scheme}://{parsed.netloc}{parsed.path}{fragment}", params
+
+
+class StoreMetadata:
+    """The Nexus metadata of a resource, named as in the kgforge resources"""
+
+    def __init__(self, metadata):
+        """
+        Args:
+          metadata (dict): the metadata fields of the resource (eg. '_project',
+            '_rev', '_self')
+        """
+        for key, value in metadata.items():
+            if key.startswith("_"):
+                setattr(self, key, value)
+
+
+class NexusResource:
+    """A resource retrieved from Nexus: its source payload and its metadata"""
+
+    def __init__(self, payload, metadata, etag=None):
+        """
+        Args:
+          payload (dict): the source payload of the resource
+          metadata (dict): the payload of the resource as returned by Nexus, with its
+            metadata
+          etag (string): OPTIONAL the ETag Nexus answered the metadata with
+        """
+        self.payload = payload
+        self.metadata = metadata
+        self.id = metadata.get("@id") or payload.get("@id") or payload.get("id")
+        self.etag = etag
+        self._store_metadata = StoreMetadata(metadata)
+
+    def get_identifier(self):
+        """Get the @id of the resource"""
+        return self.id
+
+
+class NexusClient:
+    """Retrieve resources from a Nexus environment, with a requests session"""
+
+    def __init__(self, session, nexus_env, org, project):
+        """
+        Args:
+          session (:obj:`requests.Session`): the HTTP session, sending the token
+          nexus_env (string): URL to the Nexus environment (without trailing '/')
+          org (string): the organization the resources are retrieved from
+          project (string): the project the resources are retrieved from
+        """
+        self.session = session
+        self.nexus_env = nexus_env
+        self.org = org
+        self.project = project
+
+    def inBucket(self, org, project):
+        """Get a client retrieving the resources from another org/project, sharing
+        the session of this one"""
+        return NexusClient(self.session, self.nexus_env, org, project)
+
+    def getResponse(self, url, params=None, etag=None):
+        """Get a JSON payload from Nexus, with a conditional request if an ETag is given
+
+        Returns:
+          :obj:`requests.Response`: the response (304 if the payload did not change
+          since the ETag), or None if Nexus answers 404
+        """
+        headers = {"Accept": "application/ld+json"}
+        if etag:
+            headers["If-None-Match"] = etag
+        response = self.session.get(
+            url, params=params, headers=headers, timeout=CLIENT_TIMEOUT
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response
+
+    def getJson(self, url, params=None):
+        """Get a JSON payload from Nexus
+
+        Returns:
+          dict: the payload, or None if Nexus answers 404
+        """
+        response = self.getResponse(url, params)
+        return response.json() if response is not None else None
+
+    def retrieve(self, id, version=None, cross_bucket=True):
+        """Retrieve a resource by id
+
+        Args:
+          id (string): the @id of the resource
+          version: OPTIONAL the revision (int) or the tag (string) of the resource
+          cross_bucket (bool): OPTIONAL whether the resource is looked for in the
+            projects resolvable from org/project, or only in org/project
+
+        Returns:
+          :obj:`NexusResource`: the resource, or None if it is not found
+        """
+        # the version given apart takes precedence over the one in the @id
+        id, params = splitId(id)
+        if isinstance(version, int):
+            params.pop("tag", None)
+            params["rev"] = version
+        elif version:
+            params.pop("rev", None)
+            params["tag"] = version
+
+        endpoint = "resolvers" if cross_bucket else "resources"
+        url = "/".join(
+            [
+                self.nexus_env,
+                endpoint,
+                quote_plus(self.org),
+                quote_plus(self.project),
+                "_",
+                quote_plus(id),
+            ]
+        )
+        response = self.getResponse(url, params)
+        if response is None:
+            logging.info(f"Resource '{id}' not found in {self.org}/{self.project}")
+            return None
+
+        return self.retrieveSource(response.json(), response.headers.get("ETag"))
+
+    def retrieveSource(self, metadata, etag=None):
+        """Retrieve the source payload of a resource whose metadata were retrieved
+
+        Args:
+          metadata (dict): the payload of the resource as returned by Nexus
+          etag (string): OPTIONAL the ETag Nexus answered the metadata with
+
+        Returns:
+          :obj:`NexusResource`: the resource, or None if its source is not found
+        """
+        # the source is fetched at the revision found, in case the resource is updated
+        # in between
+        payload = self.getJson(
+            metadata["_self"] + "/source", {"rev": metadata["_rev"]}
+        )
+        if payload is None:
+            return None
+
+        return NexusResource(payload, metadata, etag)
+
+    def revalidate(self, resource):
+        """Check if a resource retrieved earlier is still the latest revision, with a
+        conditional request on its metadata (ETag), or by comparing its revision if
+        Nexus does not answer 304
+
+        Args:
+          resource (:obj:`NexusResource`): the resource retrieved earlier, with its
+            '_self' and '_rev' metadata
+
+        Returns:
+          :obj:`NexusResource`: the same resource if it did not change, its latest
+          revision otherwise, or None if it is not found anymore
+        """
+        response = self.getResponse(
+            resource._store_metadata._self, etag=getattr(resource, "etag", None)
+        )
+        if response is None:
+            return None
+        if response.status_code == 304:
+            return resource
+
+        metadata = response.json()
+        if metadata.get("_rev") == getattr(resource._store_metadata, "_rev", None):
+            return resource
+        return self.retrieveSource(metadata, response.headers.get("ETag"))
+
+    def retrieveMany(self, ids):
+        """Retrieve the latest revision of many resources of org/project at once, with
+        an Elasticsearch query per BULK_SIZE ids on the default Elasticsearch view of
+        the project (which indexes the source of the resources along with their
+        metadata)
+
+        Args:
+          ids ([string]): the @id of the resources
+
+        Returns:
+          dict: the :obj:`NexusResource` of each @id found in org/project
+        """
+        url = "/".join(
+            [
+                self.nexus_env,
+                "views",
+                quote_plus(self.org),
+                quote_plus(self.project),
+                quote_plus(ELASTIC_VIEW),
+                "_search",
+            ]
+        )
+        ids = list(dict.fromkeys(ids))
+        resources = {}
+        for start in range(0, len(ids), BULK_SIZE):
+            chunk = ids[start:start + BULK_SIZE]
+            response = self.session.post(
+                url,
+                json={"query": {"terms": {"@id": chunk}}, "size": len(chunk)},
+                timeout=CLIENT_TIMEOUT,
+            )
+            response.raise_for_status()
+            for hit in response.json()["hits"]["hits"]:
+                metadata = dict(hit["_source"])
+                source = metadata.pop("_original_source", None)
+                if source is None:
+                    continue
+                resource = NexusResource(json.loads(source), metadata)
+                resources[resource.get_identifier()] = resource
+
+        logging.info(f"{len(resources)}/{len(ids)} resources retrieved at once")
+        return resources
+
+    def as_json(self, resource):
+        """Get the payload of a resource, as a dictionary that can be modified"""
+        return copy.deepcopy(resource.payload)
+
+
+class PrefetchedEngine:
+    """Stands for a forge or a NexusClient, serving the latest revision of the
+    resources retrieved beforehand (see NexusClient.retrieveMany) and delegating the
+    retrieval of the other ones"""
+
+    def __init__(self, engine, resources):
+        """
+        Args:
+          engine (:obj:`KnowledgeGraphForge` or :obj:`NexusClient`): retrieves the
+            resources which were not prefetched
+          resources (dict): the prefetched :obj:`NexusResource`, by @id
+        """
+        self.engine = engine
+        self.resources = resources
+
+    def inBucket(self, org, project):
+        """Get the engine retrieving the resources from another org/project (serving
+        the same prefetched resources), or None if the engine cannot"""
+        in_bucket = getattr(self.engine, "inBucket", None)
+        if in_bucket is None:
+            return None
+        return PrefetchedEngine(in_bucket(org, project), self.resources)
+
+    def retrieve(self, id, version=None, cross_bucket=True):
+        """Retrieve a resource by id, see NexusClient.retrieve"""
+        if version is None and id in self.resources:
+            return self.resources[id]
+        return self.engine.retrieve(id, version=version, cross_bucket=cross_bucket)
+
+    def revalidate(self, resource):
+        """Check if a resource retrieved earlier is still the latest revision (see
+        NexusClient.revalidate): a prefetched resource is the latest revision
+
+        Returns:
+          the latest revision of the resource, or None if the engine cannot
+          revalidate it
+        """
+        if resource.get_identifier() in self.resources:
+            return self.resources[resource.get_identifier()]
+        revalidate = getattr(self.engine, "revalidate", None)
+        return revalidate(resource) if revalidate else None
+
+    def toForgeResource(self, resource):
+        """Convert a prefetched resource into a resource of the forge, built as
+        forge.retrieve builds it: by the store, whose JSON-LD conversion turns '@id'
+        and '@type' into 'id' and 'type' (the nested objects included), with the
+        metadata of the resource
+
+        Args:
+          resource (:obj:`NexusResource`): the prefetched resource
+
+        Returns:
+          :obj:`Resource`: the resource of the forge
+        """
+        payload = copy.deepcopy(resource.payload)
+        service = getattr(getattr(self.engine, "_store", None), "service", None)
+        if not hasattr(service, "to_resource"):
+            return self.engine.from_json(payload)
+
+        forge_resource = service.to_resource(payload)
+        service.synchronize_resource(
+            forge_resource, copy.deepcopy(resource.metadata), "retrieve", True, True
+        )
+        return forge_resource
+
+    def as_json(self, resource):
+        """Get the payload of a resource, as the engine serializes it: a prefetched
+        resource is converted into a resource of the forge beforehand"""
+        if isinstance(resource, NexusResource) and hasattr(self.engine, "from_json"):
+            return self.engine.as_json(self.toForgeResource(resource))
+        return self.engine.as_json(resource)
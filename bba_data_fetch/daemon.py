@@ -0,0 +1,247 @@
+"""
+Warm fetch daemon. `bba-data-fetch serve` starts a process listening on a Unix socket,
+which keeps what is costly to build across the fetches: the forges, the context used
+to translate the filters, the HTTP connection pools and the resolved filters. It also
+bounds the number of fetches running at the same time on the node (--jobs).
+
+When a daemon is listening, the CLI sends it its (already parsed) arguments instead
+of fetching by itself, and replays the log of the fetch. The daemon only serves the
+fetches with its own token and Nexus environment, the others (and the fetches of a
+--manifest or of a --locked lockfile) being run by the CLI.
+
+The protocol is one JSON document per line: the CLI sends {"args": {...}} and the
+daemon answers {"status": <exit status>, "log": [[<level>, <message>], ...]}, or
+{"declined": true, "log": [...]} if the CLI has to run the fetch.
+"""
+
+import os
+import json
+import stat
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import contextvars
+import socketserver
+
+SOCKET_ENV = "BBA_DATA_FETCH_SOCKET"
+
+# arguments holding paths, made absolute since the daemon has its own working dir
+PATH_ARGS = ["out", "forge_config", "cache_dir"]
+
+# the log handler of the request being served, in the context of the thread serving
+# it and of the worker threads it starts (see download.ContextExecutor)
+REQUEST_LOG = contextvars.ContextVar("REQUEST_LOG", default=None)
+
+
+def getPrivateDir():
+    """Get the directory of the default socket in the temporary directory, specific to
+    the user"""
+    return os.path.join(tempfile.gettempdir(), f"bba-data-fetch-{os.getuid()}")
+
+
+def getSocketPath(socket_path=None):
+    """Get the path of the socket of the daemon, from the argument, the environment
+    variable BBA_DATA_FETCH_SOCKET or a default path specific to the user: in its
+    runtime directory (XDG_RUNTIME_DIR), or in a directory of the temporary directory
+    that only the user can access (see FetchDaemon)"""
+    if socket_path or os.environ.get(SOCKET_ENV):
+        return socket_path or os.environ.get(SOCKET_ENV)
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "bba-data-fetch.sock")
+    return os.path.join(getPrivateDir(), "fetch.sock")
+
+
+def isOwnSocket(socket_path):
+    """Check if a path is a Unix socket created by the current user. The token being
+    sent to the daemon, a socket created by another user (eg. at the default path,
+    before the user started any daemon) is never connected to."""
+    try:
+        stats = os.lstat(socket_path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(stats.st_mode) and stats.st_uid == os.getuid()
+
+
+def makePrivateDir(directory):
+    """Create the directory of the socket, only accessible by the current user, or
+    check that it is so if it exists"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    stats = os.lstat(directory)
+    if (
+        not stat.S_ISDIR(stats.st_mode)
+        or stats.st_uid != os.getuid()
+        or stats.st_mode & 0o077
+    ):
+        raise OSError(f"{directory} is not a directory only the user can access")
+
+
+def isListening(socket_path):
+    """Check if a process is listening on a Unix socket"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+        except OSError:
+            return False
+
+
+def delegate(args):
+    """Run a fetch in the daemon, if one is listening
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+
+    Returns:
+      int: the exit status of the fetch, or None if it was not run by a daemon
+    """
+    if args.manifest or args.locked or args.no_daemon:
+        return None
+
+    socket_path = getSocketPath(args.socket)
+    if not os.path.lexists(socket_path):
+        return None
+    if not isOwnSocket(socket_path):
+        logging.warning(
+            f"⚠️  {socket_path} is not a socket of the user, the fetch is not "
+            "delegated to it"
+        )
+        return None
+
+    request_args = dict(vars(args))
+    for key in PATH_ARGS:
+        if request_args.get(key):
+            request_args[key] = os.path.abspath(request_args[key])
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall((json.dumps({"args": request_args}) + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as f:
+                reply = json.loads(f.readline())
+    except (OSError, ValueError) as e:
+        logging.info(f"No fetch daemon available at {socket_path} ({e})")
+        return None
+
+    for level, message in reply.get("log", []):
+        logging.log(level, message)
+
+    if reply.get("declined"):
+        return None
+
+    logging.info(f"Fetched by the daemon listening at {socket_path}")
+    return reply["status"]
+
+
+class RequestLogHandler(logging.Handler):
+    """Collect the log records of a request, logged by the thread serving it or by
+    its worker threads, to send them back"""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.records = []
+
+    def emit(self, record):
+        if REQUEST_LOG.get() is self:
+            self.records.append([record.levelno, self.format(record)])
+
+
+class FetchRequestHandler(socketserver.StreamRequestHandler):
+    """Serve a fetch request sent by the CLI"""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            args = argparse.Namespace(**request["args"])
+        except (ValueError, KeyError, TypeError) as e:
+            reply = {"status": 1, "log": [[logging.ERROR, f"❌ Invalid request: {e}"]]}
+        else:
+            reply = self.server.serveFetch(args)
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+class FetchDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server running the fetches in a warm process"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, nexus_token, nexus_env, run_fetch, jobs):
+        """
+        Args:
+          socket_path (string): the path of the socket to listen on
+          nexus_token (string): the token of the fetches served
+          nexus_env (string): the Nexus environment of the fetches served
+          run_fetch (callable): runs a fetch from its parameters namespace (exiting
+            with a non-zero status if it fails)
+          jobs (int): maximum number of fetches running at the same time
+        """
+        self.nexus_token = nexus_token
+        self.nexus_env = nexus_env
+        self.run_fetch = run_fetch
+        self.semaphore = threading.BoundedSemaphore(jobs)
+
+        # the default socket is in a directory of the temporary directory, which
+        # must not be created by another user
+        if os.path.dirname(os.path.abspath(socket_path)) == getPrivateDir():
+            makePrivateDir(getPrivateDir())
+
+        # a socket left by a daemon that did not stop properly is replaced
+        if os.path.lexists(socket_path):
+            if isListening(socket_path):
+                raise OSError(f"a daemon is already listening at {socket_path}")
+            os.remove(socket_path)
+
+        # the fetches are run with the token of the daemon: the socket is created
+        # with no access for the other users (rather than restricted after the bind)
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, FetchRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def serveFetch(self, args):
+        """Run a fetch and collect its log
+
+        Args:
+          args (:obj:`argparse.Namespace`): parameters namespace of the fetch
+
+        Returns:
+          dict: the reply to send back
+        """
+        if args.nexus_token != self.nexus_token or args.nexus_env != self.nexus_env:
+            return {
+                "declined": True,
+                "log": [
+                    [
+                        logging.INFO,
+                        "The fetch daemon serves another token or Nexus environment",
+                    ]
+                ],
+            }
+
+        handler = RequestLogHandler()
+        REQUEST_LOG.set(handler)
+        logging.getLogger().addHandler(handler)
+        status = 0
+        try:
+            with self.semaphore:
+                self.run_fetch(args)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                status = e.code or 0
+            else:
+                status = 1
+        except Exception as e:
+            logging.error(f"❌ {e}")
+            status = 1
+        finally:
+            logging.getLogger().removeHandler(handler)
+            REQUEST_LOG.set(None)
+
+        return {"status": status, "log": handler.records}
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
@@ -0,0 +1,91 @@
+"""
+Compute the digest of local files, with the algorithms used by Nexus (eg. 'SHA-256'),
+to compare them with the digest of the distributions.
+"""
+
+import os
+import mmap
+import hashlib
+
+# size of the slices of the file given to the hash function
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def getHashlibName(algorithm):
+    """Convert the name of a digest algorithm as written by Nexus (eg. 'SHA-256') into
+    the name used by hashlib (eg. 'sha256')
+
+    Args:
+      algorithm (string): the name of the algorithm
+
+    Returns:
+      string: the hashlib name of the algorithm
+    """
+    name = algorithm.lower().replace("-", "").replace("_", "")
+    if name not in hashlib.algorithms_available:
+        raise ValueError(f"unsupported digest algorithm '{algorithm}'")
+    return name
+
+
+def createHash(algorithm):
+    """Create a hashlib object for a digest algorithm as written by Nexus"""
+    return hashlib.new(getHashlibName(algorithm))
+
+
+def updateHashFromFile(file_hash, filepath, chunk_size=HASH_CHUNK_SIZE):
+    """Feed the content of a local file to a hashlib object. The file is
+    memory-mapped and hashed by slices, so that the memory usage does not depend on the
+    size of the file.
+
+    Args:
+      file_hash: the hashlib object
+      filepath (string): path to the file
+      chunk_size (int): OPTIONAL size of the slices given to the hash function
+    """
+    with open(filepath, "rb") as f:
+        # empty files cannot be memory-mapped
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return
+
+        with mapped:
+            view = memoryview(mapped)
+            try:
+                for start in range(0, len(view), chunk_size):
+                    file_hash.update(view[start:start + chunk_size])
+            finally:
+                view.release()
+
+
+def hashFile(filepath, algorithm, chunk_size=HASH_CHUNK_SIZE):
+    """Compute the digest of a local file, see updateHashFromFile
+
+    Args:
+      filepath (string): path to the file
+      algorithm (string): the name of the algorithm, as written by Nexus
+      chunk_size (int): OPTIONAL size of the slices given to the hash function
+
+    Returns:
+      string: the hexadecimal digest
+    """
+    file_hash = createHash(algorithm)
+    updateHashFromFile(file_hash, filepath, chunk_size)
+    return file_hash.hexdigest()
+
+
+def isUpToDate(filepath, algorithm, digest):
+    """Check if a local file has the given digest
+
+    Args:
+      filepath (string): path to the file
+      algorithm (string): the name of the algorithm, as written by Nexus
+      digest (string): the expected hexadecimal digest
+
+    Returns:
+      bool: True if the file exists and has the given digest
+    """
+    if not os.path.isfile(filepath):
+        return False
+
+    return hashFile(filepath, algorithm) == digest.lower()
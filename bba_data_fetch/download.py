@@ -0,0 +1,407 @@
+"""
+Download the distribution files from Nexus. The file is streamed to the disk by
+chunks of a fixed size (the buffer size), its digest being computed along the way, so
+that the memory usage does not depend on the size of the file.
+
+The file is first written next to the output, with a '.part' suffix. If the transfer
+is interrupted, it is resumed from the last byte received (HTTP Range request), by
+the next attempt or by the next run. Once complete, the file is checked against the
+digest of the distribution and renamed into the output.
+
+Large files can also be downloaded by segments: several connections fetch byte ranges
+of the file in parallel, into a preallocated part file.
+"""
+
+import os
+import time
+import logging
+import threading
+import contextvars
+
+from urllib.parse import quote_plus
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bba_data_fetch.digest import createHash, updateHashFromFile, hashFile
+from bba_data_fetch.errors import DigestMismatchError
+
+PART_SUFFIX = ".part"
+
+# default size of the chunks read from the HTTP response and written to the disk
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+
+# (connection, read) timeouts, in seconds
+DOWNLOAD_TIMEOUT = (30, 300)
+
+# status codes that are worth retrying
+RETRY_STATUS_CODES = [408, 425, 429, 500, 502, 503, 504]
+
+# sessions (and their connection pools) shared by the downloads of the process, by
+# token and pool size
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+
+class ContextExecutor(ThreadPoolExecutor):
+    """Thread pool running each task in a copy of the context of the thread that
+    submitted it, so that the worker threads log for the same daemon request (see
+    bba_data_fetch.daemon)"""
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def getSession(token, pool_size=10):
+    """Get the HTTP session of the process for a given token and pool size, so that
+    the downloads reuse the same connections (a pool too small for the concurrent
+    downloads, eg. by segments, would discard the connections beyond its size)
+
+    Args:
+      token (string): the Nexus token
+      pool_size (int): OPTIONAL maximum number of connections kept per host
+
+    Returns:
+      :obj:`requests.Session`: the session, sending the token
+    """
+    # requests is slow to import, hence only imported when downloading
+    import requests
+
+    key = (token, pool_size)
+    with SESSIONS_LOCK:
+        if key not in SESSIONS:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            if token:
+                session.headers["Authorization"] = f"Bearer {token}"
+            SESSIONS[key] = session
+        return SESSIONS[key]
+
+
+def getFileUrl(nexus_env, org, project, file_id):
+    """Build the URL of the binary of a Nexus file
+
+    Args:
+      nexus_env (string): URL to the Nexus environment
+      org (string): the organization of the file
+      project (string): the project of the file
+      file_id (string): the id of the file (not URL-encoded)
+
+    Returns:
+      string: the URL
+    """
+    return "/".join(
+        [nexus_env, "files", quote_plus(org), quote_plus(project), quote_plus(file_id)]
+    )
+
+
+def isRetryable(error):
+    """Check if a failed request is worth retrying (network error or temporary server
+    error)"""
+    import requests
+
+    if isinstance(error, requests.HTTPError):
+        return (
+            error.response is not None
+            and error.response.status_code in RETRY_STATUS_CODES
+        )
+    return isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+    )
+
+
+class PartFile:
+    """A download in progress: the '.part' file and the digest of its content, which
+    is kept in sync with the file as the chunks are written"""
+
+    def __init__(self, out_filepath, algorithm):
+        """
+        Args:
+          out_filepath (string): the output, the part file being next to it
+          algorithm (string): the digest algorithm, as written by Nexus
+        """
+        self.filepath = out_filepath + PART_SUFFIX
+        self.algorithm = algorithm
+        self.hash = createHash(algorithm)
+        # a part file left by a previous run
+        self.resumed = os.path.isfile(self.filepath)
+        if self.resumed:
+            updateHashFromFile(self.hash, self.filepath)
+
+    def size(self):
+        """Number of bytes already downloaded"""
+        return os.path.getsize(self.filepath) if os.path.isfile(self.filepath) else 0
+
+    def open(self, resume):
+        """Open the part file to write the next chunks, either after the bytes already
+        downloaded or from scratch"""
+        if not resume:
+            self.hash = createHash(self.algorithm)
+        return open(self.filepath, "ab" if resume else "wb", buffering=0)
+
+    def write(self, f, chunk):
+        """Write a chunk in the opened part file"""
+        f.write(chunk)
+        self.hash.update(chunk)
+
+    def discard(self):
+        """Remove the part file, to start the download over"""
+        if os.path.isfile(self.filepath):
+            os.remove(self.filepath)
+        self.hash = createHash(self.algorithm)
+        self.resumed = False
+
+
+def downloadPart(session, url, part_file, buffer_size):
+    """Download a file into the part file, continuing from the bytes already in it
+
+    Args:
+      session (:obj:`requests.Session`): the HTTP session
+      url (string): the URL of the file
+      part_file (:obj:`PartFile`): the download in progress
+      buffer_size (int): size of the chunks written to the disk
+    """
+    offset = part_file.size()
+
+    headers = {"Accept": "*/*"}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+
+    with session.get(
+        url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+    ) as response:
+        # the part file is already complete
+        if offset and response.status_code == 416:
+            return
+
+        response.raise_for_status()
+
+        # the server may ignore the Range header and send the whole file
+        content_range = response.headers.get("Content-Range", "")
+        resume = response.status_code == 206 and content_range.startswith(
+            f"bytes {offset}-"
+        )
+        if resume:
+            logging.info(f"Resuming the download from byte {offset}")
+
+        with part_file.open(resume) as f:
+            for chunk in response.iter_content(chunk_size=buffer_size):
+                part_file.write(f, chunk)
+
+
+def downloadFile(
+    session,
+    url,
+    out_filepath,
+    algorithm,
+    digest,
+    retries=3,
+    buffer_size=None,
+):
+    """Download a file, resuming the transfer when it is interrupted, and check its
+    digest (computed while downloading) before moving it to out_filepath
+
+    Args:
+      session (:obj:`requests.Session`): the HTTP session
+      url (string): the URL of the file
+      out_filepath (string): where to write the file
+      algorithm (string): the digest algorithm, as written by Nexus (eg. 'SHA-256')
+      digest (string): the expected hexadecimal digest
+      retries (int): OPTIONAL number of times an interrupted transfer is resumed
+      buffer_size (int): OPTIONAL size of the chunks written to the disk (defaults
+        to DOWNLOAD_BUFFER_SIZE)
+    """
+    buffer_size = buffer_size or DOWNLOAD_BUFFER_SIZE
+    part_file = PartFile(out_filepath, algorithm)
+
+    # a part file left by a previous run may belong to another version of the file,
+    # in which case the download is started over once
+    if part_file.resumed:
+        logging.info(f"Found an incomplete download at {part_file.filepath}")
+
+    while True:
+        for attempt in range(retries + 1):
+            try:
+                downloadPart(session, url, part_file, buffer_size)
+                break
+            except Exception as e:
+                if attempt == retries or not isRetryable(e):
+                    raise
+                delay = 2**attempt
+                logging.warning(
+                    f"⚠️  Download interrupted ({e}), resuming in {delay}s "
+                    f"(attempt {attempt + 1}/{retries})"
+                )
+                time.sleep(delay)
+
+        if part_file.hash.hexdigest() == digest.lower():
+            break
+
+        resumed = part_file.resumed
+        part_file.discard()
+        if not resumed:
+            raise DigestMismatchError(
+                f"The file downloaded from {url} does not have the digest of the "
+                "distribution"
+            )
+        logging.warning(
+            "⚠️  The resumed download does not match the digest, starting over"
+        )
+
+    os.replace(part_file.filepath, out_filepath)
+
+
+def supportsRanges(session, url, size):
+    """Check that the server answers Range requests for a file of a given size
+
+    Args:
+      session (:obj:`requests.Session`): the HTTP session
+      url (string): the URL of the file
+      size (int): the size of the file
+
+    Returns:
+      bool: True if byte ranges of the file can be requested
+    """
+    headers = {"Accept": "*/*", "Range": "bytes=0-0"}
+    with session.get(
+        url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        return response.status_code == 206 and response.headers.get(
+            "Content-Range", ""
+        ).endswith(f"/{size}")
+
+
+def downloadSegment(session, url, filepath, start, end, retries, buffer_size):
+    """Download the byte range [start, end] of a file into the same range of a
+    preallocated local file, resuming the transfer when it is interrupted
+
+    Args:
+      session (:obj:`requests.Session`): the HTTP session
+      url (string): the URL of the file
+      filepath (string): the preallocated file to write
+      start (int): first byte of the segment
+      end (int): last byte of the segment (included)
+      retries (int): number of times an interrupted transfer is resumed
+      buffer_size (int): size of the chunks written to the disk
+    """
+    import requests
+
+    position = start
+    for attempt in range(retries + 1):
+        headers = {"Accept": "*/*", "Range": f"bytes={position}-{end}"}
+        try:
+            with session.get(
+                url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+            ) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise requests.HTTPError(
+                        f"byte range {position}-{end} not served", response=response
+                    )
+                with open(filepath, "r+b", buffering=0) as f:
+                    f.seek(position)
+                    for chunk in response.iter_content(chunk_size=buffer_size):
+                        f.write(chunk[: end + 1 - position])
+                        position += len(chunk)
+            if position > end:
+                return
+            raise requests.exceptions.ChunkedEncodingError(
+                f"byte range {start}-{end} incomplete"
+            )
+        except Exception as e:
+            if attempt == retries or not isRetryable(e):
+                raise
+            delay = 2**attempt
+            logging.warning(
+                f"⚠️  Download of bytes {start}-{end} interrupted ({e}), resuming in "
+                f"{delay}s (attempt {attempt + 1}/{retries})"
+            )
+            time.sleep(delay)
+
+
+def downloadSegmented(
+    session,
+    url,
+    out_filepath,
+    algorithm,
+    digest,
+    size,
+    segments,
+    retries=3,
+    buffer_size=None,
+):
+    """Download a large file with several connections, each of them fetching a byte
+    range into a preallocated part file, then check its digest before moving it to
+    out_filepath. If the server does not serve byte ranges, the file is downloaded
+    with a single connection (see downloadFile).
+
+    Args:
+      session (:obj:`requests.Session`): the HTTP session
+      url (string): the URL of the file
+      out_filepath (string): where to write the file
+      algorithm (string): the digest algorithm, as written by Nexus (eg. 'SHA-256')
+      digest (string): the expected hexadecimal digest
+      size (int): the size of the file, in bytes
+      segments (int): the number of byte ranges downloaded in parallel
+      retries (int): OPTIONAL number of times an interrupted transfer is resumed
+      buffer_size (int): OPTIONAL size of the chunks written to the disk (defaults
+        to DOWNLOAD_BUFFER_SIZE)
+    """
+    buffer_size = buffer_size or DOWNLOAD_BUFFER_SIZE
+
+    if not supportsRanges(session, url, size):
+        logging.info("The server does not serve byte ranges, using one connection")
+        downloadFile(
+            session, url, out_filepath, algorithm, digest, retries, buffer_size
+        )
+        return
+
+    # the segments are written in place, hence an incomplete part file left by a
+    # previous run cannot be resumed
+    part_filepath = out_filepath + PART_SUFFIX
+    with open(part_filepath, "wb") as f:
+        f.truncate(size)
+
+    segment_size = -(-size // segments)
+    ranges = [
+        (start, min(start + segment_size, size) - 1)
+        for start in range(0, size, segment_size)
+    ]
+    logging.info(f"Downloading {len(ranges)} segments of {segment_size} bytes")
+
+    try:
+        with ContextExecutor(max_workers=len(ranges)) as executor:
+            futures = [
+                executor.submit(
+                    downloadSegment,
+                    session,
+                    url,
+                    part_filepath,
+                    start,
+                    end,
+                    retries,
+                    buffer_size,
+                )
+                for start, end in ranges
+            ]
+            for future in as_completed(futures):
+                future.result()
+
+        if hashFile(part_filepath, algorithm) != digest.lower():
+            raise DigestMismatchError(
+                f"The file downloaded from {url} does not have the digest of the "
+                "distribution"
+            )
+    except BaseException:
+        os.remove(part_filepath)
+        raise
+
+    os.replace(part_filepath, out_filepath)
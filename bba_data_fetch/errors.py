@@ -0,0 +1,40 @@
+"""
+Exceptions raised by the fetches (see Fetcher). They all derive from FetchError, the
+CLI reporting them and exiting with a non-zero status.
+"""
+
+
+class FetchError(Exception):
+    """A fetch failed"""
+
+
+class QueryError(FetchError):
+    """The SPARQL query resolving the filters failed"""
+
+
+class NoMatchError(FetchError):
+    """No resource matches the filters"""
+
+
+class ResourceNotFoundError(FetchError):
+    """The resource cannot be retrieved from Nexus"""
+
+
+class ForgeError(FetchError):
+    """The KnowledgeGraphForge cannot be built"""
+
+
+class OutputError(FetchError):
+    """The output does not suit what is fetched (eg. its extension)"""
+
+
+class DistributionError(FetchError):
+    """The resource has no distribution file to fetch"""
+
+
+class DownloadError(FetchError):
+    """The distribution file cannot be downloaded"""
+
+
+class DigestMismatchError(DownloadError):
+    """The downloaded file does not have the digest of the distribution"""
@@ -0,0 +1,1042 @@
+"""
+Library API. A Fetcher holds what is costly to build (the forge, the HTTP session, the
+context and the caches) and fetches the resources, their payload or their distribution
+file, raising the exceptions of bba_data_fetch.errors instead of exiting. It can then
+be used from a Python pipeline, by several threads at the same time. The queries being
+sent by the Nexus SDK, whose configuration is global, a process only supports a single
+token and Nexus environment (the Fetchers of a process must share them):
+
+    fetcher = Fetcher("https://bbp.epfl.ch/nexus/v1", token, "bbp", "atlas")
+    ids = fetcher.resolve(["type=BrainParcellationDataLayer", "name=annotation"])
+    fetcher.fetchDistribution(ids[0], "./annotation.nrrd", tag="v1.1.0")
+
+The options of a Fetcher are the ones of the command line, with their argparse names
+(see DEFAULT_OPTIONS).
+"""
+
+import os
+import re
+import copy
+import json
+import logging
+import argparse
+import threading
+
+from urllib.parse import unquote
+
+from bba_data_fetch.cache import (
+    CACHE_MAX_SIZE_ENV,
+    DistributionCache,
+    entryKey,
+    getCacheDir,
+    parseSize,
+    readJsonEntry,
+    writeJsonEntry,
+)
+from bba_data_fetch.client import NexusClient, NexusResource, PrefetchedEngine
+from bba_data_fetch.digest import isUpToDate
+from bba_data_fetch.download import (
+    downloadFile,
+    downloadSegmented,
+    getFileUrl,
+    getSession,
+)
+from bba_data_fetch.errors import (
+    DigestMismatchError,
+    DistributionError,
+    DownloadError,
+    FetchError,
+    ForgeError,
+    NoMatchError,
+    OutputError,
+    QueryError,
+    ResourceNotFoundError,
+)
+from bba_data_fetch.query import (
+    getFilteredIds,
+    importNexus,
+    iterFilteredIds,
+    iterFilteredMatches,
+    resolveFilterSets,
+)
+
+# options of a Fetcher, and their default values (the same as the command line)
+DEFAULT_OPTIONS = {
+    "forge_config": "cfg/forge-config.yml",
+    "cross_bucket": True,
+    "use_forge": False,
+    "jobs": None,
+    "retries": 3,
+    "buffer_size": None,
+    "segments": 1,
+    "segment_threshold": "256M",
+    "incremental": False,
+    "cache_dir": None,
+    "cache_max_size": None,
+    "context_ttl": 86400,
+    "filter_cache_ttl": 0,
+    "pin_filters": False,
+    "refresh_filters": False,
+    "page_size": 10000,
+    "search_backend": "sparql",
+}
+
+# Nexus metadata removed from the payloads, unless they are kept
+NEXUS_METADATA = [
+    "@context",
+    "@id",
+    "@type",
+    "_self",
+    "_project",
+    "_rev",
+    "_deprecated",
+    "_createdAt",
+    "_createdBy",
+    "_updatedAt",
+    "_updatedBy",
+    "_incoming",
+    "_outgoing",
+    "_constrainedBy",
+]
+
+# forges already built by this process (eg. a daemon), by configuration and bucket
+FORGES_MEMO = {}
+FORGES_LOCK = threading.Lock()
+
+# the bucket ([org, project]) the resources were found in by this process, by
+# environment, bucket they were resolved from and id (see readBucket)
+BUCKETS_MEMO = {}
+
+# the max_connection of the forge configurations read by this process, by path
+JOBS_MEMO = {}
+
+# the payloads of the resources retrieved (or checked) by this process, by environment,
+# bucket, id, version and serialization (see readPayload)
+PAYLOADS_MEMO = {}
+
+
+def buildForge(args):
+    """Instantiate the forge used to retrieve the resources (once per process for a
+    given configuration and bucket)
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+
+    Returns:
+      :obj:`KnowledgeGraphForge`: the forge, bound to the org/proj bucket
+    """
+    bucket = "/".join([args.nexus_org, args.nexus_proj])
+    key = (args.forge_config, args.nexus_env, bucket, args.nexus_token)
+    with FORGES_LOCK:
+        if key not in FORGES_MEMO:
+            try:
+                from kgforge.core import KnowledgeGraphForge
+
+                FORGES_MEMO[key] = KnowledgeGraphForge(
+                    args.forge_config,
+                    endpoint=args.nexus_env,
+                    bucket=bucket,
+                    token=args.nexus_token,
+                )
+            except Exception as e:
+                raise ForgeError(str(e)) from e
+        return FORGES_MEMO[key]
+
+
+def buildClient(args):
+    """Instantiate the lightweight client retrieving the resources directly from the
+    Nexus API
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+
+    Returns:
+      :obj:`NexusClient`: the client, bound to the org/proj bucket
+    """
+    session = getSession(args.nexus_token, getJobs(args))
+    return NexusClient(session, args.nexus_env, args.nexus_org, args.nexus_proj)
+
+
+def prefetchResources(args, client, ids):
+    """Retrieve the latest revision of many resources at once (see
+    NexusClient.retrieveMany)
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+      client (:obj:`NexusClient`): the client bound to the org/proj bucket
+      ids ([str]): the @id of the resources
+
+    Returns:
+      dict: the resources retrieved, by @id (none if they cannot be retrieved at
+      once, in which case they are retrieved one by one)
+    """
+    try:
+        return client.retrieveMany(ids)
+    except Exception as e:
+        logging.warning(
+            f"⚠️  The resources cannot be retrieved at once ({e}), they are retrieved "
+            "one by one"
+        )
+        return {}
+
+
+def readBucket(args, id):
+    """Get the bucket a resource was found in when it was resolved across the buckets
+    from org/proj, by this process or by a previous run (if a cache directory is set)
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+      id (string): the @id of the resource
+
+    Returns:
+      list: the org and the project of the resource, or None if it is not known
+    """
+    key = entryKey(args.nexus_env, args.nexus_org, args.nexus_proj, id)
+    bucket = BUCKETS_MEMO.get(key)
+    cache_dir = getCacheDir(args.cache_dir)
+    if bucket is None and cache_dir:
+        bucket = readJsonEntry(cache_dir, "buckets", key)
+        if bucket is not None:
+            BUCKETS_MEMO[key] = bucket
+    return bucket
+
+
+def storeBucket(args, id, res):
+    """Remember the bucket a resource was found in (see readBucket)
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+      id (string): the @id of the resource
+      res: the retrieved resource, whose project is in its metadata
+    """
+    project = getattr(getattr(res, "_store_metadata", None), "_project", None)
+    if not isinstance(project, str) or project.count("/") < 2:
+        return
+
+    bucket = project.rstrip("/").split("/")[-2:]
+    key = entryKey(args.nexus_env, args.nexus_org, args.nexus_proj, id)
+    if BUCKETS_MEMO.get(key) == bucket:
+        return
+
+    BUCKETS_MEMO[key] = bucket
+    cache_dir = getCacheDir(args.cache_dir)
+    if cache_dir:
+        writeJsonEntry(cache_dir, "buckets", key, bucket)
+
+
+def runQuery(resolve, *args):
+    """Resolve filters, raising a QueryError for any failure (eg. the context cannot
+    be fetched)
+
+    Args:
+      resolve (callable): the function resolving the filters
+      args: its arguments
+
+    Returns:
+      what the function returns
+    """
+    try:
+        return resolve(*args)
+    except FetchError:
+        raise
+    except Exception as e:
+        raise QueryError(str(e)) from e
+
+
+def iterQuery(matches):
+    """Iterate over the results of a resolution of filters (a generator, running the
+    queries as it is iterated), raising a QueryError for any failure"""
+    try:
+        yield from matches
+    except FetchError:
+        raise
+    except Exception as e:
+        raise QueryError(str(e)) from e
+
+
+def isPinned(id, version=None):
+    """Check if a resource is retrieved at a given revision or tag (which does not
+    change), given apart or in its @id (eg. '...?tag=v0.1.1')"""
+    return version is not None or bool(re.search(r"[?&](rev|tag)=", id))
+
+
+def payloadKey(args, id, version, engine):
+    """Build the key of the cached payload of a resource (see readPayload). The
+    payloads serialized by a forge and by a NexusClient are cached apart"""
+    if isinstance(engine, PrefetchedEngine):
+        engine = engine.engine
+    serializer = "forge" if hasattr(engine, "from_json") else "client"
+    return entryKey(
+        args.nexus_env,
+        args.nexus_org,
+        args.nexus_proj,
+        args.cross_bucket,
+        id,
+        version,
+        serializer,
+    )
+
+
+def readPayload(args, key):
+    """Get the payload of a resource retrieved by this process, or by a previous run
+    (if a cache directory is set)
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+      key (string): the key of the payload, see payloadKey
+
+    Returns:
+      tuple: the payload, the metadata ('@id', '_project', '_rev', '_self') and the
+      ETag of the resource (dict, or None if it is not cached), and whether it was
+      retrieved or checked by this process. The payloads of the previous runs are
+      not trusted before a request to Nexus with the token of this process, as the
+      cache directory may be shared with users who can read other resources.
+    """
+    entry = PAYLOADS_MEMO.get(key)
+    if entry is not None:
+        return entry, True
+    cache_dir = getCacheDir(args.cache_dir)
+    if cache_dir:
+        entry = readJsonEntry(cache_dir, "payloads", key)
+    return entry, False
+
+
+def storePayload(args, key, res, payload):
+    """Cache the payload of a resource (see readPayload)
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+      key (string): the key of the payload, see payloadKey
+      res: the retrieved resource
+      payload (dict): its payload, as serialized by the engine
+    """
+    metadata = {"@id": res.get_identifier()}
+    for name in ["_project", "_rev", "_self"]:
+        value = getattr(getattr(res, "_store_metadata", None), name, None)
+        if value is not None:
+            metadata[name] = value
+    entry = {
+        "payload": copy.deepcopy(payload),
+        "metadata": metadata,
+        "etag": getattr(res, "etag", None),
+    }
+    if PAYLOADS_MEMO.get(key) == entry:
+        return
+
+    PAYLOADS_MEMO[key] = entry
+    cache_dir = getCacheDir(args.cache_dir)
+    if cache_dir:
+        writeJsonEntry(cache_dir, "payloads", key, entry)
+        # the payloads count in the size of the cache
+        cache = getDistributionCache(args)
+        if cache.max_size is not None:
+            cache.gc()
+
+
+def revalidateResource(engine, res):
+    """Get the latest revision of a resource retrieved earlier, with a conditional
+    request if the engine can (see NexusClient.revalidate)
+
+    Returns:
+      the same resource if it did not change, its latest revision otherwise, or None
+      if it cannot be revalidated (it is then retrieved as usual)
+    """
+    revalidate = getattr(engine, "revalidate", None)
+    if revalidate is None:
+        return None
+    try:
+        return revalidate(res)
+    except Exception as e:
+        logging.info(f"Resource '{res.get_identifier()}' not revalidated: {e}")
+        return None
+
+
+def getJobs(args):
+    """Get the number of fetches to run concurrently: the value of --jobs if provided,
+    otherwise the max_connection of the Store in the forge configuration (read once
+    per process)
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+
+    Returns:
+      int: the number of concurrent jobs (at least 1)
+    """
+    if args.jobs:
+        return max(1, args.jobs)
+
+    if args.forge_config not in JOBS_MEMO:
+        try:
+            import yaml
+
+            with open(args.forge_config, "r") as f:
+                forge_config = yaml.safe_load(f)
+            jobs = max(1, int(forge_config["Store"]["max_connection"]))
+        except Exception:
+            jobs = 1
+        JOBS_MEMO[args.forge_config] = jobs
+    return JOBS_MEMO[args.forge_config]
+
+
+def getVersion(rev=None, tag=None):
+    """Get the version of a resource to retrieve, from its revision or its tag
+
+    Returns:
+      the revision (int), the tag (string) or None for the latest revision
+    """
+    if rev:
+        return int(rev)
+    return tag or None
+
+
+def getContentSize(distribution):
+    """Get the size of a distribution file, in bytes
+
+    Args:
+      distribution (dict): the distribution of the resource
+
+    Returns:
+      int: the size, or None if the distribution does not give it
+    """
+    content_size = distribution.get("contentSize")
+    if isinstance(content_size, dict):
+        if content_size.get("unitCode", "bytes") != "bytes":
+            return None
+        content_size = content_size.get("value")
+    try:
+        return int(content_size)
+    except (TypeError, ValueError):
+        return None
+
+
+def getDistributionCache(args):
+    """Get the local cache of distribution files, if enabled
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+
+    Returns:
+      :obj:`DistributionCache`: the cache, or None if no cache directory is set
+    """
+    cache_dir = getCacheDir(args.cache_dir)
+    if not cache_dir:
+        return None
+
+    max_size = parseSize(args.cache_max_size or os.environ.get(CACHE_MAX_SIZE_ENV))
+    return DistributionCache(cache_dir, max_size)
+
+
+def diagnoseDigestMismatch(args, file_org, file_project, file_id, distribution):
+    """Explain why a downloaded file does not have the digest of the distribution, by
+    fetching the metadata of the file
+
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace
+      file_org (string): the organization of the file
+      file_project (string): the project of the file
+      file_id (string): the id of the file
+      distribution (dict): the distribution of the resource
+
+    Returns:
+      string: the explanation
+    """
+    try:
+        file_payload = importNexus(args).files.fetch(file_org, file_project, file_id)
+    except Exception as e:
+        return f"Cannot fetch the metadata of the file: {e}"
+
+    # If hashes are different, it means the File has changed (new rev) and the
+    # resource was not updated accordingly, hence the metadata in the payload
+    # may be wrong.
+    if distribution["digest"]["value"] != file_payload["_digest"]["_value"]:
+        return (
+            "Hash mismatch. The resource distribution is no longer in sync with the "
+            "file resource."
+        )
+    return (
+        "The file resource has the digest of the distribution, the transfer was most "
+        "likely corrupted."
+    )
+
+
+def getOutputPath(out, res, extension=None):
+    """Get the path of the file to write, and create its parent directory
+
+    Args:
+      out (string): the output, either a file path or a directory
+      res: the retrieved resource (named after its @id if out is a directory)
+      extension (string): OPTIONAL extension of the file named after the @id
+
+    Returns:
+      tuple: the path of the file and its extension (None if out is a directory and
+      no extension is given)
+    """
+    if os.path.isdir(out):
+        filename = res.get_identifier().replace("/", "_")
+        if extension:
+            filename += f".{extension}"
+        out_filepath = os.path.join(out, filename)
+        output_extension = extension
+    else:
+        out_filepath = out
+        output_extension = out_filepath.split(".").pop().lower()
+
+    # Make sure the parent directory of the specified output exist, if not, create it
+    # (exist_ok, since concurrent fetches of a batch may create it at the same time)
+    parent_dir = os.path.dirname(out_filepath)
+    if parent_dir and not os.path.isdir(parent_dir):
+        os.makedirs(parent_dir, exist_ok=True)
+
+    return out_filepath, output_extension
+
+
+def selectDistribution(resource, favor):
+    """Select the distribution to fetch, among the distributions of a resource
+
+    Args:
+      resource (dict): the payload of the resource
+      favor ([str]): properties and values with the format 'properties:value'
+        (ex: 'name:1.json') to choose among several distributions
+
+    Returns:
+      dict: the distribution
+    """
+    if "distribution" not in resource:
+        raise DistributionError("The resource has no distribution")
+
+    distribution = resource["distribution"]
+    if distribution == [] or not isinstance(distribution, (dict, list)):
+        raise DistributionError("The resource has no distribution")
+    if isinstance(resource["distribution"], list):
+        logging.info(
+            "Resource distribution property is a list. Therefore several files "
+            "are linked to it: "
+        )
+        distrib_found = []
+        for distrib in resource["distribution"]:
+            logging.info(f"=> '{distrib.get('name')}'")
+            for favor_value in favor:
+                prop_val_list = favor_value.split(":")
+                if (
+                    prop_val_list[0] in distrib
+                    and prop_val_list[1] == distrib[prop_val_list[0]]
+                ):
+                    distrib_found.append((favor_value, distrib))
+
+        if distrib_found:
+            distribution = distrib_found[0][1]
+            for distrib_favor in distrib_found:
+                logging.info(
+                    f"--favor argument '{distrib_favor[0]}' corresponds to the "
+                    f"'{distrib_favor[1].get('name')}' distribution."
+                )
+            if len(distrib_found) > 1:
+                logging.warning(
+                    "⚠️  More than one distribution has a correspondence with "
+                    "the --favor arguments values."
+                )
+                logging.info(
+                    "Fetching the first corresponding distribution with "
+                    f"'{distribution.get('name')}' as file name by default..."
+                )
+            else:
+                logging.info(
+                    f"Fetching the corresponding distribution with "
+                    f"'{distribution.get('name')}' as file name..."
+                )
+
+        else:
+            distribution = resource["distribution"][0]
+            if not favor:
+                logging.warning("⚠️  --flavor argument has not been provided.")
+            else:
+                logging.warning(
+                    "⚠️  No distribution has a correspondence with a provided "
+                    "--favor argument."
+                )
+                logging.info(
+                    "Fetching the first distribution with "
+                    f"'{distribution.get('name')}' as file name by default..."
+                )
+
+    # what the download needs
+    missing = [
+        key for key in ["name", "contentUrl", "digest"] if key not in distribution
+    ]
+    digest = distribution.get("digest")
+    if "digest" in distribution and not (
+        isinstance(digest, dict) and "algorithm" in digest and "value" in digest
+    ):
+        missing.append("digest algorithm and value")
+    if missing:
+        raise DistributionError(
+            f"The distribution of the resource has no {', '.join(missing)}"
+        )
+
+    return distribution
+
+
+class Fetcher:
+    """Fetch resources from a Nexus project, reusing the same forge, client and
+    caches"""
+
+    def __init__(self, nexus_env, nexus_token, nexus_org, nexus_proj, engine=None,
+                 **options):
+        """
+        Args:
+          nexus_env (string): URL to the Nexus environment
+          nexus_token (string): the Nexus token
+          nexus_org (string): the organization of the resources
+          nexus_proj (string): the project of the resources
+          engine: OPTIONAL the KnowledgeGraphForge or NexusClient retrieving all the
+            resources (by default, a NexusClient retrieves the resources whose
+            distribution is fetched, and a forge the resources whose payload is)
+          **options: the options of the command line (see DEFAULT_OPTIONS)
+        """
+        unknown_options = set(options) - set(DEFAULT_OPTIONS)
+        if unknown_options:
+            raise TypeError(f"unknown options {sorted(unknown_options)}")
+
+        self.args = argparse.Namespace(**dict(DEFAULT_OPTIONS, **options))
+        self.args.nexus_env = nexus_env.rstrip("/")
+        self.args.nexus_token = nexus_token
+        self.args.nexus_org = nexus_org
+        self.args.nexus_proj = nexus_proj
+        self.engine = engine
+        self.client = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def fromArgs(cls, args, engine=None):
+        """Create a Fetcher from the parameters namespace of the command line"""
+        options = {key: getattr(args, key) for key in DEFAULT_OPTIONS}
+        return cls(
+            args.nexus_env,
+            args.nexus_token,
+            args.nexus_org,
+            args.nexus_proj,
+            engine=engine,
+            **options,
+        )
+
+    def getEngine(self, use_forge=False):
+        """Get what retrieves the resources: the engine given to the Fetcher, or a
+        forge (if use_forge or the use_forge option) or a NexusClient"""
+        if self.engine is not None:
+            return self.engine
+        if use_forge or self.args.use_forge:
+            return buildForge(self.args)
+        return self.getClient()
+
+    def getClient(self):
+        """Get the NexusClient of the Fetcher (built on the first call)"""
+        with self.lock:
+            if self.client is None:
+                self.client = buildClient(self.args)
+            return self.client
+
+    def prefetch(self, ids, use_forge=False):
+        """Retrieve the latest revision of many resources at once (see
+        NexusClient.retrieveMany), so that fetching them does not take any further
+        request. The resources which are not found this way (eg. in another project)
+        are retrieved one by one, as usual.
+
+        Args:
+          ids ([str]): the @id of the resources
+          use_forge (bool): OPTIONAL whether the payloads are then serialized by a
+            forge (see getEngine)
+
+        Returns:
+          :obj:`PrefetchedEngine`: the engine of the Fetcher from now on, which can be
+          given to other Fetchers
+        """
+        resources = prefetchResources(self.args, self.getClient(), ids)
+        self.engine = PrefetchedEngine(self.getEngine(use_forge), resources)
+        return self.engine
+
+    def resolve(self, filters):
+        """Get the @id of the resources matching some filters
+
+        Args:
+          filters ([str]): the filters, as on the command line (eg.
+            'brainLocation.brainRegion=mba:1048')
+
+        Returns:
+          [str]: the @id of the resources (NoMatchError is raised if there is none)
+        """
+        args = copy.copy(self.args)
+        args.filter = list(filters)
+        ids = runQuery(getFilteredIds, args)
+        if not ids:
+            raise NoMatchError(f"No match for the filter {' '.join(filters)}")
+        return ids
+
+    def resolveMany(self, filter_sets):
+        """Get the @id of the resources matching each of several sets of filters,
+        with a single query (see resolveFilterSets)
+
+        Args:
+          filter_sets ([[str]]): the sets of filters, as on the command line
+
+        Returns:
+          [[str]]: the @id of the resources matching each set (NoMatchError is
+          raised if a set matches none)
+        """
+        filter_sets = [list(filters) for filters in filter_sets]
+        sets_ids = runQuery(resolveFilterSets, self.args, filter_sets)
+        for (filters, ids) in zip(filter_sets, sets_ids):
+            if not ids:
+                raise NoMatchError(f"No match for the filter {' '.join(filters)}")
+        return sets_ids
+
+    def iterResolve(self, filters):
+        """Get the @id of the resources matching some filters, as they are received
+        (the SPARQL query being run by pages)
+
+        Args:
+          filters ([str]): the filters, as on the command line
+
+        Returns:
+          generator: the @id of the resources
+        """
+        args = copy.copy(self.args)
+        args.filter = list(filters)
+        return iterQuery(iterFilteredIds(args))
+
+    def iterResolveMatches(self, filters):
+        """Get the @id of the resources matching some filters, grouped by the value
+        of their set-membership filter (eg. 'brainRegion=in(mba:1048,mba:997)')
+
+        Args:
+          filters ([str]): the filters, as on the command line
+
+        Returns:
+          generator: the (@id, group) of the resources, ordered by @id, the group
+          being the value matched as given in the filter (None if no filter is a
+          set-membership one)
+        """
+        args = copy.copy(self.args)
+        args.filter = list(filters)
+        return iterQuery(iterFilteredMatches(args))
+
+    def retrieve(self, id, rev=None, tag=None, use_forge=False):
+        """Retrieve a resource
+
+        Args:
+          id (string): the @id of the resource
+          rev (int): OPTIONAL the revision of the resource
+          tag (string): OPTIONAL the tag of the resource
+          use_forge (bool): OPTIONAL retrieve the resource with a forge (see
+            getEngine)
+
+        Returns:
+          tuple: the resource (as returned by the engine) and its payload (dict)
+        """
+        engine = self.getEngine(use_forge)
+        try:
+            version = getVersion(rev, tag)
+        except ValueError as e:
+            raise ResourceNotFoundError(f"Invalid revision '{rev}'") from e
+        pinned = isPinned(id, version)
+        key = payloadKey(self.args, id, version, engine)
+        entry, checked = readPayload(self.args, key)
+        cached = entry and NexusResource(
+            entry["payload"], entry["metadata"], entry["etag"]
+        )
+        # a pinned revision never changes, while the latest one is revalidated
+        if entry and pinned and checked:
+            logging.info(f"Resource '{id}' read from the cache")
+            return cached, copy.deepcopy(entry["payload"])
+        try:
+            res = revalidateResource(engine, cached) if entry else None
+            # a pinned revision cached by a previous run is served once the resource
+            # is found readable with the token of this process
+            if entry and pinned and res is not None:
+                PAYLOADS_MEMO[key] = entry
+                logging.info(f"Resource '{id}' read from the cache")
+                return cached, copy.deepcopy(entry["payload"])
+            if res is cached and res is not None:
+                logging.info(f"Resource '{id}' did not change since it was cached")
+                return cached, copy.deepcopy(entry["payload"])
+            if not res:
+                res = self.retrieveFromBucket(engine, id, version)
+            if not res:
+                res = engine.retrieve(
+                    id, version=version, cross_bucket=self.args.cross_bucket
+                )
+            if not res:
+                raise ResourceNotFoundError(f"Resource '{id}' not found")
+            if self.args.cross_bucket:
+                storeBucket(self.args, id, res)
+            payload = engine.as_json(res)
+            if pinned or hasattr(engine, "revalidate"):
+                storePayload(self.args, key, res, payload)
+            return res, payload
+        except ResourceNotFoundError:
+            raise
+        except Exception as e:
+            raise ResourceNotFoundError(str(e)) from e
+
+    def retrieveFromBucket(self, engine, id, version):
+        """Retrieve a resource directly from the bucket it was found in by a previous
+        resolution across the buckets (see readBucket), instead of resolving it again
+
+        Args:
+          engine: the forge or the client retrieving the resources
+          id (string): the @id of the resource
+          version: the revision (int) or the tag (string) of the resource, if any
+
+        Returns:
+          the resource, or None if its bucket is not known, or cannot be read by the
+          engine, or does not have the resource (anymore)
+        """
+        bucket = readBucket(self.args, id) if self.args.cross_bucket else None
+        if bucket is None:
+            return None
+
+        # a forge is bound to org/proj, while a NexusClient can read any bucket
+        if bucket == [self.args.nexus_org, self.args.nexus_proj]:
+            bucket_engine = engine
+        else:
+            in_bucket = getattr(engine, "inBucket", None)
+            bucket_engine = in_bucket(*bucket) if in_bucket else None
+        if bucket_engine is None:
+            return None
+
+        try:
+            res = bucket_engine.retrieve(id, version=version, cross_bucket=False)
+        except Exception as e:
+            logging.info(f"Resource '{id}' not read from {'/'.join(bucket)}: {e}")
+            return None
+        if not res:
+            logging.info(f"Resource '{id}' not in {'/'.join(bucket)} anymore")
+        return res
+
+    def fetchPayload(self, id, out, rev=None, tag=None, keep_meta=False):
+        """Write the payload of a resource in a JSON file
+
+        Args:
+          id (string): the @id of the resource
+          out (string): the JSON file to write, or a directory (the file being then
+            named after the @id)
+          rev (int): OPTIONAL the revision of the resource
+          tag (string): OPTIONAL the tag of the resource
+          keep_meta (bool): OPTIONAL keep the Nexus metadata in the payload
+
+        Returns:
+          string: the path of the file written
+        """
+        # the payload is written as the forge serializes it
+        res, resource = self.retrieve(id, rev, tag, use_forge=True)
+        return self.writePayload(res, resource, out, keep_meta)
+
+    def writePayload(self, res, resource, out, keep_meta=False):
+        """Write the payload of a retrieved resource in a JSON file (see fetchPayload)
+
+        Args:
+          res: the resource (named after its @id if out is a directory)
+          resource (dict): its payload
+          out (string): the JSON file to write, or a directory
+          keep_meta (bool): OPTIONAL keep the Nexus metadata in the payload
+
+        Returns:
+          string: the path of the file written
+        """
+        out_filepath, output_extension = getOutputPath(out, res, "json")
+
+        # If there is no file attached to the resource, we want to write the payload as
+        # a JSON output file. Though if the extension of the given output is not json,
+        # then we raise an error.
+        if output_extension != "json":
+            raise OutputError(
+                "To save the payload, the extension of the file must be .json"
+            )
+
+        # removing the file if it exists
+        if os.path.exists(out_filepath):
+            os.remove(out_filepath)
+
+        # sanitize from all the Nexus meta
+        if not keep_meta:
+            for key in NEXUS_METADATA:
+                resource.pop(key, None)
+
+        # write the resource payload as a json file
+        with open(out_filepath, "w+") as f:
+            f.write(json.dumps(resource, indent=2))
+
+        logging.info("✅  File saved at {}".format(out_filepath))
+        return out_filepath
+
+    def fetchDistribution(self, id, out, rev=None, tag=None, favor=()):
+        """Write the distribution file of a resource
+
+        Args:
+          id (string): the @id of the resource
+          out (string): the file to write (with the extension of the distribution),
+            or a directory
+          rev (int): OPTIONAL the revision of the resource
+          tag (string): OPTIONAL the tag of the resource
+          favor ([str]): OPTIONAL properties and values with the format
+            'properties:value' (ex: 'name:1.json') to choose among several
+            distributions
+
+        Returns:
+          string: the path of the file written
+        """
+        res, resource = self.retrieve(id, rev, tag)
+        distribution = selectDistribution(resource, favor)
+        return self.writeDistribution(res, distribution, out)
+
+    def writeDistribution(self, res, distribution, out):
+        """Write a distribution file of a retrieved resource (see fetchDistribution)
+
+        Args:
+          res: the resource, whose project is in its metadata
+          distribution (dict): the distribution to download, with its name,
+            contentUrl and digest
+          out (string): the file to write (with the extension of the distribution),
+            or a directory
+
+        Returns:
+          string: the path of the file written
+        """
+        args = self.args
+        out_filepath, output_extension = getOutputPath(out, res)
+
+        linked_file_extension = distribution["name"].split(".").pop().lower()
+
+        # check that extension of distribution file and the output is the same (case
+        # not sensitive)
+        if output_extension and linked_file_extension != output_extension:
+            raise OutputError(
+                f"The provided output extension is '.{output_extension}' while "
+                f"the distribution file extension is '.{linked_file_extension}' "
+                "- They must be the same."
+            )
+
+        # with 'cross_bucket=True', the file bucket may be different from org/proj
+        separator = "/"
+        fields = res._store_metadata._project.split(separator)
+        file_org = fields[-2]
+        file_project = fields[-1]
+        file_bucket = separator.join([file_org, file_project])
+        file_id = distribution["contentUrl"].split(file_bucket + separator)[-1]
+        # as of nexusforge 0.8.1, the distribution.contentUrl may contain "%2F"
+        raw_file_id = unquote(file_id)
+
+        digest_algorithm = distribution["digest"]["algorithm"]
+        digest_value = distribution["digest"]["value"]
+
+        # the existing output may already be the right file
+        if args.incremental:
+            try:
+                if isUpToDate(out_filepath, digest_algorithm, digest_value):
+                    logging.info(f"✅  File {out_filepath} is up to date")
+                    return out_filepath
+            except ValueError as e:
+                logging.warning(f"⚠️  Cannot check the existing output: {e}")
+
+        # the file may already be in the local cache, under the same digest
+        cache = getDistributionCache(args)
+        if cache and cache.fetch(digest_algorithm, digest_value, out_filepath):
+            logging.info(f"✅  File saved at {out_filepath} (from the cache)")
+            return out_filepath
+
+        # fetching the file. It is written in a .part file first, renamed into the
+        # output once complete and checked against the digest of the distribution
+        # (hence a file of the cache the output may be a hardlink to is left as is)
+        session = getSession(args.nexus_token, getJobs(args) * max(args.segments, 1))
+        file_url = getFileUrl(args.nexus_env, file_org, file_project, raw_file_id)
+        content_size = getContentSize(distribution)
+        try:
+            if (
+                args.segments > 1
+                and content_size
+                and content_size >= parseSize(args.segment_threshold)
+            ):
+                downloadSegmented(
+                    session,
+                    file_url,
+                    out_filepath,
+                    digest_algorithm,
+                    digest_value,
+                    content_size,
+                    args.segments,
+                    retries=args.retries,
+                    buffer_size=parseSize(args.buffer_size),
+                )
+            else:
+                downloadFile(
+                    session,
+                    file_url,
+                    out_filepath,
+                    digest_algorithm,
+                    digest_value,
+                    retries=args.retries,
+                    buffer_size=parseSize(args.buffer_size),
+                )
+        except DigestMismatchError as e:
+            diagnosis = diagnoseDigestMismatch(
+                args, file_org, file_project, raw_file_id, distribution
+            )
+            raise DigestMismatchError(f"{e}. {diagnosis}") from e
+        except Exception as e:
+            raise DownloadError(str(e)) from e
+
+        logging.info(f"✅  File saved at {out_filepath}")
+
+        if cache:
+            cache.store(digest_algorithm, digest_value, out_filepath)
+
+        return out_filepath
+
+    def lockResource(self, id, rev=None, tag=None, favor=(), payload=False):
+        """Resolve what a fetch writes, so that it can be written later without any
+        query to Nexus (see fetchLocked)
+
+        Args:
+          id (string): the @id of the resource
+          rev (int): OPTIONAL the revision of the resource
+          tag (string): OPTIONAL the tag of the resource
+          favor ([str]): OPTIONAL properties and values to choose among several
+            distributions (see fetchDistribution)
+          payload (bool): OPTIONAL lock the payload of the resource instead of its
+            distribution file
+
+        Returns:
+          dict: the '@id', '_rev' and '_project' of the resource, and its payload (as
+          the forge serializes it) or its chosen distribution
+        """
+        res, resource = self.retrieve(id, rev, tag, use_forge=payload)
+        entry = {
+            "@id": res.get_identifier(),
+            "_rev": getattr(res._store_metadata, "_rev", None),
+            "_project": res._store_metadata._project,
+        }
+        if payload:
+            entry["payload"] = resource
+        else:
+            entry["distribution"] = selectDistribution(resource, favor)
+        return entry
+
+    def fetchLocked(self, entry, out, keep_meta=False):
+        """Write the payload or the distribution file locked by lockResource, without
+        retrieving the resource
+
+        Args:
+          entry (dict): the entry returned by lockResource
+          out (string): the file to write, or a directory
+          keep_meta (bool): OPTIONAL keep the Nexus metadata in the payload
+
+        Returns:
+          string: the path of the file written
+        """
+        res = NexusResource(
+            entry.get("payload", {}),
+            {key: entry[key] for key in ["@id", "_rev", "_project"]},
+        )
+        if "payload" in entry:
+            payload = copy.deepcopy(entry["payload"])
+            return self.writePayload(res, payload, out, keep_meta)
+        return self.writeDistribution(res, entry["distribution"], out)
@@ -0,0 +1,81 @@
+"""
+Read and write the lockfiles. A lockfile is written by the 'resolve' subcommand and
+records, for each fetch, what its filters resolved to: the @id, the revision and the
+project of the resource, and its payload or the distribution chosen among its
+distributions (with its contentUrl, contentSize and digest). Fetching with
+--locked then writes the same files again, without any query to Nexus (neither
+SPARQL, nor context, nor resource retrieval): only the distribution files are
+downloaded.
+
+A lockfile is a JSON file:
+    {
+        "version": 1,
+        "nexus_env": "https://bbp.epfl.ch/nexus/v1",
+        "fetches": [
+            {"out": "./tmp/annotation.nrrd", "@id": "https://some/id", "_rev": 3,
+             "_project": "https://bbp.epfl.ch/nexus/v1/projects/bbp/atlas",
+             "distribution": {"name": "annotation.nrrd", "contentUrl": "...",
+                              "contentSize": {...}, "digest": {...}}},
+            {"out": "./tmp/positions.json", "keep_meta": false, ...,
+             "payload": {...}}
+        ]
+    }
+"""
+
+import os
+import json
+import uuid
+
+LOCKFILE_VERSION = 1
+
+# the keys every fetch of a lockfile has
+LOCKED_KEYS = ["out", "@id", "_rev", "_project"]
+
+
+def writeLockfile(lockfile_path, nexus_env, fetches):
+    """Write (atomically) a lockfile
+
+    Args:
+      lockfile_path (string): path to the lockfile
+      nexus_env (string): URL to the Nexus environment the fetches were resolved in
+      fetches ([dict]): the locked fetches (see Fetcher.lockResource), with their
+        'out'
+    """
+    lock = {"version": LOCKFILE_VERSION, "nexus_env": nexus_env, "fetches": fetches}
+    directory = os.path.dirname(os.path.abspath(lockfile_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{lockfile_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(lock, f, indent=2)
+        os.replace(tmp_path, lockfile_path)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+
+def readLockfile(lockfile_path):
+    """Read and check a lockfile
+
+    Args:
+      lockfile_path (string): path to the lockfile
+
+    Returns:
+      dict: the lockfile, with its 'nexus_env' and its 'fetches'
+    """
+    with open(lockfile_path, "r") as f:
+        lock = json.load(f)
+
+    if not isinstance(lock, dict) or lock.get("version") != LOCKFILE_VERSION:
+        raise ValueError(f"not a lockfile of version {LOCKFILE_VERSION}")
+    if not isinstance(lock.get("fetches"), list):
+        raise ValueError("the lockfile must contain a list of fetches")
+
+    for i, fetch in enumerate(lock["fetches"]):
+        missing = [key for key in LOCKED_KEYS if key not in fetch]
+        if "payload" not in fetch and "distribution" not in fetch:
+            missing.append("payload or distribution")
+        if missing:
+            raise ValueError(f"fetch {i} misses {', '.join(missing)}")
+
+    return lock
@@ -2,30 +2,71 @@
 Download the file attached to a given resource from Nexus.
 If no file is attached and the output required is actually the payload, then the
 output extension must be .json
+
+The heavy dependencies (nexussdk, kgforge, requests, yaml) are imported by the
+functions that need them, so that the startup of the CLI (eg. --version or invalid
+arguments) does not pay for them.
+
+The fetches themselves are run by a Fetcher (see bba_data_fetch.fetcher), this module
+turning its exceptions into error messages and exit statuses.
 """
 
 import argparse
-import re
+import copy
 import sys
 import os
-import json
-import string
-import random
+import signal
 import logging
-import nexussdk as nexus
 
-from urllib.parse import unquote
-
-from kgforge.core import KnowledgeGraphForge
+from itertools import islice
+from concurrent.futures import as_completed
 
 from bba_data_fetch import __version__
+from bba_data_fetch.batch import readManifest, entryArgs
+from bba_data_fetch.cache import (
+    CACHE_MAX_SIZE_ENV,
+    DistributionCache,
+    getCacheDir,
+    parseSize,
+    formatSize,
+)
+# NexusClient and getContentSize, historically defined in this module, are re-exported
+from bba_data_fetch.client import BULK_SIZE, NexusClient, PrefetchedEngine  # noqa: F401
+from bba_data_fetch.daemon import FetchDaemon, delegate, getSocketPath
+from bba_data_fetch.download import ContextExecutor
+from bba_data_fetch.errors import FetchError
+from bba_data_fetch.fetcher import (  # noqa: F401
+    Fetcher,
+    buildClient,
+    buildForge,
+    getContentSize,
+    getJobs,
+    prefetchResources,
+)
+from bba_data_fetch.lock import readLockfile, writeLockfile
+
+# so are the functions resolving the filters
+from bba_data_fetch.query import (  # noqa: F401
+    SEARCH_BACKENDS,
+    randomString,
+    extractListIndexFromPropName,
+    createRestFirstSequence,
+    buildLowercaseContextLut,
+    translateFilters,
+    normalizeFilters,
+    buildSparqlQuery,
+    buildCanonicalSparqlQuery,
+    queryFingerprint,
+    extractContext,
+    getContext,
+    getFilteredIds,
+    iterFilteredIds,
+)
 
 __author__ = "Jonathan Lurie"
 __copyright__ = "EPFL - The Blue Brain Project"
 __license__ = ""
 
-UNKNOWN_CONTEXT_SHORT = "unknown:"
-
 
 def parse_args(args):
     """Parse command line parameters
@@ -98,7 +139,54 @@ def parse_args(args):
         "(optional, defaults to True)",
     )
 
-    parser.add_argument("--out", dest="out", required=True, help="Output filepath")
+    parser.add_argument(
+        "--use-forge",
+        dest="use_forge",
+        action="store_true",
+        help="OPTIONAL Retrieve the resources with a KnowledgeGraphForge even when "
+        "fetching a distribution file (which are otherwise retrieved directly from "
+        "the Nexus API, the forge being only built to fetch a --payload)",
+    )
+
+    parser.add_argument(
+        "--out",
+        dest="out",
+        required=False,
+        default=None,
+        help="Output filepath (mandatory, unless --manifest is provided)",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        dest="manifest",
+        required=False,
+        default=None,
+        help="OPTIONAL Path to a JSON, YAML or CSV manifest listing several fetches "
+        "(each with its own --nexus-id or --filter, --out, --favor, --payload...) to "
+        "run in a single process, sharing the same Nexus configuration and forge "
+        "instance",
+    )
+
+    parser.add_argument(
+        "--locked",
+        dest="locked",
+        required=False,
+        default=None,
+        help="OPTIONAL Path to a lockfile written by 'bba-data-fetch resolve': its "
+        "fetches are run without any query to Nexus. Replaces --nexus-id, --filter, "
+        "--manifest and --out",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        dest="jobs",
+        type=int,
+        required=False,
+        default=None,
+        help="OPTIONAL Number of fetches of the --manifest (or of --all-matches) to "
+        "run concurrently (defaults to the Store max_connection of the forge "
+        "configuration)",
+    )
 
     parser.add_argument(
         "--favor",
@@ -153,6 +241,172 @@ def parse_args(args):
         "bufferEncoding=gzip'). Optional but necessary of --nexus-id is not provided.",
     )
 
+    parser.add_argument(
+        "--retries",
+        dest="retries",
+        type=int,
+        required=False,
+        default=3,
+        help="OPTIONAL Number of times an interrupted download is resumed (defaults "
+        "to 3). An incomplete download left by a failed run is also resumed by the "
+        "next run",
+    )
+
+    parser.add_argument(
+        "--buffer-size",
+        dest="buffer_size",
+        required=False,
+        default=None,
+        help="OPTIONAL Size of the chunks in which the distribution files are "
+        "streamed to the disk (ex: '4M', defaults to 1M). The memory used by a "
+        "download does not depend on the size of the file",
+    )
+
+    parser.add_argument(
+        "--segments",
+        dest="segments",
+        type=int,
+        required=False,
+        default=1,
+        help="OPTIONAL Number of connections used to download a large distribution "
+        "file, each of them fetching a byte range of the file (defaults to 1, no "
+        "segmented download). Only the files above --segment-threshold are "
+        "downloaded by segments",
+    )
+
+    parser.add_argument(
+        "--segment-threshold",
+        dest="segment_threshold",
+        required=False,
+        default="256M",
+        help="OPTIONAL Size (from the contentSize of the distribution) above which a "
+        "file is downloaded by segments, see --segments (defaults to 256M)",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        help="OPTIONAL If the output file already exists and has the same digest as "
+        "the distribution, it is kept as is instead of being downloaded again",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        required=False,
+        default=None,
+        help="OPTIONAL Directory of the local cache of distribution files, where the "
+        "files are stored by digest and served without downloading them again "
+        "(defaults to the BBA_DATA_FETCH_CACHE_DIR environment variable, no cache if "
+        "not set)",
+    )
+
+    parser.add_argument(
+        "--cache-max-size",
+        dest="cache_max_size",
+        required=False,
+        default=None,
+        help="OPTIONAL Maximum size of the cache (ex: '20G'), the least recently used "
+        "files being evicted beyond it (defaults to the BBA_DATA_FETCH_CACHE_MAX_SIZE "
+        "environment variable, no limit if not set)",
+    )
+
+    parser.add_argument(
+        "--context-ttl",
+        dest="context_ttl",
+        type=float,
+        required=False,
+        default=86400,
+        help="OPTIONAL Time (in seconds) during which the context used to translate "
+        "the --filter is used from the cache without checking if it changed in Nexus "
+        "(defaults to 86400)",
+    )
+
+    parser.add_argument(
+        "--filter-cache-ttl",
+        dest="filter_cache_ttl",
+        type=float,
+        required=False,
+        default=0,
+        help="OPTIONAL Time (in seconds) during which the ids matching a set of "
+        "--filter are reused without querying Nexus again (defaults to 0, no reuse)",
+    )
+
+    parser.add_argument(
+        "--page-size",
+        dest="page_size",
+        type=int,
+        required=False,
+        default=10000,
+        help="OPTIONAL Number of results per page of the SPARQL query resolving the "
+        "--filter (defaults to 10000, 0 to get all the results at once)",
+    )
+
+    parser.add_argument(
+        "--search-backend",
+        dest="search_backend",
+        choices=SEARCH_BACKENDS,
+        required=False,
+        default="sparql",
+        help="OPTIONAL Backend resolving the --filter: sparql, elastic (faster, for "
+        "the filters on the properties of the payloads) or auto (elastic unless the "
+        "filters address the elements of a list, or are dotted and might traverse "
+        "the graph). Defaults to sparql",
+    )
+
+    parser.add_argument(
+        "--all-matches",
+        dest="all_matches",
+        action="store_true",
+        help="OPTIONAL Fetch all the resources matching the --filter (instead of the "
+        "first one) concurrently, into the --out directory (each file being named "
+        "after the @id of its resource)",
+    )
+
+    parser.add_argument(
+        "--pin-filters",
+        dest="pin_filters",
+        action="store_true",
+        help="OPTIONAL Pin the ids matching the --filter: they are reused by the "
+        "next fetches with the same filters, whatever --filter-cache-ttl",
+    )
+
+    parser.add_argument(
+        "--refresh-filters",
+        dest="refresh_filters",
+        action="store_true",
+        help="OPTIONAL Query Nexus for the ids matching the --filter even if they "
+        "were cached or pinned",
+    )
+
+    parser.add_argument(
+        "--socket",
+        dest="socket",
+        required=False,
+        default=None,
+        help="OPTIONAL Socket of the fetch daemon (see 'bba-data-fetch serve') to "
+        "delegate the fetch to, if it is running (defaults to the "
+        "BBA_DATA_FETCH_SOCKET environment variable, or a path specific to the user)",
+    )
+
+    parser.add_argument(
+        "--prefetch",
+        dest="prefetch",
+        action="store_true",
+        help="OPTIONAL Retrieve the latest revision of the resources of a --manifest "
+        "(or of --all-matches) at once from the Elasticsearch view of the project, "
+        "instead of one by one. The view being indexed asynchronously, a resource "
+        "updated a few seconds earlier may be fetched at its previous revision",
+    )
+
+    parser.add_argument(
+        "--no-daemon",
+        dest="no_daemon",
+        action="store_true",
+        help="OPTIONAL Fetch in this process even if a fetch daemon is running",
+    )
+
     parser.add_argument(
         "--verbose", dest="verbose", action="store_true", help="OPTIONAL Verbose mode"
     )
@@ -165,6 +419,49 @@ def parse_args(args):
     else:
         logging.basicConfig(format="%(message)s", level=logging.WARNING)
 
+    try:
+        parseSize(args.cache_max_size or os.environ.get(CACHE_MAX_SIZE_ENV))
+        parseSize(args.buffer_size)
+        parseSize(args.segment_threshold)
+    except ValueError as e:
+        logging.error(f"❌ {e}")
+        exit(1)
+
+    if args.locked:
+        if args.manifest or args.nexus_id or args.filter:
+            logging.error(
+                "❌ Arguments --locked and --manifest/--nexus-id/--filter are mutually "
+                "exclusive."
+            )
+            exit(1)
+        return args
+
+    if args.manifest:
+        if args.nexus_id or args.filter:
+            logging.error(
+                "❌ Arguments --manifest and --nexus-id/--filter are mutually exclusive."
+            )
+            exit(1)
+        return args
+
+    if not args.out:
+        logging.error(
+            "❌ If the argument --manifest is missing, the argument --out becomes "
+            "mandatory."
+        )
+        exit(1)
+
+    if args.all_matches:
+        if not args.filter:
+            logging.error("❌ The argument --all-matches requires --filter.")
+            exit(1)
+        if os.path.exists(args.out) and not os.path.isdir(args.out):
+            logging.error(
+                "❌ With --all-matches, the argument --out must be a directory."
+            )
+            exit(1)
+        os.makedirs(args.out, exist_ok=True)
+
     if os.path.isdir(args.out):
         logging.info(f"The '--out' argument provided ('{args.out}'), is a directory, "
             "hence the downloaded file will be saved using the nexus-id as filename.")
@@ -183,511 +480,766 @@ def parse_args(args):
     return args
 
 
-def randomString(stringLength=5):
-    """Generate a random string of fixed length
+def parse_cache_args(args):
+    """Parse the command line parameters of the 'cache' subcommand
 
     Args:
-      stringLength ([int]): The length of the string to generate
+      args ([str]): command line parameters as list of strings (without 'cache')
 
     Returns:
-      :string: The random string
+      :obj:`argparse.Namespace`: command line parameters namespace
     """
-    letters = string.ascii_lowercase
-    return "".join(random.choice(letters) for _ in range(stringLength))
+    parser = argparse.ArgumentParser(
+        prog="bba-data-fetch cache",
+        description="Inspect or clean the local cache of distribution files",
+    )
 
+    parser.add_argument(
+        "action",
+        choices=["stats", "gc"],
+        help="'stats' prints the number of files and the size of the cache, 'gc' "
+        "evicts the least recently used files until the cache fits in --max-size",
+    )
 
-def extractListIndexFromPropName(prop_name):
-    """
-    A property name can refer to a position in a list, such as in "dimension[10]"
-    then, the '10' as well as the 'dimension' must be extracted.
-    """
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        required=False,
+        default=None,
+        help="Directory of the cache (defaults to the BBA_DATA_FETCH_CACHE_DIR "
+        "environment variable)",
+    )
 
-    regex = r"\[(\d+)\]$"
-    matches = re.search(regex, prop_name)
+    parser.add_argument(
+        "--max-size",
+        dest="max_size",
+        required=False,
+        default=None,
+        help="OPTIONAL Size to reduce the cache to (ex: '20G', defaults to the "
+        "BBA_DATA_FETCH_CACHE_MAX_SIZE environment variable)",
+    )
+
+    parser.add_argument(
+        "--verbose", dest="verbose", action="store_true", help="OPTIONAL Verbose mode"
+    )
+
+    args = parser.parse_args(args)
 
-    if matches:
-        group_num = 1
-        list_index = int(matches.group(group_num))
-        prop_name_without_index = prop_name[: matches.start(group_num) - 1]
-        return prop_name_without_index, list_index
+    if args.verbose:
+        logging.basicConfig(format="%(message)s", level=logging.INFO)
     else:
-        return prop_name, None
+        logging.basicConfig(format="%(message)s", level=logging.WARNING)
+
+    args.cache_dir = getCacheDir(args.cache_dir)
+    if not args.cache_dir:
+        logging.error(
+            "❌ No cache directory: use --cache-dir or set the BBA_DATA_FETCH_CACHE_DIR "
+            "environment variable."
+        )
+        exit(1)
 
+    try:
+        args.max_size = parseSize(args.max_size or os.environ.get(CACHE_MAX_SIZE_ENV))
+    except ValueError as e:
+        logging.error(f"❌ {e}")
+        exit(1)
 
-def createRestFirstSequence(list_index):
-    """
-    In RDF, an element of a @list is addressed with rdf:first and rdf:rest
-    This function builds a sequence of /rdf:rest/rdf:rest/.../rdf:first based
-    on the list_index provided.
+    return args
+
+
+def parse_serve_args(args):
+    """Parse the command line parameters of the 'serve' subcommand
+
+    Args:
+      args ([str]): command line parameters as list of strings (without 'serve')
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
     """
-    rest = "/rdf:rest"
-    first = "/rdf:first"
+    parser = argparse.ArgumentParser(
+        prog="bba-data-fetch serve",
+        description="Run a fetch daemon, to which the fetches of the CLI are "
+        "delegated while it is running",
+    )
+
+    parser.add_argument(
+        "--nexus-token",
+        dest="nexus_token",
+        required=True,
+        help="Value of the Nexus token (only the fetches with this token are served)",
+    )
+
+    parser.add_argument(
+        "--nexus-env",
+        dest="nexus_env",
+        required=True,
+        help="URL to the Nexus environment (only the fetches with this environment "
+        "are served)",
+    )
+
+    parser.add_argument(
+        "--nexus-org",
+        dest="nexus_org",
+        required=False,
+        default=None,
+        help="OPTIONAL The Nexus organization of the forge built at startup",
+    )
+
+    parser.add_argument(
+        "--nexus-proj",
+        dest="nexus_proj",
+        required=False,
+        default=None,
+        help="OPTIONAL The Nexus project of the forge built at startup",
+    )
+
+    parser.add_argument(
+        "--forge-config",
+        dest="forge_config",
+        required=False,
+        default="cfg/forge-config.yml",
+        help="Path to Nexus forge configuration",
+    )
+
+    parser.add_argument(
+        "--socket",
+        dest="socket",
+        required=False,
+        default=None,
+        help="OPTIONAL Path of the socket to listen on (defaults to the "
+        "BBA_DATA_FETCH_SOCKET environment variable, or a path specific to the user)",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        dest="jobs",
+        type=int,
+        required=False,
+        default=None,
+        help="OPTIONAL Maximum number of fetches run at the same time by the daemon "
+        "(defaults to the Store max_connection of the forge configuration)",
+    )
+
+    parser.add_argument(
+        "--verbose", dest="verbose", action="store_true", help="OPTIONAL Verbose mode"
+    )
+
+    args = parser.parse_args(args)
+
+    if args.verbose:
+        logging.basicConfig(format="%(message)s", level=logging.INFO)
+    else:
+        logging.basicConfig(format="%(message)s", level=logging.WARNING)
+
+    if args.nexus_env[-1] == "/":
+        args.nexus_env = args.nexus_env[:-1]
+
+    # the forge built at startup is then found by the delegated fetches, whose
+    # configuration path is made absolute
+    args.forge_config = os.path.abspath(args.forge_config)
+
+    return args
 
-    if list_index is None:
-        return ""
 
-    return list_index * rest + first
+def parse_resolve_args(args):
+    """Parse the command line parameters of the 'resolve' subcommand: the parameters
+    of the fetch to resolve, and the lockfile to write
 
+    Args:
+      args ([str]): command line parameters as list of strings (without 'resolve')
 
-def translateFilters(args, context):
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
     """
-    Convert the string filters into filters datastructure that are easier to understand
-    for further processes.
-    For example:
-        "atlasRelease.name='Allen Mouse CCF v2'"
-        will turn into
-        {
-            "id": "dbgxf", # some random string
-            "properties": [
-                "atlasRelease",
-                "name"
-            ],
-            "comparator": '=',
-            "value": "Allen Mouse CCF v2",
-            "value_type": "string"
-        }
-    return :tuple: (filter_datastructure, context_mappers)
+    parser = argparse.ArgumentParser(
+        prog="bba-data-fetch resolve",
+        description="Resolve a fetch (or a batch of fetches) into a lockfile, then "
+        "fetched with --locked. The other parameters are the ones of the fetch",
+    )
+
+    parser.add_argument(
+        "--lockfile",
+        dest="lockfile",
+        required=True,
+        help="Path to the lockfile to write",
+    )
+
+    resolve_args, fetch_args = parser.parse_known_args(args)
+    args = parse_args(fetch_args)
+    args.lockfile = resolve_args.lockfile
+
+    if args.locked:
+        logging.error("❌ The fetches of a lockfile are resolved already.")
+        exit(1)
+
+    if args.nexus_env[-1] == "/":
+        args.nexus_env = args.nexus_env[:-1]
+
+    return args
+
+
+def resolveId(args):
+    """Get the @id of the resource to fetch, either directly from --nexus-id or by
+    resolving the --filter
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+
+    Returns:
+      :string: the @id of the resource
     """
-    # must be in the order from the most complex to the simplest
-    filter_symbols = [">=", "<=", "!=", "~=", "=", ">", "<"]
-
-    interpreted_filters = []
-    context_mappers = {}
-
-    # Create a LUT for context entries to match lowercase names
-    lowercase_context_lut = {}
-    for name in context:
-        lowercase_context_lut[name.lower()] = name
-
-    # converting each filter...
-    for given_filter in args.filter:
-        # print("processing filter:", given_filter)
-        symbol = None
-        symbol_position = -1
-        # checking what symbol is being used for the current filter
-        for s in filter_symbols:
-            symbol_position = given_filter.find(s)
-            if symbol_position >= 0:
-                symbol = s
-                break
-
-        # if there is no symbol match for this filter, we just ignore this filter
-        # and go to the next one
-        if not symbol:
-            continue
-
-        properties_no_mapping = given_filter[:symbol_position].split(".")
-
-        # here, each prop will be preceded by "nsg:" or another context in use
-        properties_with_mapping = []
-        for prop in properties_no_mapping:
-            (prop_name, list_index) = extractListIndexFromPropName(prop)
-            if list_index is not None:
-                context_mappers["rdf"] = context["rdf"]
-
-            lowercase_prop = prop_name.lower()
-
-            # if prop in context:
-            if lowercase_prop in lowercase_context_lut:
-                prop_with_mapping = context[lowercase_context_lut[lowercase_prop]][
-                    "@id"
-                ]
-                context_id = prop_with_mapping.split(":")[0]
-                context_mappers[context_id] = context[context_id]
-            else:
-                prop_with_mapping = UNKNOWN_CONTEXT_SHORT + prop_name
-
-            # adding /rdf:rest/rdf:first if necessary (when a prop name is given with
-            # [n] at the end)
-            prop_with_mapping = prop_with_mapping + createRestFirstSequence(list_index)
-            properties_with_mapping.append(prop_with_mapping)
-
-        value = given_filter[symbol_position + len(symbol):]
-        value_type = "string"
-
-        # A value can possibly use a prefix, such as in "mba:997" (Allen CCF brain
-        # region id) If this prefix is in the context, then it is replaced by the
-        # actual value
-        position_semicolon = value.find(":")
-        if position_semicolon > 0:
-            prefix = value[:position_semicolon]
-            prefix_lower = prefix.lower()
-            if prefix_lower in lowercase_context_lut:
-                value = (
-                    context[lowercase_context_lut[prefix_lower]]
-                    + value[position_semicolon + 1:]
-                )
-
-        # If the value happens to be a number, we convert in into a number,
-        # unless the operator is ~= which is reserved for string so we do not want
-        # to cast to number because we still want to use a regex on this one.
-        if symbol != "~=":
-            try:
-                value = float(value)
-                value_int = int(value)
-                # Check if it's an int or a float, to make sure we don't end up
-                # with a trailing ".0" if the provided value is an int
-                if abs(value - value_int) < sys.float_info.epsilon:
-                    value = value_int
-                value_type = "number"
-            except Exception:
-                pass
-
-        smarter_filter = {
-            "id": randomString(),
-            "properties": properties_with_mapping,
-            "comparator": symbol,
-            "value": value,
-            "value_type": value_type,
-        }
-
-        # special case of the "type" property, where we have to look up in the context
-        # for the mapping of the value (and not only of the property name)
-        if (
-            len(smarter_filter["properties"]) == 1
-            and smarter_filter["properties"][0] == context["type"]["@id"]
-        ):
-            # deleting some useless properties
-            del smarter_filter["comparator"]
-            del smarter_filter["id"]
-            del smarter_filter["properties"]
-
-            # updating the field type
-            smarter_filter["value_type"] = "type"
-            lowercase_type = smarter_filter["value"].lower()
-            if lowercase_type in lowercase_context_lut:
-                smarter_filter["value"] = context[
-                    lowercase_context_lut[lowercase_type]
-                ]["@id"]
-            else:
-                smarter_filter["value"] = (
-                    UNKNOWN_CONTEXT_SHORT + smarter_filter["value"]
-                )
-
-        interpreted_filters.append(smarter_filter)
-
-    return interpreted_filters, context_mappers
-
-
-def buildSparqlQuery(filters, context_mappers, context_when_no_context):
+    if not args.filter:
+        return args.nexus_id
+
+    try:
+        ids = Fetcher.fromArgs(args).resolve(args.filter)
+    except FetchError as e:
+        logging.error(f"❌ {e}")
+        exit(1)
+
+    return pickId(ids)
+
+
+def pickId(ids):
+    """Get the @id of the resource to fetch among the ones matching the filters
+
+    Args:
+      ids ([str]): the @id of the resources matching the filters (at least one)
+
+    Returns:
+      :string: the @id of the first resource
     """
-    Builds a SPARQL query
+    if len(ids) > 1:
+        logging.warning("⚠️  There are multiple matches for the provided filters:")
+        logging.warning("\n".join(ids))
+        logging.warning("➡️  Using the first one.")
+
+    return ids[0]
+
+
+def createForge(args):
+    """Instantiate the forge used to retrieve the resources (once per process for a
+    given configuration and bucket)
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+
+    Returns:
+      :obj:`KnowledgeGraphForge`: the forge, bound to the org/proj bucket
     """
+    try:
+        return buildForge(args)
+    except FetchError as e:
+        logging.error("❌ {}".format(e))
+        exit(1)
 
-    q = ""
-    select_var_name = "?s"
 
-    # add unknown prefix
-    q += "PREFIX {} <{}>\n".format(UNKNOWN_CONTEXT_SHORT, context_when_no_context)
+def needsForge(args):
+    """Check if a fetch must retrieve the resource with a forge. The payload is
+    written as the forge serializes it, while the distribution files only need the
+    source of the resource, which the NexusClient retrieves much faster."""
+    return args.payload or args.use_forge
 
-    # add the prefixes
-    for pref in context_mappers:
-        line = "PREFIX {}: <{}>\n".format(pref, context_mappers[pref])
-        q += line
 
-    # add the SELECT
-    q += "SELECT {}\n".format(select_var_name)
+def fetchResource(args, id, forge=None):
+    """Fetch the payload or the distribution file of a resource and write it on disk
 
-    # add the WHEREs
-    q += "WHERE {\n"
-    for filter in filters:
-        if filter["value_type"] == "type":
-            line = "\t{} a {} .\n".format(select_var_name, filter["value"])
-        else:
-            line = "\t{} {} ?{} .\n".format(
-                select_var_name, "/".join(filter["properties"]), filter["id"]
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+      id (string): the @id of the resource to fetch
+      forge (:obj:`KnowledgeGraphForge` or :obj:`NexusClient`): OPTIONAL used to
+        retrieve the resource (see Fetcher)
+    """
+    fetcher = Fetcher.fromArgs(args, engine=forge)
+    try:
+        if args.payload:
+            # in the namespace, keep_meta is False when the metadata must be kept
+            fetcher.fetchPayload(
+                id,
+                args.out,
+                rev=args.nexus_rev,
+                tag=args.nexus_tag,
+                keep_meta=not args.keep_meta,
             )
-        q += line
-
-    # add the FILTERs
-    for filter in filters:
-        if filter["value_type"] == "type":
-            continue
-
-        line = ""
-        if filter["value_type"] == "string":
-            if filter["comparator"] == "=":
-                line = '\tFILTER(regex(str(?{}), "^{}$", "i"))\n'.format(
-                    filter["id"], filter["value"]
-                )
-            elif filter["comparator"] == "~=":
-                line = '\tFILTER(regex(str(?{}), "{}", "i"))\n'.format(
-                    filter["id"], filter["value"]
-                )
-            elif filter["comparator"] == "!=":
-                line = '\tFILTER(regex(str(?{}), "^(?!{}).*$", "i"))\n'.format(
-                    filter["id"], filter["value"]
-                )
-
-        elif filter["value_type"] == "number":
-            line = "\tFILTER(?{} {} {}) .\n".format(
-                filter["id"], filter["comparator"], filter["value"]
+        else:
+            fetcher.fetchDistribution(
+                id, args.out, rev=args.nexus_rev, tag=args.nexus_tag, favor=args.favor
             )
-        q += line
+    except FetchError as e:
+        logging.error(f"❌ {e}")
+        exit(1)
 
-    # close the query
-    q += "}"
-    return q
 
+def fetchEntry(args, forge, client):
+    """Resolve and fetch a single entry of a batch
 
-def getFilteredIds(args):
-    # fetching the full context to look up the context mappings
-    context_payload = nexus.resources.fetch(
-        "neurosciencegraph", "datamodels", "https://neuroshapes.org"
-    )
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace of this fetch
+      forge (:obj:`KnowledgeGraphForge`): the forge shared by the batch (None if no
+        entry needs it)
+      client (:obj:`NexusClient`): the client shared by the batch
+    """
+    id = resolveId(args)
+    logging.info(f"Fetching '{id}' into '{args.out}'")
+    fetchResource(args, id, forge if needsForge(args) else client)
 
-    # stealing the context from the context payload. Could be @context or an element of
-    # it if it happens to be a list. We just take the first one in this case. (not
-    # bulletproof but since this resource is under the control of DKE, we will know
-    # if it changes...)
-    context = None
-    if isinstance(context_payload["@context"], dict):
-        context = context_payload["@context"]
-    elif isinstance(context_payload["@context"], list):
-        for el in context_payload["@context"]:
-            if isinstance(el, dict):
-                context = el
-                break
 
-    context_when_no_context = (
-        args.nexus_env + "/resources/" + args.nexus_org + "/" + args.nexus_proj + "/_/"
-    )
+def resolveEntries(args, entries_args):
+    """Resolve the --filter of all the entries of a batch with a single query, the
+    entries being then fetched by @id
 
-    (filters, context_mappers) = translateFilters(args, context)
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+      entries_args ([:obj:`argparse.Namespace`]): the parameters of the entries
+    """
+    filtered_args = [entry_args for entry_args in entries_args if entry_args.filter]
+    if len(filtered_args) < 2:
+        return
 
-    query = buildSparqlQuery(filters, context_mappers, context_when_no_context)
-    separator = (
-        "---------------------------------------------------------------------------"
-    )
-    logging.info("{}\nSPARQL Query:\n{}\n{}".format(separator, query, separator))
+    try:
+        entries_ids = Fetcher.fromArgs(args).resolveMany(
+            [entry_args.filter for entry_args in filtered_args]
+        )
+    except FetchError as e:
+        logging.error(f"❌ {e}")
+        exit(1)
+
+    for (entry_args, ids) in zip(filtered_args, entries_ids):
+        entry_args.nexus_id = pickId(ids)
+        entry_args.filter = None
 
+
+def readEntries(args):
+    """Read the fetches listed in the manifest
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+
+    Returns:
+      [:obj:`argparse.Namespace`]: the parameters of each fetch
+    """
     try:
-        result = nexus.views.query_sparql(args.nexus_org, args.nexus_proj, query=query)
+        entries = readManifest(args.manifest)
     except Exception as e:
-        logging.error("❌ {}".format(e))
-        if e.response.status_code == 400:
-            logging.info("📄 Here is the original server error message:")
-            logging.info(e.response.text.replace("\\n", "\n").replace("\\t", "\t"))
-        #exit(1)
+        logging.error(f"❌ Invalid manifest '{args.manifest}': {e}")
+        exit(1)
 
-    logging.info(
-        "{}\nSPARQL Response:\n{}\n{}".format(
-            separator, json.dumps(result, indent=2), separator
-        )
-    )
+    logging.info(f"{len(entries)} fetches listed in the manifest '{args.manifest}'")
+    return [entryArgs(args, entry) for entry in entries]
 
-    ids = []
-    for binding in result["results"]["bindings"]:
-        ids.append(binding["s"]["value"])
 
-    return ids
+def buildEngines(args, fetches_args, ids):
+    """Build the engines shared by several fetches: the forge, only built once (if any
+    fetch needs it), and the client, both serving the latest revision of the
+    resources retrieved at once (with --prefetch)
 
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+      fetches_args ([:obj:`argparse.Namespace`]): the parameters of the fetches
+      ids ([str]): the @id of the resources fetched at their latest revision
 
-def main(args):
-    """Main entry point allowing external calls
+    Returns:
+      tuple: the forge (None if no fetch needs it) and the client
+    """
+    forge = None
+    if any(needsForge(fetch_args) for fetch_args in fetches_args):
+        forge = createForge(args)
+    client = buildClient(args)
+
+    if args.prefetch and len(ids) > 1:
+        resources = prefetchResources(args, client, ids)
+        forge = forge and PrefetchedEngine(forge, resources)
+        client = PrefetchedEngine(client, resources)
+    return forge, client
+
+
+def waitFetches(futures):
+    """Wait for the fetches submitted to an executor, raising the first failure
 
     Args:
-      args ([str]): command line parameter list
+      futures ([:obj:`concurrent.futures.Future`]): the fetches
     """
-    args = parse_args(args)
+    try:
+        for future in as_completed(futures):
+            future.result()
+    except BaseException:
+        # a fetch failed (most likely with exit(1)), the pending ones are dropped
+        for future in futures:
+            future.cancel()
+        raise
 
-    # setting Nexus SDK
-    nexus.config.set_token(args.nexus_token)
 
-    if args.nexus_env[-1] == "/":
-        args.nexus_env = args.nexus_env[:-1]
-    nexus.config.set_environment(args.nexus_env)
+def runBatch(args):
+    """Run all the fetches listed in the manifest concurrently, reusing the same forge
+    and client instances
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+    """
+    entries_args = readEntries(args)
+
+    jobs = getJobs(args)
+    logging.info(f"Running the fetches with {jobs} concurrent jobs")
+
+    # the filters of all the entries are resolved at once, before any fetch, and so
+    # is the latest revision of the resources (with --prefetch)
+    resolveEntries(args, entries_args)
+    ids = [
+        entry_args.nexus_id
+        for entry_args in entries_args
+        if entry_args.nexus_id and isLatest(entry_args)
+    ]
+    forge, client = buildEngines(args, entries_args, ids)
+
+    with ContextExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(fetchEntry, entry_args, forge, client)
+            for entry_args in entries_args
+        ]
+        waitFetches(futures)
 
-    # Getting the @ids from the query or simply from the list provided in args
-    id = args.nexus_id
-    if args.filter:
-        ids = getFilteredIds(args)
-        # print(ids)
 
-        if len(ids) == 0:
+def listFetches(args):
+    """List the fetches described by the parameters (a single one, the ones of the
+    manifest or all the matches of the filters), with their filters resolved
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+
+    Returns:
+      [tuple]: the parameters of each fetch and the @id of its resource
+    """
+    if args.manifest:
+        entries_args = readEntries(args)
+        resolveEntries(args, entries_args)
+        return [(entry_args, resolveId(entry_args)) for entry_args in entries_args]
+
+    if args.all_matches:
+        try:
+            matches = list(Fetcher.fromArgs(args).iterResolveMatches(args.filter))
+        except FetchError as e:
+            logging.error(f"❌ {e}")
+            exit(1)
+        if not matches:
             logging.error("❌ No match for the given filter.")
             exit(1)
+        return [(groupArgs(args, group), id) for (id, group) in matches]
+
+    return [(args, resolveId(args))]
+
+
+def lockFetch(args, id, engine):
+    """Resolve a fetch into an entry of the lockfile (see Fetcher.lockResource)
 
-        if len(ids) > 1:
-            logging.warning("⚠️  There are multiple matches for the provided filters:")
-            logging.warning("\n".join(ids))
-            logging.warning("➡️  Using the first one.")
+    Args:
+      args (:obj:`argparse.Namespace`): parameters namespace of the fetch
+      id (string): the @id of the resource to fetch
+      engine (:obj:`KnowledgeGraphForge` or :obj:`NexusClient`): used to retrieve
+        the resource
+
+    Returns:
+      dict: the entry of the lockfile
+    """
+    try:
+        entry = Fetcher.fromArgs(args, engine=engine).lockResource(
+            id,
+            rev=args.nexus_rev,
+            tag=args.nexus_tag,
+            favor=args.favor,
+            payload=args.payload,
+        )
+    except FetchError as e:
+        logging.error(f"❌ {e}")
+        exit(1)
 
-        id = ids[0]
+    locked = {"out": args.out}
+    if args.payload:
+        # in the namespace, keep_meta is False when the metadata must be kept
+        locked["keep_meta"] = not args.keep_meta
+    locked.update(entry)
+    return locked
+
+
+def resolveMain(args):
+    """Entry point of the 'resolve' subcommand
+
+    Args:
+      args ([str]): command line parameter list (without 'resolve')
+    """
+    args = parse_resolve_args(args)
+    fetches = listFetches(args)
+
+    # as in a batch, the forge is only built if a payload is locked
+    forge, client = buildEngines(
+        args,
+        [fetch_args for (fetch_args, _) in fetches],
+        [id for (fetch_args, id) in fetches if isLatest(fetch_args)],
+    )
+
+    with ContextExecutor(max_workers=getJobs(args)) as executor:
+        futures = [
+            executor.submit(
+                lockFetch, fetch_args, id, forge if needsForge(fetch_args) else client
+            )
+            for (fetch_args, id) in fetches
+        ]
+        waitFetches(futures)
+    entries = [future.result() for future in futures]
 
-    # Fetching the resource of interest
-    res = None
-    resource = None
     try:
-        bucket = "/".join([args.nexus_org, args.nexus_proj])
-        forge = KnowledgeGraphForge(args.forge_config, endpoint=args.nexus_env,
-                                    bucket=bucket, token=args.nexus_token)
-        res = forge.retrieve(id, cross_bucket=args.cross_bucket)
-        if not res:
-            raise Exception
-        resource = forge.as_json(res)
+        writeLockfile(args.lockfile, args.nexus_env, entries)
+    except OSError as e:
+        logging.error(f"❌ Cannot write the lockfile '{args.lockfile}': {e}")
+        exit(1)
+    logging.info(f"✅  {len(entries)} fetches locked in {args.lockfile}")
+
+
+def fetchLocked(fetcher, entry):
+    """Run a fetch of a lockfile
+
+    Args:
+      fetcher (:obj:`Fetcher`): the Fetcher shared by the fetches of the lockfile
+      entry (dict): the entry of the lockfile
+    """
+    try:
+        keep_meta = entry.get("keep_meta", False)
+        fetcher.fetchLocked(entry, entry["out"], keep_meta=keep_meta)
+    except FetchError as e:
+        logging.error(f"❌ {e}")
+        exit(1)
+
+
+def runLocked(args):
+    """Run the fetches of the lockfile concurrently, without any query to Nexus
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+    """
+    try:
+        lock = readLockfile(args.locked)
     except Exception as e:
-        logging.error("❌ {}".format(e))
+        logging.error(f"❌ Invalid lockfile '{args.locked}': {e}")
         exit(1)
 
-    if os.path.isdir(args.out):
-        out_filepath = os.path.join(args.out, res.get_identifier().replace("/", "_"))
-        output_extension = None
-    else:
-        out_filepath = args.out
-        output_extension = out_filepath.split(".").pop().lower()
+    if lock["nexus_env"] != args.nexus_env:
+        logging.error(
+            f"❌ The lockfile was resolved in {lock['nexus_env']}, not in "
+            f"{args.nexus_env}."
+        )
+        exit(1)
+
+    jobs = getJobs(args)
+    logging.info(
+        f"Running the {len(lock['fetches'])} fetches of the lockfile '{args.locked}' "
+        f"with {jobs} concurrent jobs"
+    )
+    fetcher = Fetcher.fromArgs(args)
+    with ContextExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(fetchLocked, fetcher, entry) for entry in lock["fetches"]
+        ]
+        waitFetches(futures)
 
-    # Make sure the parent directory of the specified output exist, if not, create it
-    parent_dir = os.path.dirname(out_filepath)
-    if not os.path.isdir(parent_dir):
-        os.makedirs(parent_dir)
 
-    # We extract the payload as a json file
-    if args.payload:
-        # If there is no file attached to the resource, we want to write the payload as
-        # a JSON output file. Though if the extension of the given output is not json,
-        # then we raise an error and quit.
-        if output_extension != "json":
+def cacheMain(args):
+    """Entry point of the 'cache' subcommand
+
+    Args:
+      args ([str]): command line parameter list (without 'cache')
+    """
+    args = parse_cache_args(args)
+    cache = DistributionCache(args.cache_dir, args.max_size)
+
+    if args.action == "gc":
+        if args.max_size is None:
             logging.error(
-                "❌ To save the payload, the extension of the file must be .json"
+                "❌ The size to reduce the cache to must be provided with --max-size."
             )
             exit(1)
+        removed, freed = cache.gc()
+        print(f"{removed} files evicted, {formatSize(freed)} freed")
 
-        # removing the file if it exists
-        if os.path.exists(out_filepath):
-            os.remove(out_filepath)
-
-        # sanitize from all the Nexus meta
-        if args.keep_meta:
-            resource.pop("@context", None)
-            resource.pop("@id", None)
-            resource.pop("@type", None)
-            resource.pop("_self", None)
-            resource.pop("_project", None)
-            resource.pop("_rev", None)
-            resource.pop("_deprecated", None)
-            resource.pop("_createdAt", None)
-            resource.pop("_createdBy", None)
-            resource.pop("_updatedAt", None)
-            resource.pop("_updatedBy", None)
-            resource.pop("_incoming", None)
-            resource.pop("_outgoing", None)
-            resource.pop("_constrainedBy", None)
-
-        # write the resource payload as a json file
-        f = open(out_filepath, "w+")
-        f.write(json.dumps(resource, indent=2))
-        f.close()
-
-        logging.info("✅  File saved at {}".format(out_filepath))
-
-        exit(0)
-
-    # if we want the distribution file
-    if "distribution" in resource:
-        distribution = resource["distribution"]
-        if isinstance(resource["distribution"], list):
-            logging.info(
-                "Resource distribution property is a list. Therefore several files "
-                "are linked to it: "
-            )
-            distrib_found = []
-            for distrib in resource["distribution"]:
-                logging.info(f"=> '{distrib['name']}'")
-                for favor in args.favor:
-                    prop_val_list = favor.split(":")
-                    if (
-                        prop_val_list[0] in distrib
-                        and prop_val_list[1] == distrib[prop_val_list[0]]
-                    ):
-                        distrib_found.append((favor, distrib))
-
-            if distrib_found:
-                distribution = distrib_found[0][1]
-                for distrib_favor in distrib_found:
-                    logging.info(
-                        f"--favor argument '{distrib_favor[0]}' corresponds to the "
-                        f"'{distrib_favor[1]['name']}' distribution."
-                    )
-                if len(distrib_found) > 1:
-                    logging.warning(
-                        "⚠️  More than one distribution has a correspondence with "
-                        "the --favor arguments values."
-                    )
-                    logging.info(
-                        "Fetching the first corresponding distribution with "
-                        f"'{distribution['name']}' as file name by default..."
-                    )
-                else:
-                    logging.info(
-                        f"Fetching the corresponding distribution with "
-                        f"'{distribution['name']}' as file name..."
-                    )
+    stats = cache.stats()
+    print(f"Cache directory: {stats['cache_dir']}")
+    print(f"Files: {stats['files']}")
+    print(f"Size: {formatSize(stats['size'])}")
+    if stats["max_size"] is not None:
+        print(f"Max size: {formatSize(stats['max_size'])}")
+
+
+def serveMain(args):
+    """Entry point of the 'serve' subcommand
+
+    Args:
+      args ([str]): command line parameter list (without 'serve')
+    """
+    args = parse_serve_args(args)
+    socket_path = getSocketPath(args.socket)
+
+    # the log of each fetch is collected and sent back to the CLI, which filters it
+    # with its own verbosity
+    logging.getLogger().setLevel(logging.INFO)
+
+    # the forge of the usual bucket is built beforehand
+    if args.nexus_org and args.nexus_proj:
+        logging.info(f"Building the forge of {args.nexus_org}/{args.nexus_proj}")
+        createForge(args)
+
+    try:
+        daemon = FetchDaemon(
+            socket_path, args.nexus_token, args.nexus_env, runFetch, getJobs(args)
+        )
+    except OSError as e:
+        logging.error(f"❌ Cannot listen at {socket_path}: {e}")
+        exit(1)
+
+    # stopping properly (removing the socket) on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    logging.warning(f"Fetch daemon listening at {socket_path}")
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+
+
+def groupArgs(args, group):
+    """Get the parameters of the fetch of a resource matching a value of a
+    set-membership filter: it is written in the subdirectory of --out named after
+    the value
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+      group (string): the value matched (None if there is no set-membership filter)
 
-            else:
-                distribution = resource["distribution"][0]
-                if not args.favor:
-                    logging.warning("⚠️  --flavor argument has not been provided.")
-                else:
-                    logging.warning(
-                        "⚠️  No distribution has a correspondence with a provided "
-                        "--favor argument."
+    Returns:
+      :obj:`argparse.Namespace`: the parameters of the fetch
+    """
+    if group is None:
+        return args
+    group_args = copy.copy(args)
+    group_args.out = os.path.join(args.out, group.replace("/", "_"))
+    os.makedirs(group_args.out, exist_ok=True)
+    return group_args
+
+
+def isLatest(args):
+    """Check if a fetch is of the latest revision of the resource (which is the only
+    one that can be retrieved at once with other resources)"""
+    return args.nexus_rev is None and args.nexus_tag is None
+
+
+def iterChunks(iterable, size):
+    """Split an iterable into lists of (at most) size elements, lazily"""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def runAllMatches(args):
+    """Fetch all the resources matching the --filter concurrently into the --out
+    directory (into a subdirectory per value of a set-membership filter). The
+    matches are fetched by chunks of BULK_SIZE resources, each chunk starting as
+    soon as it is resolved and its resources are retrieved at once (with --prefetch)
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+    """
+    jobs = getJobs(args)
+    client = buildClient(args)
+    engine = createForge(args) if needsForge(args) else client
+    prefetch = args.prefetch and isLatest(args)
+
+    with ContextExecutor(max_workers=jobs) as executor:
+        futures = []
+        try:
+            # the fetches start with the first page of results
+            matches = Fetcher.fromArgs(args).iterResolveMatches(args.filter)
+            for chunk in iterChunks(matches, BULK_SIZE):
+                chunk_engine = engine
+                if prefetch and len(chunk) > 1:
+                    resources = prefetchResources(
+                        args, client, [id for (id, _) in chunk]
                     )
-                    logging.info(
-                        "Fetching the first distribution with "
-                        f"'{distribution['name']}' as file name by default..."
+                    chunk_engine = PrefetchedEngine(engine, resources)
+                for (id, group) in chunk:
+                    futures.append(
+                        executor.submit(
+                            fetchResource, groupArgs(args, group), id, chunk_engine
+                        )
                     )
+        except FetchError as e:
+            logging.error(f"❌ {e}")
+            for future in futures:
+                future.cancel()
+            exit(1)
+
+        if not futures:
+            logging.error("❌ No match for the given filter.")
+            exit(1)
+        logging.info(f"Fetching {len(futures)} resources with {jobs} concurrent jobs")
+        waitFetches(futures)
+
+
+def runFetch(args):
+    """Run the fetch (or the batch of fetches) described by the parameters
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+    """
+    if args.locked:
+        runLocked(args)
+        return
+
+    if args.manifest:
+        runBatch(args)
+        return
+
+    if args.all_matches:
+        runAllMatches(args)
+        return
+
+    # Getting the @id from the query or simply from the one provided in args
+    id = resolveId(args)
+    fetchResource(args, id)
+
+
+def main(args):
+    """Main entry point allowing external calls
+
+    Args:
+      args ([str]): command line parameter list
+    """
+    if args and args[0] == "cache":
+        cacheMain(args[1:])
+        return
+
+    if args and args[0] == "serve":
+        serveMain(args[1:])
+        return
+
+    if args and args[0] == "resolve":
+        resolveMain(args[1:])
+        return
+
+    args = parse_args(args)
+
+    # the Nexus SDK is configured with it by importNexus
+    if args.nexus_env[-1] == "/":
+        args.nexus_env = args.nexus_env[:-1]
+
+    # a fetch daemon may be running, with everything already warm
+    status = delegate(args)
+    if status is not None:
+        if status:
+            exit(status)
+        return
 
-        if "contentUrl" in distribution:
-            linked_file_extension = distribution["name"].split(".").pop().lower()
-
-            # check that extension of distribution file and the output is the same (case
-            # not sensitive)
-            if output_extension and linked_file_extension != output_extension:
-                logging.error(
-                    f"❌ The provided output extension is '.{output_extension}' while "
-                    f"the distribution file extension is '.{linked_file_extension}' "
-                    "- They must be the same. ")
-                exit(1)
-
-            # Fetching the file
-            # with 'cross_bucket=True', the file bucket may be different from org/proj
-            separator = "/"
-            fields = res._store_metadata._project.split(separator)
-            file_org = fields[-2]
-            file_project = fields[-1]
-            file_bucket = separator.join([file_org, file_project])
-            file_id = distribution["contentUrl"].split(file_bucket + separator)[-1]
-            # as of nexusforge 0.8.1, the distribution.contentUrl may contain "%2F"
-            raw_file_id = unquote(file_id)
-
-            # fetching just the payload of the file, to check first if the file hash
-            # is in sync with what is in the payload of the resource (distribution)
-            file_payload = None
-            try:
-                file_payload = nexus.files.fetch(file_org, file_project, raw_file_id)
-            except Exception as e:
-                logging.error(f"❌ {e}")
-                exit(1)
-
-            # If hashes are different, it means the File has changed (new rev) and the
-            # resource was not updated accordingly, hence the metadata in the payload
-            # may be wrong.
-            if distribution["digest"]["value"] != file_payload["_digest"]["_value"]:
-                logging.error(
-                    "❌ Hash mismatch. The resource distribution is no longer "
-                    "in sync with the file resource."
-                )
-                exit(1)
-
-            # fetching the actual file (no longer only the payload)
-            try:
-                nexus.files.fetch(
-                    file_org, file_project, raw_file_id, out_filepath=out_filepath)
-                logging.info(f"✅  File saved at {out_filepath}")
-            except Exception as e:
-                logging.error(f"❌ {e}")
-                exit(1)
+    runFetch(args)
 
 
 def run():
@@ -0,0 +1,1171 @@
+"""
+Resolve the resources matching a set of filters: the filters are translated with the
+neuroshapes context into a SPARQL query, run on the SPARQL view of the project. The
+context and the resolved ids are cached (in memory, and on disk if a cache directory
+is set).
+"""
+
+import re
+import sys
+import copy
+import json
+import time
+import string
+import random
+import hashlib
+import logging
+
+from urllib.parse import quote_plus
+
+from bba_data_fetch.cache import entryKey, getCacheDir, readJsonEntry, writeJsonEntry
+from bba_data_fetch.errors import QueryError
+
+UNKNOWN_CONTEXT_SHORT = "unknown:"
+
+# the resource holding the context used to translate the filters
+CONTEXT_ORG = "neurosciencegraph"
+CONTEXT_PROJ = "datamodels"
+CONTEXT_ID = "https://neuroshapes.org"
+
+# contexts already loaded by this process, by environment
+CONTEXT_MEMO = {}
+
+# filters already resolved by this process, by normalized filters
+FILTERS_MEMO = {}
+
+# must be in the order from the most complex to the simplest
+FILTER_SYMBOLS = [">=", "<=", "!=", "~=", "=", ">", "<"]
+
+# the backends the filters can be resolved with (see iterBackendMatches)
+SEARCH_BACKENDS = ["sparql", "elastic", "auto"]
+
+# the Elasticsearch view of the projects, and the subfield of its string fields
+# holding their exact value
+ELASTIC_VIEW = "nxv:defaultElasticSearchIndex"
+ELASTIC_KEYWORD_FIELD = "keyword"
+
+# the maximum number of hits of an Elasticsearch query which is not paged
+ELASTIC_MAX_SIZE = 10000
+
+# the set-membership filters, such as "brainRegion=in(mba:1048,mba:997)"
+IN_PATTERN = re.compile(r"^in\((.*)\)$", re.IGNORECASE | re.DOTALL)
+
+# the characters making a string filter value a regex rather than a plain string
+REGEX_METACHARACTERS = set(".^$*+?()[]{}|\\")
+
+# an absolute IRI, without the characters forbidden in a SPARQL IRI reference
+IRI_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*://[^\s<>"{}|\\^`]+$')
+
+
+def randomString(stringLength=5):
+    """Generate a random string of fixed length
+
+    Args:
+      stringLength ([int]): The length of the string to generate
+
+    Returns:
+      :string: The random string
+    """
+    letters = string.ascii_lowercase
+    return "".join(random.choice(letters) for _ in range(stringLength))
+
+
+def extractListIndexFromPropName(prop_name):
+    """
+    A property name can refer to a position in a list, such as in "dimension[10]"
+    then, the '10' as well as the 'dimension' must be extracted.
+    """
+
+    regex = r"\[(\d+)\]$"
+    matches = re.search(regex, prop_name)
+
+    if matches:
+        group_num = 1
+        list_index = int(matches.group(group_num))
+        prop_name_without_index = prop_name[: matches.start(group_num) - 1]
+        return prop_name_without_index, list_index
+    else:
+        return prop_name, None
+
+
+def createRestFirstSequence(list_index):
+    """
+    In RDF, an element of a @list is addressed with rdf:first and rdf:rest
+    This function builds a sequence of /rdf:rest/rdf:rest/.../rdf:first based
+    on the list_index provided.
+    """
+    rest = "/rdf:rest"
+    first = "/rdf:first"
+
+    if list_index is None:
+        return ""
+
+    return list_index * rest + first
+
+
+def buildLowercaseContextLut(context):
+    """
+    Build the lookup table from the lowercase names of the context entries to their
+    actual names, so that filters are case-insensitive.
+    """
+    lowercase_context_lut = {}
+    for name in context:
+        lowercase_context_lut[name.lower()] = name
+    return lowercase_context_lut
+
+
+def splitFilter(given_filter):
+    """
+    Split a filter such as "atlasRelease.name=Allen Mouse CCF v2" into its property
+    names (["atlasRelease", "name"]), its comparator ("=") and its value.
+    return :tuple: (property_names, comparator, value), or None if the filter has no
+    comparator
+    """
+    for symbol in FILTER_SYMBOLS:
+        symbol_position = given_filter.find(symbol)
+        if symbol_position >= 0:
+            return (
+                given_filter[:symbol_position].split("."),
+                symbol,
+                given_filter[symbol_position + len(symbol):],
+            )
+    return None
+
+
+def expandPrefix(value, context, lowercase_context_lut):
+    """
+    A value can possibly use a prefix, such as in "mba:997" (Allen CCF brain region
+    id). If this prefix is in the context, then it is replaced by the actual value.
+    """
+    position_semicolon = value.find(":")
+    if position_semicolon > 0:
+        prefix_lower = value[:position_semicolon].lower()
+        if prefix_lower in lowercase_context_lut:
+            return (
+                context[lowercase_context_lut[prefix_lower]]
+                + value[position_semicolon + 1:]
+            )
+    return value
+
+
+def parseNumber(value):
+    """
+    Convert a filter value into a number, an int if it has no decimal part (to make
+    sure we don't end up with a trailing ".0").
+    return :number: the number, or None if the value is not a number
+    """
+    try:
+        number = float(value)
+        number_int = int(number)
+    except Exception:
+        return None
+    if abs(number - number_int) < sys.float_info.epsilon:
+        return number_int
+    return number
+
+
+def splitInValues(symbol, value):
+    """
+    Get the values of a set-membership filter, such as "in(mba:1048, mba:997)".
+    return :list: the values (without duplicates), or None if the filter is not a
+    set-membership one
+    """
+    matches = IN_PATTERN.match(value) if symbol == "=" else None
+    if not matches:
+        return None
+    values = [v.strip() for v in matches.group(1).split(",")]
+    return list(dict.fromkeys(v for v in values if v))
+
+
+def translateFilters(args, context, lowercase_context_lut=None):
+    """
+    Convert the string filters into filters datastructure that are easier to understand
+    for further processes.
+    For example:
+        "atlasRelease.name='Allen Mouse CCF v2'"
+        will turn into
+        {
+            "id": "dbgxf", # some random string
+            "properties": [
+                "atlasRelease",
+                "name"
+            ],
+            "comparator": '=',
+            "value": "Allen Mouse CCF v2",
+            "value_type": "string"
+        }
+    A set-membership filter, such as "brainRegion=in(mba:1048,mba:997)", has the "in"
+    comparator, the list of its values (sorted) as value, and the values as they
+    were given as "groups", to group the matching resources by value.
+    The lowercase_context_lut (see buildLowercaseContextLut) is built from the context
+    if not provided.
+    return :tuple: (filter_datastructure, context_mappers)
+    """
+    interpreted_filters = []
+    context_mappers = {}
+
+    # Create a LUT for context entries to match lowercase names (unless it was
+    # already built along with the context)
+    if lowercase_context_lut is None:
+        lowercase_context_lut = buildLowercaseContextLut(context)
+
+    # converting each filter...
+    for given_filter in args.filter:
+        split_filter = splitFilter(given_filter)
+
+        # if there is no symbol match for this filter, we just ignore this filter
+        # and go to the next one
+        if not split_filter:
+            continue
+
+        (properties_no_mapping, symbol, value) = split_filter
+        in_values = splitInValues(symbol, value)
+
+        # here, each prop will be preceded by "nsg:" or another context in use
+        properties_with_mapping = []
+        for prop in properties_no_mapping:
+            (prop_name, list_index) = extractListIndexFromPropName(prop)
+            if list_index is not None:
+                context_mappers["rdf"] = context["rdf"]
+
+            lowercase_prop = prop_name.lower()
+
+            # if prop in context:
+            if lowercase_prop in lowercase_context_lut:
+                prop_with_mapping = context[lowercase_context_lut[lowercase_prop]][
+                    "@id"
+                ]
+                context_id = prop_with_mapping.split(":")[0]
+                context_mappers[context_id] = context[context_id]
+            else:
+                prop_with_mapping = UNKNOWN_CONTEXT_SHORT + prop_name
+
+            # adding /rdf:rest/rdf:first if necessary (when a prop name is given with
+            # [n] at the end)
+            prop_with_mapping = prop_with_mapping + createRestFirstSequence(list_index)
+            properties_with_mapping.append(prop_with_mapping)
+
+        if in_values is not None:
+            # the values are all numbers, or all compared as strings
+            symbol = "in"
+            value = [expandPrefix(v, context, lowercase_context_lut) for v in in_values]
+            value_type = "string"
+            numbers = [parseNumber(v) for v in value]
+            if None not in numbers:
+                value = numbers
+                value_type = "number"
+        else:
+            value = expandPrefix(value, context, lowercase_context_lut)
+            value_type = "string"
+
+            # If the value happens to be a number, we convert in into a number,
+            # unless the operator is ~= which is reserved for string so we do not
+            # want to cast to number because we still want to use a regex on this one.
+            if symbol != "~=":
+                number = parseNumber(value)
+                if number is not None:
+                    value = number
+                    value_type = "number"
+
+        smarter_filter = {
+            "id": randomString(),
+            "properties": properties_with_mapping,
+            "comparator": symbol,
+            "value": value,
+            "value_type": value_type,
+        }
+
+        # special case of the "type" property, where we have to look up in the context
+        # for the mapping of the value (and not only of the property name)
+        if (
+            len(smarter_filter["properties"]) == 1
+            and smarter_filter["properties"][0] == context["type"]["@id"]
+        ):
+            # deleting some useless properties (the comparator only matters for
+            # the set-membership filters)
+            if symbol != "in":
+                del smarter_filter["comparator"]
+            del smarter_filter["id"]
+            del smarter_filter["properties"]
+
+            # updating the field type
+            smarter_filter["value_type"] = "type"
+            types = list(in_values) if symbol == "in" else [smarter_filter["value"]]
+            for i, type in enumerate(types):
+                lowercase_type = str(type).lower()
+                if lowercase_type in lowercase_context_lut:
+                    types[i] = context[lowercase_context_lut[lowercase_type]]["@id"]
+                else:
+                    types[i] = UNKNOWN_CONTEXT_SHORT + str(type)
+            smarter_filter["value"] = types if symbol == "in" else types[0]
+
+        if symbol == "in":
+            # sorted, so that the filter does not depend on the order of its values
+            pairs = sorted(
+                zip(smarter_filter["value"], in_values), key=lambda p: str(p[0])
+            )
+            smarter_filter["value"] = [value for (value, _) in pairs]
+            smarter_filter["groups"] = [group for (_, group) in pairs]
+
+        interpreted_filters.append(smarter_filter)
+
+    return interpreted_filters, context_mappers
+
+
+def normalizeFilters(filters):
+    """
+    Get a canonical version of translated filters, that does not depend on the order
+    of the filters nor on the (random) ids of the SPARQL variables, to identify a set
+    of filters.
+    """
+    normalized = []
+    for filter in filters:
+        filter = {k: v for k, v in filter.items() if k != "id"}
+        if filter not in normalized:
+            normalized.append(filter)
+    return sorted(normalized, key=lambda f: json.dumps(f, sort_keys=True))
+
+
+def isRegexFree(value):
+    """
+    Check whether a string value has no regex metacharacter, ie. whether matching it
+    with an anchored regex is the same as comparing it as a plain string.
+    """
+    return not any(c in REGEX_METACHARACTERS for c in value)
+
+
+def isIri(value):
+    """
+    Check whether a value is an absolute IRI (eg. a brain region id once its prefix
+    is expanded), that can be matched exactly by a triple pattern.
+    """
+    return isinstance(value, str) and IRI_PATTERN.match(value) is not None
+
+
+def sparqlLiteral(value):
+    """
+    Write a value as a SPARQL string literal, with its quotes and backslashes escaped.
+    """
+    return json.dumps(str(value), ensure_ascii=False)
+
+
+def isInFilter(filter):
+    """
+    Check whether a translated filter is a set-membership one (see translateFilters).
+    """
+    return "comparator" in filter and filter["comparator"] == "in"
+
+
+def filterRank(filter):
+    """
+    Rank of a filter in the query, the most selective patterns (the ones a
+    triplestore resolves with its indexes) coming first: the types, the exact IRIs,
+    the numbers, the plain strings and then the regex.
+    """
+    if filter["value_type"] == "type":
+        return 0
+    if filter["value_type"] == "number":
+        return 2
+    if isInFilter(filter):
+        return 1 if all(isIri(value) for value in filter["value"]) else 3
+    if filter["comparator"] == "=" and isIri(filter["value"]):
+        return 1
+    if filter["comparator"] in ("=", "!=") and isRegexFree(filter["value"]):
+        return 3
+    return 4
+
+
+def buildValuesBlock(filter):
+    """
+    Builds the VALUES block of a set-membership filter, binding each of its values
+    (to ?member) along with the value as it was given (to ?group), so that the
+    matches of all the values are returned at once, grouped by value.
+    """
+    rank = filterRank(filter)
+    rows = []
+    for (value, group) in zip(filter["value"], filter["groups"]):
+        if rank == 0:
+            term = value
+        elif rank == 1:
+            term = "<{}>".format(value)
+        elif filter["value_type"] == "number":
+            term = str(value)
+        else:
+            term = sparqlLiteral(value.lower())
+        rows.append("({} {})".format(term, sparqlLiteral(group)))
+    return "\tVALUES (?member ?group) {{ {} }}\n".format(" ".join(rows))
+
+
+def buildTriplePattern(filter, select_var_name):
+    """
+    Builds the triple pattern of a filter: the type and the exact IRIs are matched
+    by the pattern itself, the other values are bound to the variable of the filter.
+    """
+    if isInFilter(filter):
+        if filter["value_type"] == "type":
+            line = "\t{} a ?member .\n".format(select_var_name)
+        else:
+            line = "\t{} {} ?{} .\n".format(
+                select_var_name,
+                "/".join(filter["properties"]),
+                "member" if filterRank(filter) == 1 else filter["id"],
+            )
+        return buildValuesBlock(filter) + line
+
+    if filter["value_type"] == "type":
+        return "\t{} a {} .\n".format(select_var_name, filter["value"])
+
+    path = "/".join(filter["properties"])
+    if filterRank(filter) == 1:
+        return "\t{} {} <{}> .\n".format(select_var_name, path, filter["value"])
+    return "\t{} {} ?{} .\n".format(select_var_name, path, filter["id"])
+
+
+def buildFilterExpression(filter):
+    """
+    Builds the FILTER of a filter (if its triple pattern is not enough): the strings
+    are compared case-insensitively with LCASE and STRSTARTS, which a triplestore
+    evaluates much faster than a regex. The regex is kept for ~=, and for the values
+    having regex metacharacters since they have always been interpreted as regex.
+    """
+    rank = filterRank(filter)
+    if rank in (0, 1):
+        return ""
+
+    if isInFilter(filter):
+        if filter["value_type"] == "number":
+            return "\tFILTER(?{} = ?member) .\n".format(filter["id"])
+        return "\tFILTER(LCASE(STR(?{})) = ?member)\n".format(filter["id"])
+
+    if filter["value_type"] == "number":
+        return "\tFILTER(?{} {} {}) .\n".format(
+            filter["id"], filter["comparator"], filter["value"]
+        )
+
+    if filter["value_type"] != "string":
+        return ""
+
+    if rank == 3:
+        value = sparqlLiteral(filter["value"].lower())
+        if filter["comparator"] == "=":
+            return "\tFILTER(LCASE(STR(?{})) = {})\n".format(filter["id"], value)
+        # like the former "^(?!value).*$" regex: the values not starting with value
+        return "\tFILTER(!STRSTARTS(LCASE(STR(?{})), {}))\n".format(
+            filter["id"], value
+        )
+
+    if filter["comparator"] == "=":
+        return '\tFILTER(regex(str(?{}), "^{}$", "i"))\n'.format(
+            filter["id"], filter["value"]
+        )
+    elif filter["comparator"] == "~=":
+        return '\tFILTER(regex(str(?{}), "{}", "i"))\n'.format(
+            filter["id"], filter["value"]
+        )
+    elif filter["comparator"] == "!=":
+        return '\tFILTER(regex(str(?{}), "^(?!{}).*$", "i"))\n'.format(
+            filter["id"], filter["value"]
+        )
+    return ""
+
+
+def buildPrefixes(context_mappers, context_when_no_context):
+    """
+    Builds the PREFIX lines of a SPARQL query.
+    """
+    # add unknown prefix
+    q = "PREFIX {} <{}>\n".format(UNKNOWN_CONTEXT_SHORT, context_when_no_context)
+
+    # add the prefixes (sorted, so that the query does not depend on the order in
+    # which they were collected)
+    for pref in sorted(context_mappers):
+        line = "PREFIX {}: <{}>\n".format(pref, context_mappers[pref])
+        q += line
+    return q
+
+
+def buildWhereBody(filters, select_var_name):
+    """
+    Builds the triple patterns and the FILTERs of a set of filters, ordered from the
+    most to the least selective one (see filterRank).
+    """
+    # the order is stable, the filters of a same rank keep their order
+    filters = sorted(filters, key=filterRank)
+
+    # add the WHEREs
+    q = ""
+    for filter in filters:
+        q += buildTriplePattern(filter, select_var_name)
+
+    # add the FILTERs
+    for filter in filters:
+        q += buildFilterExpression(filter)
+    return q
+
+
+def buildSparqlQuery(filters, context_mappers, context_when_no_context):
+    """
+    Builds a SPARQL query. The filters are ordered from the most to the least
+    selective one (see filterRank) and compared without regex whenever possible.
+    """
+    select_var_name = "?s"
+    q = buildPrefixes(context_mappers, context_when_no_context)
+
+    # add the SELECT, with the value matched by the set-membership filter if any
+    in_filters = [f for f in filters if isInFilter(f)]
+    if len(in_filters) > 1:
+        raise QueryError("Only one set-membership filter (in) can be used at once")
+    if in_filters:
+        q += "SELECT {} ?group\n".format(select_var_name)
+    else:
+        q += "SELECT {}\n".format(select_var_name)
+
+    q += "WHERE {\n"
+    q += buildWhereBody(filters, select_var_name)
+
+    # close the query
+    q += "}"
+    return q
+
+
+def buildBatchSparqlQuery(filter_sets, context_mappers, context_when_no_context):
+    """
+    Builds the SPARQL query of several sets of filters at once: each set is a UNION
+    branch binding its position in filter_sets to ?set, so that the matches of each
+    set can be told apart. The variables of the sets are named after their
+    position (see buildCanonicalSparqlQuery), the sets having no set-membership
+    filter.
+    """
+    select_var_name = "?s"
+    q = buildPrefixes(context_mappers, context_when_no_context)
+    q += "SELECT {} ?set\n".format(select_var_name)
+    q += "WHERE {\n"
+
+    branches = []
+    for (position, filters) in enumerate(filter_sets):
+        body = "\tBIND({} AS ?set)\n".format(position)
+        body += buildWhereBody(
+            canonicalFilters(filters, "s{}f".format(position)), select_var_name
+        )
+        branches.append("\t{\n" + body.replace("\t", "\t\t") + "\t}\n")
+    q += "\tUNION\n".join(branches)
+
+    # close the query
+    q += "}"
+    return q
+
+
+def extractContext(context_payload):
+    """
+    Get the context from the payload of the context resource.
+    """
+    # stealing the context from the context payload. Could be @context or an element of
+    # it if it happens to be a list. We just take the first one in this case. (not
+    # bulletproof but since this resource is under the control of DKE, we will know
+    # if it changes...)
+    context = None
+    if isinstance(context_payload["@context"], dict):
+        context = context_payload["@context"]
+    elif isinstance(context_payload["@context"], list):
+        for el in context_payload["@context"]:
+            if isinstance(el, dict):
+                context = el
+                break
+    return context
+
+
+def importNexus(args):
+    """Import and configure the Nexus SDK (slow to import, hence only done by the
+    code paths querying Nexus with it)
+
+    Args:
+      args (:obj:`argparse.Namespace`): command line parameters namespace
+
+    Returns:
+      the nexussdk module, set with the token and environment of args. The
+      configuration of the SDK being global, the queries of a process must all be
+      sent with the same token and environment.
+    """
+    import nexussdk as nexus
+
+    nexus.config.set_token(args.nexus_token)
+    nexus.config.set_environment(args.nexus_env)
+    return nexus
+
+
+def fetchContextPayload(args, etag=None):
+    """
+    Fetch the payload of the context resource, with a conditional request if the ETag
+    of a previously fetched version is provided.
+    return :tuple: (payload, etag), payload being None if the context did not change
+    """
+    url = "/".join([
+        args.nexus_env,
+        "resources",
+        CONTEXT_ORG,
+        CONTEXT_PROJ,
+        "_",
+        quote_plus(CONTEXT_ID),
+    ])
+    import requests
+
+    headers = importNexus(args).utils.http.prepare_header()
+    if etag:
+        headers["If-None-Match"] = etag
+
+    response = requests.get(url, headers=headers)
+    if response.status_code == 304:
+        return None, etag
+    response.raise_for_status()
+
+    return response.json(), response.headers.get("ETag")
+
+
+def getContext(args):
+    """
+    Get the context used to translate the filters, along with its lowercase LUT.
+    The context is kept in memory and in the local cache (if any), and only
+    revalidated against Nexus once its age exceeds --context-ttl.
+    return :tuple: (context, lowercase_context_lut)
+    """
+    key = entryKey(args.nexus_env, CONTEXT_ID)
+    cache_dir = getCacheDir(args.cache_dir)
+    entry = CONTEXT_MEMO.get(key)
+    if entry is None and cache_dir:
+        entry = readJsonEntry(cache_dir, "context", key)
+
+    if entry and time.time() - entry["fetched_at"] < args.context_ttl:
+        logging.info("Using the cached context")
+    else:
+        etag = entry["etag"] if entry else None
+        context_payload, etag = fetchContextPayload(args, etag)
+
+        # the context did not change since it was cached (same ETag or same
+        # revision), only its validity is extended
+        if entry and (
+            context_payload is None or context_payload.get("_rev") == entry["rev"]
+        ):
+            logging.info("The cached context is still valid")
+        else:
+            context = extractContext(context_payload)
+            entry = {
+                "rev": context_payload.get("_rev"),
+                "context": context,
+                "lowercase_context_lut": buildLowercaseContextLut(context),
+            }
+
+        entry["etag"] = etag
+        entry["fetched_at"] = time.time()
+        if cache_dir:
+            writeJsonEntry(cache_dir, "context", key, entry)
+
+    CONTEXT_MEMO[key] = entry
+    return entry["context"], entry["lowercase_context_lut"]
+
+
+def canonicalFilters(filters, var_prefix="f"):
+    """
+    Normalize a set of filters (see normalizeFilters), their variables being named
+    after their position.
+    """
+    canonical_filters = []
+    for filter in normalizeFilters(filters):
+        if filter["value_type"] != "type":
+            filter["id"] = "{}{}".format(var_prefix, len(canonical_filters))
+        canonical_filters.append(filter)
+    return canonical_filters
+
+
+def buildCanonicalSparqlQuery(filters, context_mappers, context_when_no_context):
+    """
+    Builds the SPARQL query of a set of filters, such that equivalent sets of filters
+    (same filters in a different order, duplicates, different variable ids) always
+    give the very same query: the filters are normalized and sorted, and their
+    variables are named after their position.
+    """
+    return buildSparqlQuery(
+        canonicalFilters(filters), context_mappers, context_when_no_context
+    )
+
+
+def queryFingerprint(query):
+    """
+    Short hash of a query, to identify it in the logs (and in the Nexus logs).
+    """
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()[:16]
+
+
+def readCachedMatches(args, filters_key):
+    """
+    Get the ids a set of filters was resolved to, if they are in the cache (in
+    memory or on disk) and were pinned or resolved less than --filter-cache-ttl ago.
+    return :list: the (id, group) matches (see iterFilteredMatches), or None
+    """
+    if args.refresh_filters:
+        return None
+
+    entry = FILTERS_MEMO.get(filters_key)
+    cache_dir = getCacheDir(args.cache_dir)
+    if entry is None and cache_dir:
+        entry = readJsonEntry(cache_dir, "filters", filters_key)
+
+    if entry is None:
+        return None
+
+    if entry["pinned"] or time.time() - entry["resolved_at"] < args.filter_cache_ttl:
+        FILTERS_MEMO[filters_key] = entry
+        groups = entry.get("groups") or [None] * len(entry["ids"])
+        return list(zip(entry["ids"], groups))
+
+    return None
+
+
+def storeCachedMatches(args, filters_key, matches):
+    """
+    Keep the (id, group) matches a set of filters was resolved to, if caching them
+    is enabled (with --filter-cache-ttl or --pin-filters). No match is never cached.
+    """
+    if not matches or not (args.pin_filters or args.filter_cache_ttl > 0):
+        return
+
+    entry = {
+        "ids": [id for (id, _) in matches],
+        "resolved_at": time.time(),
+        "pinned": args.pin_filters,
+    }
+    if any(group is not None for (_, group) in matches):
+        entry["groups"] = [group for (_, group) in matches]
+    FILTERS_MEMO[filters_key] = entry
+
+    cache_dir = getCacheDir(args.cache_dir)
+    if cache_dir:
+        writeJsonEntry(cache_dir, "filters", filters_key, entry)
+
+
+def pageQuery(query, page_size, offset, order="?s"):
+    """
+    Restrict a query to a page of its results. The results are ordered (by the
+    variables of order), so that the pages do not overlap.
+    """
+    return "{}\nORDER BY {}\nLIMIT {}\nOFFSET {}".format(
+        query, order, page_size, offset
+    )
+
+
+def isElasticCompatible(args):
+    """
+    Check whether the --filter can be resolved by the Elasticsearch view, which
+    indexes the payloads as they are: the elements of a @list (eg. dimension[0])
+    can only be addressed with SPARQL, as well as the matches of a set-membership
+    filter grouped by value.
+    """
+    for given_filter in args.filter:
+        split_filter = splitFilter(given_filter)
+        if split_filter and any(
+            extractListIndexFromPropName(prop)[1] is not None
+            for prop in split_filter[0]
+        ):
+            return False
+        # the set-membership filters are compiled to a SPARQL VALUES block
+        if split_filter and splitInValues(*split_filter[1:]) is not None:
+            return False
+    return True
+
+
+def isTraversal(args):
+    """
+    Check whether some --filter might traverse the graph (eg. atlasRelease.name), in
+    which case Elasticsearch may match nothing, or only some of the resources, its
+    view only indexing the nested properties of a payload (not the resources an IRI
+    refers to, the IRI being indexed under '@id').
+    """
+    return any(
+        split_filter and len(split_filter[0]) > 1
+        for split_filter in map(splitFilter, args.filter)
+    )
+
+
+def buildElasticClause(field, symbol, value):
+    """
+    Builds the Elasticsearch clause of a filter on a field, with the semantics of the
+    SPARQL query: case-insensitive strings, != meaning "does not start with" for
+    strings, ~= and the values having regex metacharacters being regex.
+    return :tuple: (clause, negated)
+    """
+    number = parseNumber(value) if symbol != "~=" else None
+    if number is not None:
+        ranges = {">=": "gte", "<=": "lte", ">": "gt", "<": "lt"}
+        if symbol in ranges:
+            return {"range": {field: {ranges[symbol]: number}}}, False
+        return {"term": {field: number}}, symbol == "!="
+
+    # the query (and the pattern of its value) of each comparator, for the values
+    # without and with regex metacharacters
+    patterns = {
+        "~=": (("wildcard", "*{}*"), ("regexp", ".*{}.*")),
+        "=": (("term", "{}"), ("regexp", "{}")),
+        "!=": (("prefix", "{}"), ("regexp", "{}.*")),
+    }
+    if symbol not in patterns:
+        raise QueryError(f"The comparator {symbol} only applies to numbers")
+    (kind, pattern) = patterns[symbol][0 if isRegexFree(value) else 1]
+
+    field = "{}.{}".format(field, ELASTIC_KEYWORD_FIELD)
+    query = {
+        kind: {field: {"value": pattern.format(value), "case_insensitive": True}}
+    }
+    return query, symbol == "!="
+
+
+def buildElasticQuery(args, context, lowercase_context_lut):
+    """
+    Builds the Elasticsearch query of the --filter. The property names are the ones
+    of the payloads (the names of the context, whatever their case in the filter) and
+    the type is matched on @type, with its short name or its IRI.
+    For example:
+        "type=Entity" and "resolution.value>=10"
+        will turn into
+        {"bool": {"filter": [
+            {"terms": {"@type": ["Entity", "prov:Entity", "http://...#Entity"]}},
+            {"range": {"resolution.value": {"gte": 10}}}
+        ], "must_not": []}}
+    Like in the SPARQL query (where the property is in a triple pattern), a negated
+    filter only matches the payloads having the property.
+    return :dict: the query
+    """
+    clauses = []
+    negated_clauses = []
+    for given_filter in args.filter:
+        split_filter = splitFilter(given_filter)
+        if not split_filter:
+            continue
+        (properties, symbol, value) = split_filter
+
+        names = [
+            lowercase_context_lut.get(prop.lower(), prop) for prop in properties
+        ]
+        if names == [lowercase_context_lut.get("type")]:
+            name = lowercase_context_lut.get(value.lower(), value)
+            types = [value, name]
+            if isinstance(context.get(name), dict) and "@id" in context[name]:
+                type_id = context[name]["@id"]
+                types.append(type_id)
+                types.append(expandPrefix(type_id, context, lowercase_context_lut))
+            # like in the SPARQL query, the type is matched whatever the comparator
+            clauses.append({"terms": {"@type": list(dict.fromkeys(types))}})
+            continue
+
+        field = ".".join(names)
+        expanded_value = expandPrefix(value, context, lowercase_context_lut)
+        if expanded_value != value and symbol in ("=", "!="):
+            # the payloads may hold the compact or the expanded form of the value
+            clause = {"bool": {"should": [
+                buildElasticClause(field, "=", value)[0],
+                buildElasticClause(field, "=", expanded_value)[0],
+            ]}}
+            (clauses if symbol == "=" else negated_clauses).append(clause)
+            if symbol == "!=":
+                clauses.append({"exists": {"field": field}})
+            continue
+
+        (clause, negated) = buildElasticClause(field, symbol, value)
+        (negated_clauses if negated else clauses).append(clause)
+        if negated:
+            clauses.append({"exists": {"field": field}})
+
+    return {"bool": {"filter": clauses, "must_not": negated_clauses}}
+
+
+def iterElasticIds(args, query):
+    """
+    Run an Elasticsearch query on the default Elasticsearch view of the project, by
+    pages of --page-size results sorted by @id (one page of at most 10000 results if
+    --page-size is 0).
+    return :generator: the ids
+    """
+    body = {
+        "query": query,
+        "_source": ["@id"],
+        "sort": [{"@id": "asc"}],
+        "size": args.page_size or ELASTIC_MAX_SIZE,
+        "track_total_hits": False,
+    }
+    fingerprint = queryFingerprint(json.dumps(query, sort_keys=True))
+    logging.info(
+        "Elasticsearch query (fingerprint {}):\n{}".format(
+            fingerprint, json.dumps(query, indent=2)
+        )
+    )
+
+    while True:
+        try:
+            start_time = time.time()
+            result = importNexus(args).views.query_es(
+                args.nexus_org, args.nexus_proj, body, view_id=ELASTIC_VIEW
+            )
+            logging.info(
+                "Elasticsearch query {} answered in {:.2f}s".format(
+                    fingerprint, time.time() - start_time
+                )
+            )
+        except Exception as e:
+            raise QueryError(
+                f"Elasticsearch query {fingerprint} failed: {e}"
+            ) from e
+
+        hits = result["hits"]["hits"]
+        for hit in hits:
+            yield hit.get("_source", {}).get("@id", hit["_id"])
+
+        if not args.page_size or len(hits) < args.page_size:
+            break
+        body["search_after"] = hits[-1]["sort"]
+
+
+def getUnknownContext(args):
+    """
+    Get the IRI the properties which are not in the context are expanded with (the
+    resources of the project).
+    """
+    return (
+        args.nexus_env + "/resources/" + args.nexus_org + "/" + args.nexus_proj + "/_/"
+    )
+
+
+def iterSparqlBindings(args, query, order="?s"):
+    """
+    Run a SPARQL query on the SPARQL view of the project, by pages of --page-size
+    results (see pageQuery).
+    return :generator: the bindings of the results
+    """
+    fingerprint = queryFingerprint(query)
+    separator = (
+        "---------------------------------------------------------------------------"
+    )
+    logging.info(
+        "{}\nSPARQL Query (fingerprint {}):\n{}\n{}".format(
+            separator, fingerprint, query, separator
+        )
+    )
+    verbose = logging.getLogger().isEnabledFor(logging.INFO)
+
+    offset = 0
+    while True:
+        page_query = query
+        if args.page_size:
+            page_query = pageQuery(query, args.page_size, offset, order)
+
+        try:
+            start_time = time.time()
+            result = importNexus(args).views.query_sparql(
+                args.nexus_org, args.nexus_proj, query=page_query
+            )
+            logging.info(
+                "SPARQL query {} (offset {}) answered in {:.2f}s".format(
+                    fingerprint, offset, time.time() - start_time
+                )
+            )
+        except Exception as e:
+            response = getattr(e, "response", None)
+            if response is not None and response.status_code == 400:
+                logging.info("📄 Here is the original server error message:")
+                logging.info(
+                    response.text.replace("\\n", "\n").replace("\\t", "\t")
+                )
+            raise QueryError(f"SPARQL query {fingerprint} failed: {e}") from e
+
+        # the response is only serialized if it is logged
+        if verbose:
+            logging.info(
+                "{}\nSPARQL Response:\n{}\n{}".format(
+                    separator, json.dumps(result, indent=2), separator
+                )
+            )
+
+        bindings = result["results"]["bindings"]
+        yield from bindings
+
+        if not args.page_size or len(bindings) < args.page_size:
+            break
+        offset += args.page_size
+
+
+def iterSparqlMatches(args, filters, context_mappers):
+    """
+    Run the SPARQL query of the translated filters on the SPARQL view of the project.
+    return :generator: the (id, group) matches, the group being the value of the
+    set-membership filter the resource matches (None if there is none)
+    """
+    query = buildCanonicalSparqlQuery(
+        filters, context_mappers, getUnknownContext(args)
+    )
+    order = "?s"
+    if any(map(isInFilter, filters)):
+        order = "?s ?group"
+        # the matches of a resource are kept together even if the query is not paged
+        if not args.page_size:
+            query = f"{query}\nORDER BY {order}"
+    for binding in iterSparqlBindings(args, query, order):
+        yield binding["s"]["value"], binding.get("group", {}).get("value")
+
+
+def getSearchBackend(args):
+    """
+    Get the backend resolving the --filter: the --search-backend, "auto" being
+    "sparql" for the filters Elasticsearch cannot resolve (see isElasticCompatible),
+    and for the dotted filters which might traverse the graph (see isTraversal).
+    return :string: "sparql", "elastic" or "auto"
+    """
+    if args.search_backend == "auto" and (
+        not isElasticCompatible(args) or isTraversal(args)
+    ):
+        return "sparql"
+    return args.search_backend
+
+
+def iterBackendMatches(args, context, lowercase_context_lut, filters, context_mappers):
+    """
+    Resolve the --filter with the --search-backend: "sparql", "elastic", or "auto"
+    which resolves the filters with Elasticsearch unless they cannot be or might
+    traverse the graph (see getSearchBackend), or unless Elasticsearch fails before
+    any result.
+    return :generator: the (id, group) matches (see iterSparqlMatches)
+    """
+    backend = getSearchBackend(args)
+    if backend == "elastic" and not isElasticCompatible(args):
+        raise QueryError(
+            "The elements of a @list and the set-membership filters can only be "
+            "resolved with the sparql backend"
+        )
+
+    if backend != "sparql":
+        found = False
+        try:
+            query = buildElasticQuery(args, context, lowercase_context_lut)
+            for id in iterElasticIds(args, query):
+                found = True
+                yield id, None
+        except QueryError as e:
+            if backend == "elastic" or found:
+                raise
+            logging.warning(f"⚠️  {e}, resolving the filters with SPARQL")
+        else:
+            return
+
+    yield from iterSparqlMatches(args, filters, context_mappers)
+
+
+def iterFilteredMatches(args):
+    """
+    Resolve the --filter into the ids of the matching resources. The query is run by
+    pages of --page-size results, the ids being yielded as soon as their page is
+    received, so that a broad filter neither times out nor loads all the results at
+    once. With a set-membership filter (eg. "brainRegion=in(mba:1048,mba:997)"), the
+    ids are grouped by the value they match, all the values being resolved at once.
+    return :generator: the (id, group) matches, ordered by id, the group being the
+    matched value of the set-membership filter, as given (None if there is none)
+    """
+    # fetching the full context to look up the context mappings
+    (context, lowercase_context_lut) = getContext(args)
+
+    (filters, context_mappers) = translateFilters(args, context, lowercase_context_lut)
+
+    # the same filters may have been resolved recently (or pinned), whatever the
+    # backend they were resolved with
+    filters_key = entryKey(
+        args.nexus_env, args.nexus_org, args.nexus_proj, normalizeFilters(filters)
+    )
+    matches = readCachedMatches(args, filters_key)
+    if matches is not None:
+        logging.info(f"Using the cached resolution of the filters: {matches}")
+        yield from matches
+        return
+
+    # the matches are only kept (for the cache) if they are to be cached
+    matches = [] if args.pin_filters or args.filter_cache_ttl > 0 else None
+    for match in iterBackendMatches(
+        args, context, lowercase_context_lut, filters, context_mappers
+    ):
+        if matches is not None:
+            matches.append(match)
+        yield match
+
+    if matches is not None:
+        storeCachedMatches(args, filters_key, matches)
+
+
+def iterFilteredIds(args):
+    """
+    Resolve the --filter into the ids of the matching resources, see
+    iterFilteredMatches.
+    return :generator: the ids
+    """
+    # a resource matching several values of a set-membership filter is matched
+    # several times
+    seen = set()
+    for (id, _) in iterFilteredMatches(args):
+        if id not in seen:
+            seen.add(id)
+            yield id
+
+
+def getFilteredIds(args):
+    """
+    Resolve the --filter into the ids of the matching resources, see iterFilteredIds.
+    return :list: the ids
+    """
+    return list(iterFilteredIds(args))
+
+
+def resolveFilterSets(args, filter_sets):
+    """
+    Resolve several sets of filters (eg. the --filter of the entries of a batch) with
+    a single SPARQL query (see buildBatchSparqlQuery), instead of a query per set.
+    The sets which are cached are not queried, and the sets having a set-membership
+    filter or resolved with Elasticsearch (--search-backend elastic, or auto, see
+    getSearchBackend) are resolved one by one.
+    return :list: the ids matching each set of filters
+    """
+    (context, lowercase_context_lut) = getContext(args)
+
+    results = [None] * len(filter_sets)
+    pending = []
+    context_mappers = {}
+    for (position, filter_set) in enumerate(filter_sets):
+        set_args = copy.copy(args)
+        set_args.filter = list(filter_set)
+        (filters, set_context_mappers) = translateFilters(
+            set_args, context, lowercase_context_lut
+        )
+        if getSearchBackend(set_args) != "sparql" or any(map(isInFilter, filters)):
+            results[position] = getFilteredIds(set_args)
+            continue
+
+        filters_key = entryKey(
+            args.nexus_env, args.nexus_org, args.nexus_proj, normalizeFilters(filters)
+        )
+        matches = readCachedMatches(args, filters_key)
+        if matches is not None:
+            results[position] = [id for (id, _) in matches]
+            continue
+
+        context_mappers.update(set_context_mappers)
+        pending.append((position, filters, filters_key))
+
+    if not pending:
+        return results
+
+    query = buildBatchSparqlQuery(
+        [filters for (_, filters, _) in pending],
+        context_mappers,
+        getUnknownContext(args),
+    )
+    logging.info(f"Resolving {len(pending)} sets of filters with a single query")
+    pending_ids = [[] for _ in pending]
+    for binding in iterSparqlBindings(args, query, "?set ?s"):
+        pending_ids[int(binding["set"]["value"])].append(binding["s"]["value"])
+
+    for ((position, _, filters_key), ids) in zip(pending, pending_ids):
+        results[position] = ids
+        storeCachedMatches(args, filters_key, [(id, None) for id in ids])
+    return results
@@ -0,0 +1,145 @@
+"""
+Benchmark of the memory used by the download of a large distribution file.
+
+A synthetic file (of --size bytes, generated on the fly) is served over HTTP by a
+local server running in another process, then downloaded with
+bba_data_fetch.download.downloadFile for each of the --buffer-size values. The
+resident memory (RSS) of the process is sampled during the download: its peak must
+stay flat, whatever the size of the file.
+
+Usage:
+    python benchmarks/bench_download_memory.py --size 4G --buffer-size 64K 1M 8M
+"""
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from bba_data_fetch.cache import parseSize, formatSize
+from bba_data_fetch.download import downloadFile
+
+BLOCK = hashlib.sha256(b"bba-data-fetch").digest() * (1024 * 1024 // 32)
+
+
+def syntheticFile(size):
+    """Generate the content of the synthetic file, by blocks"""
+    sent = 0
+    while sent < size:
+        block = BLOCK[: min(len(BLOCK), size - sent)]
+        sent += len(block)
+        yield block
+
+
+def serve(size, port_queue):
+    """Serve the synthetic file on a free local port"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            for block in syntheticFile(size):
+                self.wfile.write(block)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    port_queue.put(httpd.server_address[1])
+    httpd.serve_forever()
+
+
+def currentRss():
+    """Resident memory of the process, in bytes"""
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class RssSampler(threading.Thread):
+    """Sample the resident memory of the process until stopped"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, currentRss())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", default="2G", help="size of the synthetic file")
+    parser.add_argument(
+        "--buffer-size", nargs="+", default=["64K", "1M", "8M"], help="buffer sizes"
+    )
+    parser.add_argument(
+        "--tmp-dir", default=None, help="where to write the downloaded file"
+    )
+    args = parser.parse_args(argv)
+
+    size = parseSize(args.size)
+    digest = hashlib.sha256()
+    for block in syntheticFile(size):
+        digest.update(block)
+    digest = digest.hexdigest()
+
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(size, port_queue), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{port_queue.get()}/file"
+
+    print(f"File size: {formatSize(size)}")
+    print(f"{'buffer':>8} {'time':>8} {'throughput':>12} {'RSS before':>12} "
+          f"{'RSS peak':>12} {'RSS growth':>12}")
+
+    try:
+        with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+            out_filepath = os.path.join(tmp_dir, "file.nrrd")
+            for buffer_size in args.buffer_size:
+                rss_before = currentRss()
+                sampler = RssSampler()
+                sampler.start()
+                start = time.time()
+                downloadFile(
+                    requests.Session(),
+                    url,
+                    out_filepath,
+                    "SHA-256",
+                    digest,
+                    buffer_size=parseSize(buffer_size),
+                )
+                duration = time.time() - start
+                rss_peak = sampler.stop()
+                os.remove(out_filepath)
+                print(
+                    f"{buffer_size:>8} {duration:>7.1f}s "
+                    f"{formatSize(size / duration) + '/s':>12} "
+                    f"{formatSize(rss_before):>12} {formatSize(rss_peak):>12} "
+                    f"{formatSize(max(0, rss_peak - rss_before)):>12}"
+                )
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
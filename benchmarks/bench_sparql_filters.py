@@ -0,0 +1,155 @@
+"""
+Benchmark of the SPARQL queries the filters are translated into.
+
+A synthetic graph of --resources resources (typed, named, with a resolution and a
+brain region) is loaded into a local rdflib store, then the same filters are
+resolved with the query of buildSparqlQuery and with the former query, where every
+string comparison is an anchored case-insensitive regex and the patterns are in the
+order of the filters. Both queries must give the same ids. With --plan, the algebra
+of both queries (the plan rdflib evaluates) is printed as well.
+
+Usage (requires rdflib, installed with the 'bench' extra: pip install -e .[bench]):
+    python benchmarks/bench_sparql_filters.py --resources 20000 --repeat 5 --plan
+"""
+
+import time
+import argparse
+
+from rdflib import Graph, Literal, Namespace, URIRef, RDF
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.algebra import pprintAlgebra
+
+from bba_data_fetch.main import parse_args
+from bba_data_fetch.query import buildSparqlQuery, translateFilters
+
+NSG = Namespace("https://neuroshapes.org/")
+SCHEMA = Namespace("http://schema.org/")
+MBA = Namespace("http://api.brain-map.org/api/v2/data/Structure/")
+RESOURCES = Namespace("https://bbp.epfl.ch/neurosciencegraph/data/")
+TYPES = ["BrainParcellationDataLayer", "CellDensityDataLayer", "Mesh", "Atlas"]
+
+CONTEXT = {
+    "type": {"@id": "rdf:type"},
+    "name": {"@id": "nsg:name"},
+    "resolution": {"@id": "nsg:resolution"},
+    "value": {"@id": "schema:value"},
+    "brainRegion": {"@id": "nsg:brainRegion"},
+    "nsg": str(NSG),
+    "schema": str(SCHEMA),
+    "mba": str(MBA),
+    "rdf": str(RDF),
+}
+for t in TYPES:
+    CONTEXT[t] = {"@id": f"nsg:{t}"}
+
+FILTERS = [
+    "name=annotation_25",
+    "brainRegion=mba:997",
+    "resolution.value=25",
+    "type=BrainParcellationDataLayer",
+]
+
+
+def addResource(graph, res, type, name, resolution, region):
+    """Add a resource to the graph"""
+    graph.add((res, RDF.type, NSG[type]))
+    graph.add((res, NSG.name, Literal(name)))
+    graph.add((res, NSG.brainRegion, MBA[str(region)]))
+    node = URIRef(f"{res}/resolution")
+    graph.add((res, NSG.resolution, node))
+    graph.add((node, SCHEMA.value, Literal(resolution)))
+
+
+def buildGraph(resources):
+    """Build the synthetic graph"""
+    graph = Graph()
+    for i in range(resources):
+        resolution = [10, 25, 50, 100][i % 4]
+        addResource(
+            graph,
+            RESOURCES[f"r{i}"],
+            TYPES[i % len(TYPES)],
+            f"Annotation_{resolution}_{i % 97}",
+            resolution,
+            [997, 8, 315][i % 3],
+        )
+    # the resources the filters are meant to find
+    for i, name in enumerate(["annotation_25", "Annotation_25"]):
+        addResource(graph, RESOURCES[f"match{i}"], TYPES[0], name, 25, 997)
+    return graph
+
+
+def buildRegexQuery(filters, context_mappers, context_when_no_context):
+    """Build the former query: the filters in their order, compared with regex"""
+    q = "PREFIX unknown: <{}>\n".format(context_when_no_context)
+    for pref in sorted(context_mappers):
+        q += "PREFIX {}: <{}>\n".format(pref, context_mappers[pref])
+    q += "SELECT ?s\nWHERE {\n"
+    for filter in filters:
+        if filter["value_type"] == "type":
+            q += "\t?s a {} .\n".format(filter["value"])
+        else:
+            q += "\t?s {} ?{} .\n".format("/".join(filter["properties"]), filter["id"])
+    for filter in filters:
+        if filter["value_type"] == "string":
+            q += '\tFILTER(regex(str(?{}), "^{}$", "i"))\n'.format(
+                filter["id"], filter["value"]
+            )
+        elif filter["value_type"] == "number":
+            q += "\tFILTER(?{} {} {}) .\n".format(
+                filter["id"], filter["comparator"], filter["value"]
+            )
+    return q + "}"
+
+
+def timeQuery(graph, query, repeat):
+    """Run a query repeat times, return its ids and its best time"""
+    prepared = prepareQuery(query)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ids = sorted(str(row[0]) for row in graph.query(prepared))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return ids, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--resources", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--plan", action="store_true", help="print the query plans")
+    options = parser.parse_args()
+
+    args = parse_args([
+        "--nexus-token", "", "--nexus-env", "env", "--nexus-org", "org",
+        "--nexus-proj", "proj", "--out", "out", "--filter", *FILTERS
+    ])
+    filters, context_mappers = translateFilters(args, CONTEXT)
+    context_when_no_context = "env/resources/org/proj/_/"
+
+    print(f"Building a graph of {options.resources} resources...")
+    graph = buildGraph(options.resources)
+
+    queries = {
+        "regex": buildRegexQuery(filters, context_mappers, context_when_no_context),
+        "optimized": buildSparqlQuery(
+            filters, context_mappers, context_when_no_context
+        ),
+    }
+    results = {}
+    for name, query in queries.items():
+        print(f"\n--- {name} query ---\n{query}")
+        if options.plan:
+            pprintAlgebra(prepareQuery(query))
+        ids, best = timeQuery(graph, query, options.repeat)
+        results[name] = ids
+        print(f"{len(ids)} ids, best of {options.repeat}: {best * 1000:.1f} ms")
+
+    if results["regex"] != results["optimized"]:
+        raise SystemExit("❌ The queries do not give the same ids")
+    print("\n✅ The queries give the same ids")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Fakes of the kgforge objects, shared by the tests"""
+
+
+class FakeResource:
+    """Stands for the kgforge Resource returned by forge.retrieve"""
+
+    def __init__(self, payload, project="https://env/projects/bbp/atlas"):
+        self.payload = payload
+        self._store_metadata = type("Metadata", (), {"_project": project})()
+
+    def get_identifier(self):
+        return self.payload.get("@id", self.payload.get("id"))
+
+
+class FakeForge:
+    """Stands for a KnowledgeGraphForge, serving payloads by id (and failing to
+    retrieve the id 'broken')"""
+
+    def __init__(self, payloads, project="https://env/projects/bbp/atlas"):
+        self.payloads = payloads
+        self.project = project
+        self.retrieved = []
+        self.versions = []
+
+    def retrieve(self, id, version=None, cross_bucket=True):
+        self.retrieved.append(id)
+        self.versions.append(version)
+        if id == "broken":
+            raise ValueError("connection refused")
+        if id not in self.payloads:
+            return None
+        return FakeResource(self.payloads[id], self.project)
+
+    def from_json(self, payload):
+        return FakeResource(payload, self.project)
+
+    def as_json(self, res):
+        return dict(res.payload)
@@ -0,0 +1,104 @@
+import os
+import json
+import pytest
+from bba_data_fetch.main import parse_args
+from bba_data_fetch.batch import readManifest, entryArgs
+
+test_folder = os.environ["TEST_FOLDER"]
+
+
+def test_readManifest(tmp_path):
+
+    entries = [
+        {"nexus-id": "https://some/id", "out": "./tmp/annotation.nrrd"},
+        {
+            "filter": ["type=CellPositions", "brainLocation.brainRegion=mba:1048"],
+            "out": "./tmp/positions.json",
+            "payload": True,
+            "keep-meta": True,
+            "rev": 3,
+        },
+    ]
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"fetches": entries}))
+
+    result = readManifest(str(manifest))
+    assert result == [
+        {"nexus_id": "https://some/id", "out": "./tmp/annotation.nrrd"},
+        {
+            "filter": ["type=CellPositions", "brainLocation.brainRegion=mba:1048"],
+            "out": "./tmp/positions.json",
+            "payload": True,
+            "keep_meta": True,
+            "nexus_rev": 3,
+        },
+    ]
+
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text(
+        "nexus-id,filter,out,payload\n"
+        ',"type=CellPositions ""atlasRelease.name=Allen Mouse CCF v2""",p.json,true\n'
+        "https://some/id,,a.nrrd,\n"
+    )
+    result = readManifest(str(manifest))
+    assert result == [
+        {
+            "filter": ["type=CellPositions", "atlasRelease.name=Allen Mouse CCF v2"],
+            "out": "p.json",
+            "payload": True,
+        },
+        {"nexus_id": "https://some/id", "out": "a.nrrd"},
+    ]
+
+    manifest = tmp_path / "manifest.yaml"
+    manifest.write_text("- nexus-id: https://some/id\n  filter: type=CellPositions\n"
+                        "  out: a.nrrd\n")
+    with pytest.raises(ValueError) as e:
+        readManifest(str(manifest))
+    assert "must have either a 'nexus-id' or a 'filter'" in str(e.value)
+
+    manifest = tmp_path / "manifest.yaml"
+    manifest.write_text("- nexus-id: https://some/id\n  output: a.nrrd\n")
+    with pytest.raises(ValueError) as e:
+        readManifest(str(manifest))
+    assert "unknown key 'output'" in str(e.value)
+
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("")
+    with pytest.raises(ValueError) as e:
+        readManifest(str(manifest))
+    assert "unsupported manifest extension" in str(e.value)
+
+
+def test_entryArgs():
+
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--manifest",
+        "manifest.json",
+        "--favor",
+        "name:1.json",
+    ]
+    args = parse_args(list_of_args)
+
+    entry_args = entryArgs(args, {"nexus_id": "id", "out": test_folder})
+    assert entry_args.nexus_id == "id"
+    assert entry_args.filter is None
+    assert entry_args.out == test_folder
+    assert entry_args.favor == ["name:1.json"]
+    assert entry_args.keep_meta is True
+    assert entry_args.manifest is None
+    # the command line namespace is left untouched
+    assert args.nexus_id is None
+
+    entry_args = entryArgs(args, {"filter": ["a=1"], "out": "a.json",
+                                  "keep_meta": True})
+    assert entry_args.filter == ["a=1"]
+    assert entry_args.keep_meta is False
@@ -0,0 +1,142 @@
+import os
+import pytest
+from bba_data_fetch.cache import (
+    DistributionCache,
+    parseSize,
+    formatSize,
+    getCacheDir,
+    entryPath,
+    readJsonEntry,
+    writeJsonEntry,
+)
+from bba_data_fetch.main import main
+
+DIGEST = "a1b2c3d4e5f6"
+
+
+def test_parseSize():
+
+    assert parseSize(None) is None
+    assert parseSize("") is None
+    assert parseSize("1024") == 1024
+    assert parseSize("2K") == 2048
+    assert parseSize("1.5G") == int(1.5 * 1024**3)
+    assert parseSize("20GB") == 20 * 1024**3
+    assert parseSize("3 MiB") == 3 * 1024**2
+
+    with pytest.raises(ValueError) as e:
+        parseSize("twenty gigs")
+    assert "invalid size 'twenty gigs'" in str(e.value)
+
+
+def test_formatSize():
+
+    assert formatSize(12) == "12B"
+    assert formatSize(2048) == "2.0KB"
+    assert formatSize(5 * 1024**3) == "5.0GB"
+
+
+def test_getCacheDir(monkeypatch):
+
+    monkeypatch.delenv("BBA_DATA_FETCH_CACHE_DIR", raising=False)
+    assert getCacheDir() is None
+    assert getCacheDir("some/dir") == "some/dir"
+
+    monkeypatch.setenv("BBA_DATA_FETCH_CACHE_DIR", "env/dir")
+    assert getCacheDir() == "env/dir"
+    assert getCacheDir("some/dir") == "some/dir"
+
+
+def test_DistributionCache(tmp_path):
+
+    cache = DistributionCache(str(tmp_path / "cache"))
+    out_filepath = str(tmp_path / "out.nrrd")
+
+    assert cache.path("SHA-256", DIGEST.upper()).endswith(
+        os.path.join("objects", "sha-256", "a1", DIGEST)
+    )
+    with pytest.raises(ValueError):
+        cache.path("SHA-256", "../../etc/passwd")
+
+    # miss
+    assert not cache.fetch("SHA-256", DIGEST, out_filepath)
+    assert not os.path.exists(out_filepath)
+
+    downloaded = tmp_path / "downloaded.nrrd"
+    downloaded.write_bytes(b"some content")
+    cache.store("SHA-256", DIGEST, str(downloaded))
+    assert cache.stats()["files"] == 1
+    assert cache.stats()["size"] == len(b"some content")
+
+    # hit, the output being replaced and not written through
+    with open(out_filepath, "wb") as f:
+        f.write(b"previous content")
+    assert cache.fetch("SHA-256", DIGEST, out_filepath)
+    with open(out_filepath, "rb") as f:
+        assert f.read() == b"some content"
+    with open(cache.path("SHA-256", DIGEST), "rb") as f:
+        assert f.read() == b"some content"
+
+
+def test_DistributionCache_gc(tmp_path):
+
+    cache = DistributionCache(str(tmp_path / "cache"))
+    for i, digest in enumerate(["aa01", "aa02", "aa03"]):
+        filepath = tmp_path / digest
+        filepath.write_bytes(b"x" * 100)
+        cache.store("SHA-256", digest, str(filepath))
+        os.utime(cache.path("SHA-256", digest), (1000 + i, 1000 + i))
+
+    # using a file makes it the most recently used
+    assert cache.fetch("SHA-256", "aa01", str(tmp_path / "out"))
+
+    assert cache.gc() == (0, 0)
+    assert cache.gc(max_size=150) == (2, 200)
+    assert [os.path.basename(e[0]) for e in cache.entries()] == ["aa01"]
+
+    # the size limit is enforced when storing
+    cache = DistributionCache(str(tmp_path / "cache"), max_size=150)
+    filepath = tmp_path / "bb01"
+    filepath.write_bytes(b"y" * 100)
+    cache.store("SHA-256", "bb01", str(filepath))
+    assert [os.path.basename(e[0]) for e in cache.entries()] == ["bb01"]
+
+
+def test_DistributionCache_json(tmp_path):
+    # the JSON entries count in the size of the cache, and are evicted as the files
+    cache_dir = str(tmp_path / "cache")
+    cache = DistributionCache(cache_dir)
+    for i, key in enumerate(["aa", "bb"]):
+        writeJsonEntry(cache_dir, "payloads", key, {"name": "x" * 100})
+        os.utime(entryPath(cache_dir, "payloads", key), (1000 + i, 1000 + i))
+    filepath = tmp_path / "file"
+    filepath.write_bytes(b"x" * 100)
+    cache.store("SHA-256", "aa01", str(filepath))
+    assert cache.stats()["files"] == 3
+
+    # reading an entry makes it the most recently used
+    assert readJsonEntry(cache_dir, "payloads", "aa") == {"name": "x" * 100}
+
+    assert cache.gc(max_size=250) == (1, 112)
+    assert readJsonEntry(cache_dir, "payloads", "bb") is None
+    assert readJsonEntry(cache_dir, "payloads", "aa") is not None
+
+
+def test_cache_command(tmp_path, capsys):
+
+    cache_dir = str(tmp_path / "cache")
+    cache = DistributionCache(cache_dir)
+    filepath = tmp_path / "file"
+    filepath.write_bytes(b"x" * 100)
+    cache.store("SHA-256", "aa01", str(filepath))
+
+    main(["cache", "stats", "--cache-dir", cache_dir])
+    assert "Files: 1\nSize: 100B\n" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit) as e:
+        main(["cache", "gc", "--cache-dir", cache_dir])
+    assert e.value.code == 1
+
+    main(["cache", "gc", "--cache-dir", cache_dir, "--max-size", "0"])
+    assert "1 files evicted, 100B freed" in capsys.readouterr().out
+    assert cache.stats()["files"] == 0
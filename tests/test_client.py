@@ -0,0 +1,233 @@
+import json
+import threading
+import pytest
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bba_data_fetch.client import NexusClient, PrefetchedEngine, splitId
+from tests.fakes import FakeForge, FakeResource
+
+ID = "https://bbp.epfl.ch/neurosciencegraph/data/annotation"
+SOURCE = {
+    "@id": ID,
+    "@type": "BrainParcellationDataLayer",
+    "distribution": {"name": "annotation.nrrd"},
+}
+
+
+class NexusHandler(BaseHTTPRequestHandler):
+    """Serves the resolver, resource and source endpoints of a single resource"""
+
+    requests = []
+    etag = '"rev3"'
+
+    def do_GET(self):
+        NexusHandler.requests.append(self.path)
+        base = f"http://{self.headers['Host']}"
+        resolved = "/resolvers/org/proj/_/" + requests.utils.quote(ID, safe="")
+        resource = "/resources/bbp/atlas/_/" + requests.utils.quote(ID, safe="")
+        path = self.path.split("?")[0]
+
+        if path in [resolved, resource]:
+            if self.headers.get("If-None-Match") == NexusHandler.etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = {
+                "@id": ID,
+                "_self": base + resource,
+                "_project": base + "/projects/bbp/atlas",
+                "_rev": 3,
+            }
+        elif path == resource + "/source":
+            body = SOURCE
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/ld+json")
+        self.send_header("Content-Length", str(len(payload)))
+        if path != resource + "/source":
+            self.send_header("ETag", NexusHandler.etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        # the Elasticsearch view, holding the source of the resource as a string
+        NexusHandler.requests.append(self.path)
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        hits = []
+        if ID in query["query"]["terms"]["@id"]:
+            hits.append({"_id": ID, "_source": {
+                "@id": ID,
+                "_rev": 3,
+                "_project": "https://env/projects/bbp/atlas",
+                "_original_source": json.dumps(SOURCE),
+            }})
+
+        payload = json.dumps({"hits": {"hits": hits}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def nexus_env():
+    NexusHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), NexusHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_retrieve(nexus_env):
+
+    client = NexusClient(requests.Session(), nexus_env, "org", "proj")
+    res = client.retrieve(ID, version=2)
+    assert res.get_identifier() == ID
+    assert res._store_metadata._project == nexus_env + "/projects/bbp/atlas"
+    assert client.as_json(res) == SOURCE
+    assert client.as_json(res) is not res.payload
+
+    # the version is given to the resolver, the source is fetched at the same rev
+    assert NexusHandler.requests[0].endswith("?rev=2")
+    assert NexusHandler.requests[1].endswith("/source?rev=3")
+
+    res = client.retrieve(ID, version="v1.0")
+    assert NexusHandler.requests[2].endswith("?tag=v1.0")
+
+    # the version may be given in the @id, as with kgforge
+    res = client.retrieve(ID + "?tag=v1.1")
+    assert res.get_identifier() == ID
+    assert NexusHandler.requests[-2].endswith(
+        requests.utils.quote(ID, safe="") + "?tag=v1.1"
+    )
+    client.retrieve(ID + "?tag=v1.1", version=2)
+    assert NexusHandler.requests[-2].endswith("?rev=2")
+    assert splitId(ID + "#part?rev=4") == (ID + "#part", {"rev": "4"})
+    assert splitId(ID) == (ID, {})
+
+    assert client.retrieve("https://unknown") is None
+    # without cross bucket, the resource is looked for in org/proj only
+    assert client.retrieve(ID, cross_bucket=False) is None
+    assert "/resources/org/proj/_/" in NexusHandler.requests[-1]
+
+
+def test_revalidate(nexus_env):
+
+    client = NexusClient(requests.Session(), nexus_env, "org", "proj")
+    res = client.retrieve(ID)
+    assert res.etag == '"rev3"'
+
+    # a single conditional request on the resource itself, answered 304
+    NexusHandler.requests = []
+    assert client.revalidate(res) is res
+    assert NexusHandler.requests == [
+        "/resources/bbp/atlas/_/" + requests.utils.quote(ID, safe="")
+    ]
+
+    # without ETag, the revisions are compared
+    res.etag = None
+    assert client.revalidate(res) is res
+    res._store_metadata._rev = 2
+    latest = client.revalidate(res)
+    assert latest is not res
+    assert latest._store_metadata._rev == 3
+    assert client.as_json(latest) == SOURCE
+    assert NexusHandler.requests[-1].endswith("/source?rev=3")
+
+    # the prefetched resources are the latest revision already
+    engine = PrefetchedEngine(client, {ID: latest})
+    assert engine.revalidate(res) is latest
+    assert PrefetchedEngine(FakeForge({}), {}).revalidate(res) is None
+
+
+class SerializingForge(FakeForge):
+    """Forge serializing the payloads its own way"""
+
+    def as_json(self, res):
+        return dict(res.payload, serialized=True)
+
+
+def test_retrieveMany(nexus_env):
+
+    client = NexusClient(requests.Session(), nexus_env, "org", "proj")
+    resources = client.retrieveMany([ID, "https://unknown", ID])
+    assert list(resources) == [ID]
+    assert resources[ID]._store_metadata._rev == 3
+    assert client.as_json(resources[ID]) == SOURCE
+    assert NexusHandler.requests == [
+        "/views/org/proj/nxv%3AdefaultElasticSearchIndex/_search"
+    ]
+
+    # the prefetched resources are served (at their latest revision), and serialized
+    # by the forge as the resources it retrieves
+    forge = SerializingForge(
+        {ID: {"@id": ID, "_rev": 2}, "https://unknown": {"@id": "https://unknown"}}
+    )
+    engine = PrefetchedEngine(forge, resources)
+    assert engine.retrieve(ID) is resources[ID]
+    assert engine.as_json(engine.retrieve(ID)) == dict(SOURCE, serialized=True)
+    assert engine.retrieve(ID, version=2).payload == {"@id": ID, "_rev": 2}
+    res = engine.retrieve("https://unknown")
+    assert res.get_identifier() == "https://unknown"
+    assert forge.retrieved == [ID, "https://unknown"]
+    assert forge.versions == [2, None]
+    assert engine.as_json(res) == {"@id": "https://unknown", "serialized": True}
+
+    assert PrefetchedEngine(client, resources).as_json(resources[ID]) == SOURCE
+
+
+class FakeNexusService:
+    """Stands for the service of the Nexus store of a forge, converting the JSON-LD
+    payloads into resources"""
+
+    def __init__(self):
+        self.synchronized = []
+
+    def to_resource(self, payload):
+        def convert(value):
+            if isinstance(value, dict):
+                return {k.lstrip("@"): convert(v) for k, v in value.items()}
+            return value
+
+        return FakeResource(convert(payload))
+
+    def synchronize_resource(self, resource, metadata, action, succeeded, sync):
+        self.synchronized.append(metadata)
+
+
+class FakeStoreForge(SerializingForge):
+    """Stands for a KnowledgeGraphForge with a Nexus store, retrieving SOURCE"""
+
+    def __init__(self):
+        super().__init__({})
+        self._store = type("Store", (), {"service": FakeNexusService()})()
+
+    def retrieve(self, id, version=None, cross_bucket=True):
+        resource = self._store.service.to_resource(SOURCE)
+        self._store.service.synchronize_resource(
+            resource, {"_rev": 3}, "retrieve", True, True
+        )
+        return resource
+
+
+def test_PrefetchedEngine_forge(nexus_env):
+
+    # a prefetched payload is serialized as the payload retrieved by the forge
+    client = NexusClient(requests.Session(), nexus_env, "org", "proj")
+    resources = client.retrieveMany([ID])
+    forge = FakeStoreForge()
+    engine = PrefetchedEngine(forge, resources)
+    assert engine.as_json(resources[ID]) == forge.as_json(forge.retrieve(ID))
+    assert engine.as_json(resources[ID])["id"] == ID
+    assert forge._store.service.synchronized[0]["_rev"] == 3
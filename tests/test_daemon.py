@@ -0,0 +1,154 @@
+import os
+import logging
+import threading
+import pytest
+import bba_data_fetch.daemon as bba_daemon
+from bba_data_fetch.daemon import FetchDaemon, delegate, getSocketPath
+from bba_data_fetch.download import ContextExecutor
+from bba_data_fetch.main import parse_args, parse_serve_args
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    # short path, as the path of a Unix socket is limited to about 100 characters
+    path = f"/tmp/bba-data-fetch-test-{os.getpid()}.sock"
+    yield path
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def fetchArgs(socket_path, *extra_args):
+    return parse_args(
+        [
+            "--nexus-token",
+            "token",
+            "--nexus-env",
+            "https://env",
+            "--nexus-org",
+            "org",
+            "--nexus-proj",
+            "proj",
+            "--out",
+            "annotation.nrrd",
+            "--nexus-id",
+            "id",
+            "--socket",
+            socket_path,
+        ]
+        + list(extra_args)
+    )
+
+
+def test_getSocketPath(monkeypatch):
+
+    monkeypatch.setenv("BBA_DATA_FETCH_SOCKET", "/run/fetch.sock")
+    assert getSocketPath("/other.sock") == "/other.sock"
+    assert getSocketPath() == "/run/fetch.sock"
+    monkeypatch.delenv("BBA_DATA_FETCH_SOCKET")
+    monkeypatch.setenv("XDG_RUNTIME_DIR", "/run/user/1000")
+    assert getSocketPath() == "/run/user/1000/bba-data-fetch.sock"
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    assert getSocketPath().endswith(f"bba-data-fetch-{os.getuid()}/fetch.sock")
+
+
+def test_FetchDaemon_private(tmp_path, monkeypatch):
+    # the default socket is in a directory only the user can access
+    private_dir = f"/tmp/bba-data-fetch-test-{os.getpid()}"
+    monkeypatch.setattr(bba_daemon, "getPrivateDir", lambda: private_dir)
+    socket_path = os.path.join(private_dir, "fetch.sock")
+    daemon = FetchDaemon(socket_path, "token", "https://env", lambda args: None, 1)
+    try:
+        assert os.stat(private_dir).st_mode & 0o777 == 0o700
+        assert os.stat(socket_path).st_mode & 0o077 == 0
+    finally:
+        daemon.server_close()
+
+    os.chmod(private_dir, 0o755)
+    try:
+        with pytest.raises(OSError):
+            FetchDaemon(socket_path, "token", "https://env", lambda args: None, 1)
+    finally:
+        os.rmdir(private_dir)
+
+
+def test_delegate(tmp_path, socket_path, caplog, monkeypatch):
+    args = fetchArgs(socket_path)
+
+    # no daemon running
+    assert delegate(args) is None
+
+    # the token is not sent to a path that is not a socket of the user
+    with open(socket_path, "w"):
+        pass
+    assert delegate(args) is None
+    assert "is not a socket of the user" in caplog.text
+    os.remove(socket_path)
+
+    fetched = []
+
+    def runFetch(args):
+        fetched.append(args)
+        logging.warning(f"⚠️  fetching {args.nexus_id}")
+        if args.nexus_id == "missing":
+            exit(1)
+
+    daemon = FetchDaemon(socket_path, "token", "https://env", runFetch, 2)
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with pytest.raises(OSError):
+            FetchDaemon(socket_path, "token", "https://env", runFetch, 2)
+
+        # the fetch is run by the daemon, with absolute paths, and its log replayed
+        assert delegate(args) == 0
+        assert fetched[0].out == os.path.abspath("annotation.nrrd")
+        assert fetched[0].nexus_id == "id"
+        assert "⚠️  fetching id" in caplog.text
+
+        args.nexus_id = "missing"
+        assert delegate(args) == 1
+
+        monkeypatch.setattr(bba_daemon.os, "getuid", lambda: -1)
+        assert delegate(args) is None
+        monkeypatch.undo()
+
+        # the fetches with another token, the manifests and --no-daemon are run
+        # locally
+        args.nexus_token = "other"
+        assert delegate(args) is None
+        args.nexus_token = "token"
+        args.no_daemon = True
+        assert delegate(args) is None
+        assert len(fetched) == 2
+    finally:
+        daemon.shutdown()
+        daemon.server_close()
+
+    assert not os.path.exists(socket_path)
+
+
+def test_serveFetch_workers(socket_path):
+    # the log of the worker threads of a fetch is sent back, not the one of the
+    # other threads
+    def runFetch(args):
+        with ContextExecutor(max_workers=2) as executor:
+            executor.submit(logging.error, f"❌ Resource '{args.nexus_id}' not found")
+        other = threading.Thread(target=logging.warning, args=("⚠️  another fetch",))
+        other.start()
+        other.join()
+        exit(1)
+
+    daemon = FetchDaemon(socket_path, "token", "https://env", runFetch, 1)
+    try:
+        reply = daemon.serveFetch(fetchArgs(socket_path))
+    finally:
+        daemon.server_close()
+    assert reply == {"status": 1, "log": [[logging.ERROR, "❌ Resource 'id' not found"]]}
+
+
+def test_parse_serve_args():
+    # the configuration path of the forge built at startup is the one of the fetches
+    # delegated to the daemon
+    args = parse_serve_args(["--nexus-token", "token", "--nexus-env", "https://env/"])
+    assert args.nexus_env == "https://env"
+    assert args.forge_config == os.path.abspath("cfg/forge-config.yml")
@@ -0,0 +1,47 @@
+import hashlib
+import pytest
+from bba_data_fetch.digest import getHashlibName, hashFile, isUpToDate
+
+
+def test_getHashlibName():
+
+    assert getHashlibName("SHA-256") == "sha256"
+    assert getHashlibName("sha256") == "sha256"
+    assert getHashlibName("MD5") == "md5"
+    assert getHashlibName("SHA_512") == "sha512"
+
+    with pytest.raises(ValueError) as e:
+        getHashlibName("CRC-32")
+    assert "unsupported digest algorithm 'CRC-32'" in str(e.value)
+
+
+def test_hashFile(tmp_path):
+
+    content = bytes(range(256)) * 1000
+    filepath = tmp_path / "file.nrrd"
+    filepath.write_bytes(content)
+
+    expected = hashlib.sha256(content).hexdigest()
+    assert hashFile(str(filepath), "SHA-256") == expected
+    # hashed by slices smaller than the file
+    assert hashFile(str(filepath), "SHA-256", chunk_size=1000) == expected
+    assert hashFile(str(filepath), "MD5") == hashlib.md5(content).hexdigest()
+
+    empty_filepath = tmp_path / "empty.nrrd"
+    empty_filepath.write_bytes(b"")
+    assert hashFile(str(empty_filepath), "SHA-256") == hashlib.sha256().hexdigest()
+
+
+def test_isUpToDate(tmp_path):
+
+    filepath = tmp_path / "file.json"
+    digest = hashlib.sha256(b"{}").hexdigest()
+
+    assert not isUpToDate(str(filepath), "SHA-256", digest)
+
+    filepath.write_bytes(b"{}")
+    assert isUpToDate(str(filepath), "SHA-256", digest)
+    assert isUpToDate(str(filepath), "SHA-256", digest.upper())
+
+    filepath.write_bytes(b"{ }")
+    assert not isUpToDate(str(filepath), "SHA-256", digest)
@@ -0,0 +1,196 @@
+import os
+import hashlib
+import threading
+import pytest
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bba_data_fetch.download import (
+    DigestMismatchError,
+    downloadFile,
+    downloadSegmented,
+    getFileUrl,
+    getSession,
+)
+
+CONTENT = os.urandom(300000)
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+LOCK = threading.Lock()
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves CONTENT, supporting Range requests (unless `accept_ranges` is False). The
+    first `failures` responses are cut after `cut_after` bytes."""
+
+    failures = 0
+    cut_after = 100000
+    accept_ranges = True
+    ranges = []
+
+    def do_GET(self):
+        start = 0
+        end = len(CONTENT) - 1
+        range_header = self.headers.get("Range")
+        with LOCK:
+            FileHandler.ranges.append(range_header)
+        if range_header and FileHandler.accept_ranges:
+            start, _, last = range_header.split("=")[1].partition("-")
+            start = int(start)
+            end = int(last) if last else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(CONTENT)}")
+        else:
+            self.send_response(200)
+        body = CONTENT[start:end + 1]
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        with LOCK:
+            fail = FileHandler.failures > 0 and len(body) > FileHandler.cut_after
+            if fail:
+                FileHandler.failures -= 1
+        if fail:
+            self.wfile.write(body[:FileHandler.cut_after])
+            self.wfile.flush()
+            self.connection.close()
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # small chunks, so that all the bytes received before an interruption are written
+    monkeypatch.setattr("bba_data_fetch.download.DOWNLOAD_BUFFER_SIZE", 10000)
+    FileHandler.failures = 0
+    FileHandler.cut_after = 100000
+    FileHandler.accept_ranges = True
+    FileHandler.ranges = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/file"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_getFileUrl():
+
+    assert getFileUrl("https://env/v1", "bbp", "atlas", "https://some/id") == (
+        "https://env/v1/files/bbp/atlas/https%3A%2F%2Fsome%2Fid"
+    )
+
+
+def test_getSession():
+
+    session = getSession("token")
+    assert session is getSession("token")
+    assert session is not getSession("other token")
+    # the downloads by segments need a larger pool
+    larger_session = getSession("token", 40)
+    assert larger_session is not session
+    assert larger_session.get_adapter("https://env")._pool_maxsize == 40
+    assert session.headers["Authorization"] == "Bearer token"
+
+
+def test_downloadFile(server, tmp_path):
+
+    out_filepath = str(tmp_path / "file.nrrd")
+    downloadFile(requests.Session(), server, out_filepath, "SHA-256", DIGEST)
+    with open(out_filepath, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(out_filepath + ".part")
+    assert FileHandler.ranges == [None]
+
+
+def test_downloadFile_resume(server, tmp_path, monkeypatch):
+    monkeypatch.setattr("bba_data_fetch.download.time.sleep", lambda s: None)
+
+    # the transfer is cut twice, and resumed from where it stopped
+    FileHandler.failures = 2
+    out_filepath = str(tmp_path / "file.nrrd")
+    downloadFile(requests.Session(), server, out_filepath, "SHA-256", DIGEST)
+    with open(out_filepath, "rb") as f:
+        assert f.read() == CONTENT
+    assert FileHandler.ranges[0] is None
+    assert FileHandler.ranges[1].startswith("bytes=")
+    assert len(FileHandler.ranges) == 3
+
+    # a part file left by a previous run is resumed
+    FileHandler.ranges = []
+    with open(out_filepath + ".part", "wb") as f:
+        f.write(CONTENT[:1000])
+    downloadFile(requests.Session(), server, out_filepath, "SHA-256", DIGEST)
+    assert FileHandler.ranges == ["bytes=1000-"]
+    with open(out_filepath, "rb") as f:
+        assert f.read() == CONTENT
+
+    # ...unless it belongs to another file, then the download starts over
+    FileHandler.ranges = []
+    with open(out_filepath + ".part", "wb") as f:
+        f.write(b"something else")
+    downloadFile(requests.Session(), server, out_filepath, "SHA-256", DIGEST)
+    assert FileHandler.ranges == ["bytes=14-", None]
+    with open(out_filepath, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_downloadFile_errors(server, tmp_path, monkeypatch):
+    monkeypatch.setattr("bba_data_fetch.download.time.sleep", lambda s: None)
+    out_filepath = str(tmp_path / "file.nrrd")
+
+    with pytest.raises(DigestMismatchError):
+        downloadFile(requests.Session(), server, out_filepath, "SHA-256", "abcd")
+    assert not os.path.exists(out_filepath)
+    assert not os.path.exists(out_filepath + ".part")
+
+    FileHandler.failures = 3
+    FileHandler.cut_after = 50000
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        downloadFile(
+            requests.Session(), server, out_filepath, "SHA-256", DIGEST, retries=2
+        )
+    assert not os.path.exists(out_filepath)
+    assert os.path.getsize(out_filepath + ".part") == 3 * FileHandler.cut_after
+
+
+def test_downloadSegmented(server, tmp_path, monkeypatch):
+    monkeypatch.setattr("bba_data_fetch.download.time.sleep", lambda s: None)
+    out_filepath = str(tmp_path / "file.nrrd")
+    size = len(CONTENT)
+
+    # the byte ranges are fetched in parallel, and each of them is resumed when cut
+    FileHandler.failures = 1
+    FileHandler.cut_after = 50000
+    downloadSegmented(
+        requests.Session(), server, out_filepath, "SHA-256", DIGEST, size, 3
+    )
+    with open(out_filepath, "rb") as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(out_filepath + ".part")
+    assert FileHandler.ranges[0] == "bytes=0-0"
+    # the cut segment may be resumed before the others are requested
+    assert {
+        "bytes=0-99999",
+        "bytes=100000-199999",
+        "bytes=200000-299999",
+    } < set(FileHandler.ranges[1:])
+    assert len(FileHandler.ranges) == 5
+
+    # the server does not serve byte ranges: one connection is used
+    FileHandler.ranges = []
+    FileHandler.accept_ranges = False
+    downloadSegmented(
+        requests.Session(), server, out_filepath, "SHA-256", DIGEST, size, 3
+    )
+    with open(out_filepath, "rb") as f:
+        assert f.read() == CONTENT
+    assert FileHandler.ranges == ["bytes=0-0", None]
+
+    FileHandler.accept_ranges = True
+    with pytest.raises(DigestMismatchError):
+        downloadSegmented(
+            requests.Session(), server, out_filepath, "SHA-256", "abcd", size, 3
+        )
+    assert not os.path.exists(out_filepath + ".part")
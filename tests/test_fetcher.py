@@ -0,0 +1,208 @@
+import json
+import pytest
+from bba_data_fetch.errors import (
+    DistributionError,
+    FetchError,
+    NoMatchError,
+    OutputError,
+    QueryError,
+    ResourceNotFoundError,
+)
+import bba_data_fetch.fetcher as bba_fetcher
+from bba_data_fetch.fetcher import Fetcher, getVersion
+from tests.fakes import FakeForge, FakeResource
+
+
+def test_getVersion():
+
+    assert getVersion() is None
+    assert getVersion(rev="3") == 3
+    assert getVersion(tag="v1.0") == "v1.0"
+
+
+def test_Fetcher(tmp_path, monkeypatch):
+
+    payloads = {
+        "https://some/id": {"@id": "https://some/id", "name": "layer", "_rev": 2},
+        "https://no/distribution": {"@id": "https://no/distribution"},
+        "https://no/digest": {
+            "@id": "https://no/digest",
+            "distribution": {"name": "f.nrrd", "contentUrl": "https://env/files/f"},
+        },
+    }
+    engine = FakeForge(payloads)
+    fetcher = Fetcher("https://env/", "token", "bbp", "atlas", engine=engine)
+    assert fetcher.args.nexus_env == "https://env"
+    assert fetcher.args.retries == 3
+
+    out_filepath = fetcher.fetchPayload(
+        "https://some/id", str(tmp_path / "sub" / "payload.json"), rev=2
+    )
+    with open(out_filepath) as f:
+        assert json.load(f) == {"name": "layer"}
+    assert engine.versions == [2]
+
+    out_filepath = fetcher.fetchPayload(
+        "https://some/id", str(tmp_path / "payload.json"), keep_meta=True
+    )
+    with open(out_filepath) as f:
+        assert json.load(f) == payloads["https://some/id"]
+
+    # the failures raise typed exceptions
+    with pytest.raises(ResourceNotFoundError):
+        fetcher.retrieve("https://unknown/id")
+    with pytest.raises(ResourceNotFoundError, match="connection refused"):
+        fetcher.retrieve("broken")
+    with pytest.raises(OutputError):
+        fetcher.fetchPayload("https://some/id", str(tmp_path / "payload.txt"))
+    with pytest.raises(DistributionError):
+        fetcher.fetchDistribution("https://no/distribution", str(tmp_path / "f.nrrd"))
+    with pytest.raises(DistributionError, match="no digest"):
+        fetcher.fetchDistribution("https://no/digest", str(tmp_path / "f.nrrd"))
+    with pytest.raises(ResourceNotFoundError, match="Invalid revision"):
+        fetcher.retrieve("https://some/id", rev="abc")
+    assert issubclass(DistributionError, FetchError)
+
+    # so do the failures of the resolution (here, the context cannot be fetched)
+    fetcher = Fetcher("env", "token", "bbp", "atlas", engine=engine)
+    with pytest.raises(QueryError, match="Invalid URL"):
+        fetcher.resolve(["name=layer"])
+    with pytest.raises(QueryError, match="Invalid URL"):
+        list(fetcher.iterResolve(["name=layer"]))
+    with pytest.raises(QueryError, match="Invalid URL"):
+        fetcher.resolveMany([["name=layer"], ["name=other"]])
+
+    # as well as the filters matching nothing
+    monkeypatch.setattr(bba_fetcher, "getFilteredIds", lambda args: [])
+    with pytest.raises(NoMatchError, match="No match for the filter name=layer"):
+        fetcher.resolve(["name=layer"])
+    monkeypatch.setattr(
+        bba_fetcher, "resolveFilterSets", lambda args, filter_sets: [["id"], []]
+    )
+    with pytest.raises(NoMatchError, match="No match for the filter name=other"):
+        fetcher.resolveMany([["name=layer"], ["name=other"]])
+
+    with pytest.raises(TypeError):
+        Fetcher("https://env", "token", "bbp", "atlas", unknown_option=True)
+
+
+class BucketEngine(FakeForge):
+    """Engine of a bucket, recording the retrievals across the buckets or not"""
+
+    def __init__(self, payloads, bucket, retrievals):
+        super().__init__(payloads)
+        self.bucket = bucket
+        self.retrievals = retrievals
+
+    def inBucket(self, org, project):
+        return BucketEngine(self.payloads, f"{org}/{project}", self.retrievals)
+
+    def retrieve(self, id, version=None, cross_bucket=True):
+        self.retrievals.append((self.bucket, cross_bucket))
+        if not cross_bucket and self.bucket != "bbp/cells":
+            return None
+        return FakeResource(self.payloads[id], "https://env/projects/bbp/cells")
+
+
+def test_Fetcher_buckets(tmp_path, monkeypatch):
+    monkeypatch.setattr(bba_fetcher, "BUCKETS_MEMO", {})
+    payloads = {"https://some/id": {"@id": "https://some/id"}}
+    retrievals = []
+    engine = BucketEngine(payloads, "bbp/atlas", retrievals)
+    fetcher = Fetcher(
+        "https://env", "token", "bbp", "atlas", engine=engine, cache_dir=str(tmp_path)
+    )
+
+    # resolved across the buckets the first time, then read from its own bucket,
+    # including by the next runs
+    fetcher.retrieve("https://some/id")
+    fetcher.retrieve("https://some/id")
+    monkeypatch.setattr(bba_fetcher, "BUCKETS_MEMO", {})
+    fetcher.retrieve("https://some/id")
+    assert retrievals == [
+        ("bbp/atlas", True), ("bbp/cells", False), ("bbp/cells", False)
+    ]
+
+    # resolved again if it is not in its bucket anymore
+    retrievals.clear()
+    bba_fetcher.BUCKETS_MEMO[next(iter(bba_fetcher.BUCKETS_MEMO))] = ["bbp", "old"]
+    fetcher.retrieve("https://some/id")
+    assert retrievals == [("bbp/old", False), ("bbp/atlas", True)]
+
+    # the buckets are only used with cross_bucket
+    retrievals.clear()
+    fetcher.args.cross_bucket = False
+    with pytest.raises(ResourceNotFoundError):
+        fetcher.retrieve("https://some/id")
+    assert retrievals == [("bbp/atlas", False)]
+
+
+class RevalidatingEngine(FakeForge):
+    """Engine retrieving the resources with their revision, and revalidating them"""
+
+    def __init__(self, payloads):
+        super().__init__(payloads)
+        self.rev = 1
+        self.revalidated = []
+
+    def retrieve(self, id, version=None, cross_bucket=True):
+        self.versions.append(version)
+        res = FakeResource(dict(self.payloads[id.split("?")[0]], _rev=self.rev))
+        res._store_metadata._rev = self.rev
+        return res
+
+    def revalidate(self, res):
+        self.revalidated.append(res.get_identifier())
+        if res._store_metadata._rev == self.rev:
+            return res
+        return self.retrieve(res.get_identifier())
+
+
+def test_Fetcher_payloads(tmp_path, monkeypatch):
+    monkeypatch.setattr(bba_fetcher, "PAYLOADS_MEMO", {})
+    payloads = {"https://some/id": {"@id": "https://some/id"}}
+    engine = RevalidatingEngine(payloads)
+    fetcher = Fetcher(
+        "https://env", "token", "bbp", "atlas", engine=engine, cache_dir=str(tmp_path)
+    )
+
+    # the pinned revisions are retrieved once, including by the next runs (once
+    # the token of the run is checked)
+    fetcher.retrieve("https://some/id", tag="v1.0")
+    fetcher.retrieve("https://some/id?tag=v1.0")
+    assert engine.revalidated == []
+    monkeypatch.setattr(bba_fetcher, "PAYLOADS_MEMO", {})
+    res, payload = fetcher.retrieve("https://some/id", tag="v1.0")
+    res, payload = fetcher.retrieve("https://some/id?tag=v1.0")
+    res, payload = fetcher.retrieve("https://some/id?tag=v1.0")
+    assert engine.versions == ["v1.0", None]
+    assert res.get_identifier() == "https://some/id"
+    assert res._store_metadata._project == "https://env/projects/bbp/atlas"
+    assert payload == {"@id": "https://some/id", "_rev": 1}
+    assert engine.revalidated == ["https://some/id"] * 2
+
+    # a cached payload is not served to a token that cannot read the resource
+    monkeypatch.setattr(bba_fetcher, "PAYLOADS_MEMO", {})
+    monkeypatch.setattr(engine, "revalidate", lambda res: None)
+    fetcher.retrieve("https://some/id", tag="v1.0")
+    assert engine.versions == ["v1.0", None, "v1.0"]
+    monkeypatch.undo()
+    monkeypatch.setattr(bba_fetcher, "PAYLOADS_MEMO", {})
+
+    # the latest revision is revalidated, and retrieved again once it changed
+    engine.versions.clear()
+    engine.revalidated.clear()
+    fetcher.retrieve("https://some/id")
+    res, payload = fetcher.retrieve("https://some/id")
+    assert engine.versions == [None]
+    engine.rev = 2
+    res, payload = fetcher.retrieve("https://some/id")
+    assert payload["_rev"] == 2
+    res, payload = fetcher.retrieve("https://some/id")
+    assert payload["_rev"] == 2
+    assert engine.versions == [None, None]
+    assert engine.revalidated == ["https://some/id"] * 3
+
+    # the cached payloads can be modified by the caller
+    payload["name"] = "modified"
+    assert "name" not in fetcher.retrieve("https://some/id")[1]
@@ -1,16 +1,32 @@
 import os
+import json
+import logging
 import pytest
-import requests
 from bba_data_fetch.main import (
     randomString,
     extractListIndexFromPropName,
     createRestFirstSequence,
     translateFilters,
     buildSparqlQuery,
+    buildCanonicalSparqlQuery,
+    queryFingerprint,
+    buildLowercaseContextLut,
+    extractContext,
+    getContext,
     getFilteredIds,
+    iterFilteredIds,
+    normalizeFilters,
+    getJobs,
+    getContentSize,
+    fetchResource,
+    runBatch,
+    runAllMatches,
     parse_args,
     main,
 )
+from bba_data_fetch.errors import QueryError
+from bba_data_fetch.query import iterFilteredMatches, resolveFilterSets
+from tests.fakes import FakeForge
 
 test_folder = os.environ["TEST_FOLDER"]
 
@@ -89,7 +105,7 @@ def test_buildSparqlQuery():
         "SELECT ?s\n"
         "WHERE {\n"
         "\t?s property/name ?dbgxf .\n"
-        '\tFILTER(regex(str(?dbgxf), "^Value of property$", "i"))\n}'
+        '\tFILTER(LCASE(STR(?dbgxf)) = "value of property")\n}'
     )
 
     filters = [
@@ -117,11 +133,55 @@ def test_buildSparqlQuery():
         "'prov:Property_2'}}>\n"
         "SELECT ?s\n"
         "WHERE {\n"
-        "\t?s property/name ?dbgxf .\n"
         "\t?s a Value of property .\n"
+        "\t?s property/name ?dbgxf .\n"
         "\tFILTER(?dbgxf != Value of property) .\n}"
     )
 
+    # the IRIs are matched exactly, the regex are kept for ~= and the metacharacters
+    filters = [
+        {
+            "id": "aaaaa",
+            "properties": ["nsg:name"],
+            "comparator": "~=",
+            "value": "annot",
+            "value_type": "string",
+        },
+        {
+            "id": "bbbbb",
+            "properties": ["nsg:name"],
+            "comparator": "=",
+            "value": "v1.*",
+            "value_type": "string",
+        },
+        {
+            "id": "ccccc",
+            "properties": ["nsg:name"],
+            "comparator": "!=",
+            "value": 'Say "hi"',
+            "value_type": "string",
+        },
+        {
+            "id": "ddddd",
+            "properties": ["nsg:brainRegion"],
+            "comparator": "=",
+            "value": "http://api.brain-map.org/api/v2/data/Structure/997",
+            "value_type": "string",
+        },
+    ]
+
+    result = buildSparqlQuery(filters, {}, context_when_no_context)
+    assert result.endswith(
+        "WHERE {\n"
+        "\t?s nsg:brainRegion <http://api.brain-map.org/api/v2/data/Structure/997> .\n"
+        "\t?s nsg:name ?ccccc .\n"
+        "\t?s nsg:name ?aaaaa .\n"
+        "\t?s nsg:name ?bbbbb .\n"
+        '\tFILTER(!STRSTARTS(LCASE(STR(?ccccc)), "say \\"hi\\""))\n'
+        '\tFILTER(regex(str(?aaaaa), "annot", "i"))\n'
+        '\tFILTER(regex(str(?bbbbb), "^v1.*$", "i"))\n}'
+    )
+
     filters = []
 
     result = buildSparqlQuery(filters, context, context_when_no_context)
@@ -207,6 +267,132 @@ def test_translateFilters():
     assert context_mappers == {"rdf": "adress/syntax"}
 
 
+def test_extractContext():
+
+    context = {"type": {"@id": "rdf:type"}}
+    assert extractContext({"@context": context}) == context
+    assert extractContext({"@context": ["https://some/context", context]}) == context
+    assert extractContext({"@context": "https://some/context"}) is None
+
+
+def test_getContext(tmp_path, monkeypatch):
+    import bba_data_fetch.query as bba_query
+
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        test_folder,
+        "--filter",
+        'property.name="data"',
+        "--cache-dir",
+        str(tmp_path),
+    ]
+    args = parse_args(list_of_args)
+
+    context = {"Type": {"@id": "rdf:type"}, "rdf": "adress/syntax"}
+    requests_etags = []
+
+    def fetchContextPayload(args, etag=None):
+        requests_etags.append(etag)
+        if etag == '"rev-1"':
+            return None, etag
+        return {"@context": context, "_rev": 1}, '"rev-1"'
+
+    monkeypatch.setattr(bba_query, "fetchContextPayload", fetchContextPayload)
+    monkeypatch.setattr(bba_query, "CONTEXT_MEMO", {})
+
+    expected = (context, {"type": "Type", "rdf": "rdf"})
+    assert buildLowercaseContextLut(context) == expected[1]
+
+    assert getContext(args) == expected
+    assert requests_etags == [None]
+
+    # from the memory, then from the disk cache, as long as it is recent enough
+    assert getContext(args) == expected
+    monkeypatch.setattr(bba_query, "CONTEXT_MEMO", {})
+    assert getContext(args) == expected
+    assert requests_etags == [None]
+
+    # revalidated with a conditional request once the TTL is over
+    args.context_ttl = 0
+    monkeypatch.setattr(bba_query, "CONTEXT_MEMO", {})
+    assert getContext(args) == expected
+    assert requests_etags == [None, '"rev-1"']
+
+
+def test_buildCanonicalSparqlQuery():
+
+    context = {
+        "name": {"@id": "nsg:name"},
+        "resolution": {"@id": "nsg:resolution"},
+        "value": {"@id": "schema:value"},
+        "type": {"@id": "rdf:type"},
+        "Entity": {"@id": "prov:Entity"},
+        "nsg": "https://neuroshapes.org/",
+        "schema": "http://schema.org/",
+        "prov": "http://www.w3.org/ns/prov#",
+        "rdf": "adress/syntax",
+    }
+    context_when_no_context = "env/resources/org/proj/_/"
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        test_folder,
+        "--filter",
+        "type=Entity",
+        "name=data",
+        "resolution.value=10",
+    ]
+    args = parse_args(list_of_args)
+    (filters, context_mappers) = translateFilters(args, context)
+    query = buildCanonicalSparqlQuery(filters, context_mappers, context_when_no_context)
+
+    assert query == (
+        "PREFIX unknown: <env/resources/org/proj/_/>\n"
+        "PREFIX nsg: <https://neuroshapes.org/>\n"
+        "PREFIX rdf: <adress/syntax>\n"
+        "PREFIX schema: <http://schema.org/>\n"
+        "SELECT ?s\n"
+        "WHERE {\n"
+        "\t?s a prov:Entity .\n"
+        "\t?s nsg:resolution/schema:value ?f1 .\n"
+        "\t?s nsg:name ?f0 .\n"
+        "\tFILTER(?f1 = 10) .\n"
+        '\tFILTER(LCASE(STR(?f0)) = "data")\n}'
+    )
+
+    # same filters, in another order, with duplicates and different cases
+    args.filter = ["Resolution.value=10", "name=data", "TYPE=entity", "name=data"]
+    (filters, context_mappers) = translateFilters(args, context)
+    assert query == buildCanonicalSparqlQuery(
+        filters, context_mappers, context_when_no_context
+    )
+    assert queryFingerprint(query) == queryFingerprint(
+        buildCanonicalSparqlQuery(filters, context_mappers, context_when_no_context)
+    )
+    assert len(queryFingerprint(query)) == 16
+
+    args.filter = ["name=data", "resolution.value=25", "type=Entity"]
+    (filters, context_mappers) = translateFilters(args, context)
+    assert query != buildCanonicalSparqlQuery(
+        filters, context_mappers, context_when_no_context
+    )
+
+
 def test_getFilteredIds():
     list_of_args = [
         "--nexus-token",
@@ -228,7 +414,680 @@ def test_getFilteredIds():
         getFilteredIds(args)
 
 
-def test_main():
+def test_getJobs(tmp_path):
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--manifest",
+        "manifest.json",
+    ]
+    args = parse_args(list_of_args)
+
+    # max_connection from the forge configuration
+    assert getJobs(args) == 5
+
+    args.jobs = 12
+    assert getJobs(args) == 12
+
+    args.jobs = None
+    forge_config = tmp_path / "forge-config.yml"
+    forge_config.write_text("Store:\n  name: BlueBrainNexus\n")
+    args.forge_config = str(forge_config)
+    assert getJobs(args) == 1
+
+    # the configuration is only read once
+    forge_config.write_text("Store:\n  max_connection: 8\n")
+    assert getJobs(args) == 1
+
+
+def test_runBatch(tmp_path, monkeypatch):
+    import json
+    import bba_data_fetch.main as bba_main
+
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps([
+        {"nexus-id": f"id_{i}", "out": str(tmp_path / f"{i}.json"), "payload": i < 2}
+        for i in range(6)
+    ]))
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--manifest",
+        str(manifest),
+        "--jobs",
+        "3",
+    ]
+    args = parse_args(list_of_args)
+
+    forges = []
+    fetched = []
+    prefetched = []
+
+    def createForge(args):
+        forges.append(object())
+        return forges[-1]
+
+    def fetchResource(args, id, forge):
+        # only the payloads are retrieved with the forge, both serving the resources
+        # retrieved at once
+        if args.prefetch:
+            assert forge.resources == {"id_0": "resource"}
+            forge = forge.engine
+        if args.payload:
+            assert forge is forges[-1]
+        else:
+            assert isinstance(forge, bba_main.NexusClient)
+        fetched.append((id, args.out))
+
+    def prefetchResources(args, client, ids):
+        prefetched.append(ids)
+        return {"id_0": "resource"}
+
+    monkeypatch.setattr(bba_main, "createForge", createForge)
+    monkeypatch.setattr(bba_main, "fetchResource", fetchResource)
+    monkeypatch.setattr(bba_main, "prefetchResources", prefetchResources)
+
+    runBatch(parse_args(list_of_args + ["--prefetch"]))
+    assert len(forges) == 1
+    assert sorted(fetched) == [
+        (f"id_{i}", str(tmp_path / f"{i}.json")) for i in range(6)
+    ]
+    assert prefetched == [[f"id_{i}" for i in range(6)]]
+
+    # the resources are retrieved one by one by default
+    fetched.clear()
+    runBatch(args)
+    assert len(fetched) == 6 and len(prefetched) == 1 and len(forges) == 2
+
+    def failingFetchResource(args, id, forge):
+        exit(1)
+
+    monkeypatch.setattr(bba_main, "fetchResource", failingFetchResource)
+    with pytest.raises(SystemExit) as e:
+        runBatch(args)
+    assert e.value.code == 1
+
+
+def test_normalizeFilters():
+
+    filter_1 = {"id": "abcde", "properties": ["nsg:name"], "comparator": "=",
+                "value": "a", "value_type": "string"}
+    filter_2 = {"value": "nsg:Entity", "value_type": "type"}
+    filter_3 = dict(filter_1, id="fghij")
+
+    assert normalizeFilters([filter_1, filter_2]) == normalizeFilters(
+        [filter_2, filter_3, filter_1]
+    )
+    assert normalizeFilters([filter_1]) != normalizeFilters([filter_2])
+
+
+def test_getFilteredIds_cache(tmp_path, monkeypatch):
+    import bba_data_fetch.query as bba_query
+
+    context = {"type": {"@id": "rdf:type"}, "name": {"@id": "nsg:name"},
+               "nsg": "https://neuroshapes.org/", "rdf": "adress/syntax"}
+    queries = []
+
+    def query_sparql(org, proj, query):
+        queries.append(query)
+        return {"results": {"bindings": [{"s": {"value": "id_1"}}]}}
+
+    monkeypatch.setattr(bba_query, "getContext",
+                        lambda args: (context, buildLowercaseContextLut(context)))
+    monkeypatch.setattr("nexussdk.views.query_sparql", query_sparql)
+    monkeypatch.setattr(bba_query, "FILTERS_MEMO", {})
+
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        test_folder,
+        "--cache-dir",
+        str(tmp_path),
+        "--filter",
+        "name=data",
+        "type=Entity",
+    ]
+
+    # not cached by default
+    args = parse_args(list_of_args)
+    assert getFilteredIds(args) == ["id_1"]
+    assert getFilteredIds(args) == ["id_1"]
+    assert len(queries) == 2
+
+    # the same filters, in another order and case, hit the cache
+    args = parse_args(list_of_args + ["--filter-cache-ttl", "3600"])
+    assert getFilteredIds(args) == ["id_1"]
+    args.filter = ["Type=Entity", "NAME=data"]
+    assert getFilteredIds(args) == ["id_1"]
+    assert len(queries) == 3
+
+    # also from the disk
+    monkeypatch.setattr(bba_query, "FILTERS_MEMO", {})
+    assert getFilteredIds(args) == ["id_1"]
+    assert len(queries) == 3
+
+    args.refresh_filters = True
+    assert getFilteredIds(args) == ["id_1"]
+    assert len(queries) == 4
+
+    # the pinned results do not expire
+    args = parse_args(list_of_args + ["--pin-filters", "--filter", "name=other"])
+    assert getFilteredIds(args) == ["id_1"]
+    args.pin_filters = False
+    monkeypatch.setattr(bba_query, "FILTERS_MEMO", {})
+    assert getFilteredIds(args) == ["id_1"]
+    assert len(queries) == 5
+
+
+def test_iterFilteredIds_pages(monkeypatch):
+    import bba_data_fetch.query as bba_query
+
+    context = {"type": {"@id": "rdf:type"}, "rdf": "adress/syntax"}
+    all_ids = [f"id_{i}" for i in range(7)]
+    queries = []
+
+    def query_sparql(org, proj, query):
+        queries.append(query)
+        limit = int(query.split("LIMIT ")[1].split("\n")[0])
+        offset = int(query.split("OFFSET ")[1])
+        page = all_ids[offset:offset + limit]
+        return {"results": {"bindings": [{"s": {"value": id}} for id in page]}}
+
+    monkeypatch.setattr(bba_query, "getContext",
+                        lambda args: (context, buildLowercaseContextLut(context)))
+    monkeypatch.setattr("nexussdk.views.query_sparql", query_sparql)
+
+    args = parse_args([
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        test_folder,
+        "--filter",
+        "type=Entity",
+        "--page-size",
+        "3",
+    ])
+
+    # the ids of a page are yielded before the next page is queried
+    ids = iterFilteredIds(args)
+    assert next(ids) == "id_0"
+    assert len(queries) == 1
+    assert queries[0].endswith("ORDER BY ?s\nLIMIT 3\nOFFSET 0")
+    assert list(ids) == all_ids[1:]
+    assert len(queries) == 3
+
+    # a page size of 0 disables the paging
+    args.page_size = 0
+    queries.clear()
+    monkeypatch.setattr(
+        "nexussdk.views.query_sparql",
+        lambda org, proj, query: queries.append(query) or {
+            "results": {"bindings": [{"s": {"value": "id_0"}}]}
+        },
+    )
+    assert getFilteredIds(args) == ["id_0"]
+    assert "LIMIT" not in queries[0]
+
+
+def test_iterFilteredMatches_in(monkeypatch):
+    import bba_data_fetch.query as bba_query
+
+    context = {
+        "type": {"@id": "rdf:type"},
+        "brainRegion": {"@id": "nsg:brainRegion"},
+        "name": {"@id": "nsg:name"},
+        "nsg": "https://neuroshapes.org/",
+        "mba": "http://api.brain-map.org/api/v2/data/Structure/",
+        "rdf": "adress/syntax",
+    }
+    mba = context["mba"]
+    queries = []
+
+    def query_sparql(org, proj, query):
+        queries.append(query)
+        return {"results": {"bindings": [
+            {"s": {"value": "id_0"}, "group": {"value": "mba:997"}},
+            {"s": {"value": "id_1"}, "group": {"value": "mba:1048"}},
+            {"s": {"value": "id_1"}, "group": {"value": "mba:997"}},
+        ]}}
+
+    monkeypatch.setattr(bba_query, "getContext",
+                        lambda args: (context, buildLowercaseContextLut(context)))
+    monkeypatch.setattr("nexussdk.views.query_sparql", query_sparql)
+
+    args = parse_args([
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        test_folder,
+        "--filter",
+        "brainRegion=in(mba:997, mba:1048,mba:997)",
+        "name=in(Positions, densities)",
+    ])
+
+    # the values are expanded, sorted and kept as given to group the matches
+    (filters, _) = translateFilters(args, context)
+    assert filters[0]["comparator"] == "in"
+    assert filters[0]["value"] == [mba + "1048", mba + "997"]
+    assert filters[0]["groups"] == ["mba:1048", "mba:997"]
+    assert filters[1]["value"] == ["Positions", "densities"]
+
+    # a single set-membership filter is supported
+    with pytest.raises(QueryError):
+        list(iterFilteredMatches(args))
+
+    # a single query returns the matches of all the values, grouped by value
+    args.filter = ["brainRegion=in(mba:997,mba:1048)"]
+    assert list(iterFilteredMatches(args)) == [
+        ("id_0", "mba:997"),
+        ("id_1", "mba:1048"),
+        ("id_1", "mba:997"),
+    ]
+    assert len(queries) == 1
+    assert "SELECT ?s ?group\n" in queries[0]
+    assert (
+        "\tVALUES (?member ?group) {{ "
+        '(<{0}1048> "mba:1048") (<{0}997> "mba:997") }}\n'
+        "\t?s nsg:brainRegion ?member .\n".format(mba)
+    ) in queries[0]
+    assert "ORDER BY ?s ?group\n" in queries[0]
+    assert getFilteredIds(args) == ["id_0", "id_1"]
+
+    # without paging, the matches are ordered as well, and an id is only yielded once
+    args.page_size = 0
+    queries.clear()
+    monkeypatch.setattr(
+        "nexussdk.views.query_sparql",
+        lambda org, proj, query: queries.append(query) or {"results": {"bindings": [
+            {"s": {"value": "id_1"}, "group": {"value": "mba:1048"}},
+            {"s": {"value": "id_0"}, "group": {"value": "mba:997"}},
+            {"s": {"value": "id_1"}, "group": {"value": "mba:997"}},
+        ]}},
+    )
+    assert getFilteredIds(args) == ["id_1", "id_0"]
+    assert queries[0].endswith("\nORDER BY ?s ?group")
+    assert "LIMIT" not in queries[0]
+    monkeypatch.setattr("nexussdk.views.query_sparql", query_sparql)
+
+    # the strings are compared case-insensitively, the numbers by value
+    args.filter = ["name=in(Positions,densities)", "type=in(Entity)"]
+    (filters, context_mappers) = translateFilters(args, context)
+    query = buildSparqlQuery(filters[:1], context_mappers, "")
+    assert (
+        "\tVALUES (?member ?group) { "
+        '("positions" "Positions") ("densities" "densities") }'
+    ) in query
+    assert "FILTER(LCASE(STR(?{})) = ?member)".format(filters[0]["id"]) in query
+    assert filters[1] == {
+        "comparator": "in",
+        "value": ["unknown:Entity"],
+        "value_type": "type",
+        "groups": ["Entity"],
+    }
+    query = buildSparqlQuery(filters[1:], context_mappers, "")
+    assert '\tVALUES (?member ?group) { (unknown:Entity "Entity") }\n' in query
+    assert "\t?s a ?member .\n" in query
+
+
+def test_resolveFilterSets(monkeypatch):
+    import bba_data_fetch.query as bba_query
+
+    context = {
+        "type": {"@id": "rdf:type"},
+        "name": {"@id": "nsg:name"},
+        "nsg": "https://neuroshapes.org/",
+        "rdf": "adress/syntax",
+    }
+    queries = []
+
+    def query_sparql(org, proj, query):
+        queries.append(query)
+        if "meshes" in query:
+            return {"results": {"bindings": []}}
+        return {"results": {"bindings": [
+            {"s": {"value": "id_0"}, "set": {"value": "0"}},
+            {"s": {"value": "id_1"}, "set": {"value": "0"}},
+            {"s": {"value": "id_2"}, "set": {"value": "2"}},
+        ]}}
+
+    monkeypatch.setattr(bba_query, "getContext",
+                        lambda args: (context, buildLowercaseContextLut(context)))
+    monkeypatch.setattr(bba_query, "FILTERS_MEMO", {})
+    monkeypatch.setattr("nexussdk.views.query_sparql", query_sparql)
+
+    args = parse_args([
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        test_folder,
+        "--filter",
+        "name=unused",
+        "--filter-cache-ttl",
+        "60",
+    ])
+    filter_sets = [["name=annotation"], ["name=hemispheres"], ["name=density"]]
+
+    # the sets are UNION branches tagged with their position, the bindings being
+    # dispatched back to their set
+    assert resolveFilterSets(args, filter_sets) == [["id_0", "id_1"], [], ["id_2"]]
+    assert len(queries) == 1
+    assert queries[0].startswith(
+        "PREFIX unknown: <env/resources/org/proj/_/>\n"
+        "PREFIX nsg: <https://neuroshapes.org/>\n"
+        "SELECT ?s ?set\n"
+        "WHERE {\n"
+        "\t{\n"
+        "\t\tBIND(0 AS ?set)\n"
+        "\t\t?s nsg:name ?s0f0 .\n"
+        '\t\tFILTER(LCASE(STR(?s0f0)) = "annotation")\n'
+        "\t}\n"
+        "\tUNION\n"
+        "\t{\n"
+        "\t\tBIND(1 AS ?set)\n"
+    )
+    assert "ORDER BY ?set ?s\n" in queries[0]
+
+    # the sets resolved with matches are cached, the others are queried again
+    queries.clear()
+    filter_sets.append(["name=meshes"])
+    resolveFilterSets(args, filter_sets)
+    assert "BIND(0 AS ?set)" in queries[0] and "hemispheres" in queries[0]
+    assert "meshes" in queries[0] and "annotation" not in queries[0]
+
+    # auto: the sets Elasticsearch can resolve are resolved with it, one by one
+    es_queries = []
+    monkeypatch.setattr(
+        "nexussdk.views.query_es",
+        lambda org, proj, body, view_id: es_queries.append(body) or {"hits": {"hits": [
+            {"_id": "id_3", "_source": {"@id": "id_3"}, "sort": ["id_3"]}
+        ]}},
+    )
+    monkeypatch.setattr(
+        "nexussdk.views.query_sparql",
+        lambda org, proj, query: queries.append(query) or {"results": {"bindings": [
+            {"s": {"value": "id_0"}, "set": {"value": "0"}}
+        ]}},
+    )
+    queries.clear()
+    args.search_backend = "auto"
+    assert resolveFilterSets(
+        args, [["name=layer"], ["dimension[0].name=intensity"]]
+    ) == [["id_3"], ["id_0"]]
+    assert len(es_queries) == 1 and len(queries) == 1
+    assert "BIND(0 AS ?set)" in queries[0] and "intensity" in queries[0]
+
+
+def test_iterFilteredIds_backends(monkeypatch):
+    import bba_data_fetch.query as bba_query
+
+    context = {
+        "type": {"@id": "rdf:type"},
+        "Entity": {"@id": "prov:Entity"},
+        "bufferEncoding": {"@id": "nsg:bufferEncoding"},
+        "resolution": {"@id": "nsg:resolution"},
+        "value": {"@id": "schema:value"},
+        "prov": "http://www.w3.org/ns/prov#",
+        "nsg": "https://neuroshapes.org/",
+        "schema": "http://schema.org/",
+        "rdf": "adress/syntax",
+    }
+    es_queries = []
+    es_hits = [{"_id": "id_0", "_source": {"@id": "id_0"}, "sort": ["id_0"]}]
+    sparql_queries = []
+
+    def query_es(org, proj, body, view_id):
+        es_queries.append(json.loads(json.dumps(body)))
+        return {"hits": {"hits": es_hits}}
+
+    def query_sparql(org, proj, query):
+        sparql_queries.append(query)
+        return {"results": {"bindings": [{"s": {"value": "id_1"}}]}}
+
+    monkeypatch.setattr(bba_query, "getContext",
+                        lambda args: (context, buildLowercaseContextLut(context)))
+    monkeypatch.setattr("nexussdk.views.query_es", query_es)
+    monkeypatch.setattr("nexussdk.views.query_sparql", query_sparql)
+
+    args = parse_args([
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        test_folder,
+        "--filter",
+        "type=entity",
+        "BUFFERENCODING=gzip",
+        "resolution.value>=10",
+        "--search-backend",
+        "elastic",
+    ])
+
+    # the flat filters are resolved by a term query on the payload properties
+    assert getFilteredIds(args) == ["id_0"]
+    assert es_queries[0]["query"] == {
+        "bool": {
+            "filter": [
+                {"terms": {"@type": [
+                    "entity",
+                    "Entity",
+                    "prov:Entity",
+                    "http://www.w3.org/ns/prov#Entity",
+                ]}},
+                {"term": {"bufferEncoding.keyword": {
+                    "value": "gzip", "case_insensitive": True
+                }}},
+                {"range": {"resolution.value": {"gte": 10}}},
+            ],
+            "must_not": [],
+        }
+    }
+    assert es_queries[0]["sort"] == [{"@id": "asc"}]
+    assert not sparql_queries
+
+    # the negated filters only match the payloads having the property
+    args.filter = ["type=entity", "bufferEncoding!=gzip"]
+    getFilteredIds(args)
+    assert es_queries[1]["query"]["bool"]["filter"][1:] == [
+        {"exists": {"field": "bufferEncoding"}}
+    ]
+    assert es_queries[1]["query"]["bool"]["must_not"] == [
+        {"prefix": {"bufferEncoding.keyword": {
+            "value": "gzip", "case_insensitive": True
+        }}},
+    ]
+    args.filter = ["type=entity", "BUFFERENCODING=gzip", "resolution.value>=10"]
+    es_queries.pop()
+
+    # auto: the dotted filters (maybe a graph traversal, eg. to the brain region
+    # an IRI refers to) and the @list elements are resolved with SPARQL only
+    args.search_backend = "auto"
+    assert getFilteredIds(args) == ["id_1"]
+    assert len(es_queries) == 1 and len(sparql_queries) == 1
+
+    args.filter = ["dimension[0].name=intensity"]
+    assert getFilteredIds(args) == ["id_1"]
+    assert len(es_queries) == 1 and len(sparql_queries) == 2
+
+    # the others with Elasticsearch, even if it matches nothing
+    args.filter = ["type=entity", "BUFFERENCODING=gzip"]
+    es_hits = []
+    assert getFilteredIds(args) == []
+    assert len(es_queries) == 2 and len(sparql_queries) == 2
+
+    args.filter = ["dimension[0].name=intensity"]
+    args.search_backend = "elastic"
+    with pytest.raises(QueryError):
+        getFilteredIds(args)
+
+    # auto: Elasticsearch failing falls back to SPARQL
+    args.search_backend = "auto"
+    args.filter = ["bufferEncoding~=gz"]
+
+    def failing_query_es(org, proj, body, view_id):
+        raise ConnectionError("no view")
+
+    monkeypatch.setattr("nexussdk.views.query_es", failing_query_es)
+    assert getFilteredIds(args) == ["id_1"]
+    assert len(sparql_queries) == 3
+
+
+def test_fetchResource_distribution(tmp_path, monkeypatch, caplog):
+    import hashlib
+    import bba_data_fetch.fetcher as bba_fetcher
+    from bba_data_fetch.errors import DigestMismatchError
+
+    content = b"NRRD0004"
+    distribution = {
+        "name": "annotation.nrrd",
+        "contentUrl": "https://env/files/bbp/atlas/https%3A%2F%2Fsome%2Ffile",
+        "digest": {
+            "algorithm": "SHA-256",
+            "value": hashlib.sha256(content).hexdigest(),
+        },
+    }
+    forge = FakeForge({"id": {"id": "id", "distribution": distribution}})
+    downloads = []
+    metadata_fetches = []
+
+    def downloadFile(session, url, out_filepath, algorithm, digest, **kwargs):
+        downloads.append(url)
+        with open(out_filepath, "wb") as f:
+            f.write(content)
+
+    def fetch(org, proj, file_id, out_filepath=None):
+        metadata_fetches.append((org, proj, file_id))
+        return {"_digest": {"_value": "other"}}
+
+    monkeypatch.setattr(bba_fetcher, "downloadFile", downloadFile)
+    monkeypatch.setattr("nexussdk.files.fetch", fetch)
+
+    out_filepath = str(tmp_path / "annotation.nrrd")
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "https://env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        out_filepath,
+        "--nexus-id",
+        "id",
+    ]
+    args = parse_args(list_of_args)
+
+    # the file is downloaded without fetching its metadata beforehand
+    fetchResource(args, "id", forge)
+    assert downloads == ["https://env/files/bbp/atlas/https%3A%2F%2Fsome%2Ffile"]
+    assert metadata_fetches == []
+
+    # the output is kept as is in incremental mode
+    args.incremental = True
+    with caplog.at_level(logging.INFO):
+        fetchResource(args, "id", forge)
+    assert len(downloads) == 1
+    assert f"File {out_filepath} is up to date" in caplog.text
+    args.incremental = False
+
+    # the output extension must be the one of the distribution
+    args.out = str(tmp_path / "annotation.json")
+    with pytest.raises(SystemExit) as e:
+        fetchResource(args, "id", forge)
+    assert e.value.code == 1
+    args.out = out_filepath
+
+    # a digest mismatch is diagnosed by fetching the metadata of the file
+    def mismatchingDownloadFile(*args, **kwargs):
+        raise DigestMismatchError("mismatch")
+
+    monkeypatch.setattr(bba_fetcher, "downloadFile", mismatchingDownloadFile)
+    with pytest.raises(SystemExit) as e:
+        fetchResource(args, "id", forge)
+    assert e.value.code == 1
+    assert metadata_fetches == [("bbp", "atlas", "https://some/file")]
+
+
+def test_fetchResource_payload(tmp_path):
+    import json
+
+    payload = {"id": "id", "name": "some name", "_rev": 3}
+    forge = FakeForge({"id": payload})
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "https://env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        str(tmp_path / "payload.json"),
+        "--nexus-id",
+        "id",
+        "--payload",
+    ]
+    args = parse_args(list_of_args)
+
+    fetchResource(args, "id", forge)
+    with open(tmp_path / "payload.json") as f:
+        assert json.load(f) == {"id": "id", "name": "some name"}
+
+    args = parse_args(list_of_args + ["--keep-meta"])
+    fetchResource(args, "id", forge)
+    with open(tmp_path / "payload.json") as f:
+        assert json.load(f) == payload
+
+    with pytest.raises(SystemExit) as e:
+        fetchResource(args, "unknown_id", forge)
+    assert e.value.code == 1
+
+
+def test_main(caplog):
 
     # no --filter and --nexus-id args
     list_of_args = [
@@ -305,9 +1164,11 @@ def test_main():
         "--verbose",
     ]
 
-    with pytest.raises(requests.exceptions.MissingSchema) as e:
+    # the failures of the resolution are reported as the other fetch errors
+    with pytest.raises(SystemExit) as e:
         main(list_of_args)
-    assert "Invalid URL" in str(e.value)
+    assert e.value.code == 1
+    assert "Invalid URL" in caplog.text
 
     list_of_args = [
         "--nexus-token",
@@ -329,3 +1190,186 @@ def test_main():
     with pytest.raises(SystemExit) as e:
         main(list_of_args)
     assert e.value.code == 1
+
+
+def test_getContentSize():
+
+    assert getContentSize({"contentSize": {"unitCode": "bytes", "value": 42}}) == 42
+    assert getContentSize({"contentSize": {"value": "42"}}) == 42
+    assert getContentSize({"contentSize": 42}) == 42
+    assert getContentSize({"contentSize": {"unitCode": "MB", "value": 42}}) is None
+    assert getContentSize({}) is None
+
+
+def test_runAllMatches(tmp_path, monkeypatch):
+    import bba_data_fetch.main as bba_main
+
+    out_dir = str(tmp_path / "positions")
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--out",
+        out_dir,
+        "--filter",
+        "type=CellPositions",
+        "--all-matches",
+        "--jobs",
+        "3",
+    ]
+    args = parse_args(list_of_args)
+    assert os.path.isdir(out_dir)
+
+    fetched = []
+    monkeypatch.setattr(
+        "bba_data_fetch.fetcher.iterFilteredMatches",
+        lambda args: [(f"id_{i}", None) for i in range(5)],
+    )
+    monkeypatch.setattr(
+        bba_main,
+        "fetchResource",
+        lambda args, id, forge: fetched.append((os.path.basename(args.out), id)),
+    )
+
+    runAllMatches(args)
+    assert sorted(fetched) == [("positions", f"id_{i}") for i in range(5)]
+
+    # the matches of a set-membership filter are fetched into a directory per value
+    fetched.clear()
+    monkeypatch.setattr(
+        "bba_data_fetch.fetcher.iterFilteredMatches",
+        lambda args: [("id_0", "mba:997"), ("id_1", "mba:997"), ("id_1", "mba:8")],
+    )
+    runAllMatches(args)
+    assert sorted(fetched) == [
+        ("mba:8", "id_1"),
+        ("mba:997", "id_0"),
+        ("mba:997", "id_1"),
+    ]
+    assert os.path.isdir(os.path.join(out_dir, "mba:997"))
+    assert args.out == out_dir
+
+    monkeypatch.setattr(
+        "bba_data_fetch.fetcher.iterFilteredMatches", lambda args: iter([])
+    )
+    with pytest.raises(SystemExit) as e:
+        runAllMatches(args)
+    assert e.value.code == 1
+
+    # --out must be a directory
+    out_file = tmp_path / "file.json"
+    out_file.write_text("{}")
+    list_of_args[list_of_args.index(out_dir)] = str(out_file)
+    with pytest.raises(SystemExit) as e:
+        parse_args(list_of_args)
+    assert e.value.code == 1
+
+
+def test_resolve_locked(tmp_path, monkeypatch):
+    import hashlib
+    import bba_data_fetch.main as bba_main
+    import bba_data_fetch.fetcher as bba_fetcher
+
+    content = b"NRRD0004"
+    distributions = [
+        {
+            "name": f"annotation_{resolution}.nrrd",
+            "contentUrl": f"https://env/files/bbp/atlas/file_{resolution}",
+            "digest": {
+                "algorithm": "SHA-256",
+                "value": hashlib.sha256(content).hexdigest(),
+            },
+        }
+        for resolution in [10, 25]
+    ]
+    payloads = {
+        "annotation": {"id": "annotation", "distribution": distributions},
+        "layer": {"id": "layer", "name": "layer", "_rev": 3},
+    }
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps([
+        {
+            "nexus-id": "annotation",
+            "out": str(tmp_path),
+            "favor": ["name:annotation_25.nrrd"],
+        },
+        {"nexus-id": "layer", "out": str(tmp_path / "layer.json"), "payload": True},
+    ]))
+    lockfile = str(tmp_path / "fetch.lock")
+    list_of_args = [
+        "--nexus-token",
+        "",
+        "--nexus-env",
+        "https://env",
+        "--nexus-org",
+        "org",
+        "--nexus-proj",
+        "proj",
+        "--no-daemon",
+    ]
+    downloads = []
+
+    def downloadFile(session, url, out_filepath, algorithm, digest, **kwargs):
+        downloads.append(url)
+        with open(out_filepath, "wb") as f:
+            f.write(content)
+
+    monkeypatch.setattr(bba_fetcher, "downloadFile", downloadFile)
+    monkeypatch.setattr(bba_main, "buildClient", lambda args: FakeForge(payloads))
+    monkeypatch.setattr(bba_main, "createForge", lambda args: FakeForge(payloads))
+    main(
+        ["resolve", "--lockfile", lockfile, "--manifest", str(manifest)]
+        + list_of_args
+    )
+
+    # the lockfile records the resources, and the distribution chosen with --favor
+    with open(lockfile) as f:
+        lock = json.load(f)
+    assert lock["nexus_env"] == "https://env"
+    assert lock["fetches"] == [
+        {
+            "out": str(tmp_path),
+            "@id": "annotation",
+            "_rev": None,
+            "_project": "https://env/projects/bbp/atlas",
+            "distribution": distributions[1],
+        },
+        {
+            "out": str(tmp_path / "layer.json"),
+            "keep_meta": False,
+            "@id": "layer",
+            "_rev": None,
+            "_project": "https://env/projects/bbp/atlas",
+            "payload": payloads["layer"],
+        },
+    ]
+    assert downloads == []
+
+    # the locked fetches do not query Nexus
+    def noQuery(*args, **kwargs):
+        raise AssertionError("Nexus is queried")
+
+    monkeypatch.setattr(bba_main, "buildClient", noQuery)
+    monkeypatch.setattr(bba_main, "createForge", noQuery)
+    monkeypatch.setattr(bba_fetcher, "buildClient", noQuery)
+    monkeypatch.setattr(bba_fetcher, "buildForge", noQuery)
+    main(list_of_args + ["--locked", lockfile])
+    assert downloads == ["https://env/files/bbp/atlas/file_25"]
+    assert os.path.exists(tmp_path / "annotation")
+    with open(tmp_path / "layer.json") as f:
+        assert json.load(f) == {"id": "layer", "name": "layer"}
+
+    # a lockfile is resolved in a single environment
+    list_of_args[3] = "https://other"
+    with pytest.raises(SystemExit) as e:
+        main(list_of_args + ["--locked", lockfile])
+    assert e.value.code == 1
+
+    with pytest.raises(SystemExit) as e:
+        main(list_of_args + ["--locked", lockfile, "--nexus-id", "layer"])
+    assert e.value.code == 1
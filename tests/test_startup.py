@@ -0,0 +1,46 @@
+import re
+import sys
+import subprocess
+
+# modules that must not be imported by the startup of the CLI
+HEAVY_MODULES = ["kgforge", "nexussdk", "requests", "pkg_resources", "yaml", "pandas"]
+
+# budget of the cumulative import time of the package, in microseconds (it takes
+# about 0.1s, against more than 1s when kgforge and nexussdk are imported)
+IMPORT_TIME_BUDGET = 500000
+
+
+def importTimes(args):
+    """Run python with -X importtime and parse its report
+
+    Returns:
+      dict: the cumulative import time (in microseconds) of each imported module
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        matches = re.match(r"^import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)$", line)
+        if matches:
+            times[matches.group(2)] = int(matches.group(1))
+    return times
+
+
+def test_startup_imports():
+
+    for args in [
+        ["-c", "import bba_data_fetch.main"],
+        ["-m", "bba_data_fetch.main", "--version"],
+        ["-m", "bba_data_fetch.main", "--nexus-id", "id"],
+    ]:
+        times = importTimes(args)
+        assert "bba_data_fetch.main" in times or "bba_data_fetch" in times
+        heavy = [m for m in times if m.split(".")[0] in HEAVY_MODULES]
+        assert heavy == [], f"{args} imports {heavy}"
+
+    times = importTimes(["-c", "import bba_data_fetch.main"])
+    assert times["bba_data_fetch.main"] < IMPORT_TIME_BUDGET